@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare two sets of results written by `run.py`.
+
+    python benchmarks/compare.py before.json after.json [--threshold 1.1]
+
+Exits with a non-zero status if any benchmark got slower than `threshold`
+times its previous timing.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(filename):
+    with open(filename) as fd:
+        report = json.load(fd)
+    return dict(((result['benchmark'], result['size']), result)
+                for result in report['results'] if 'seconds' in result)
+
+
+def compare(args=None):
+    parser = argparse.ArgumentParser(description='Compare two expyre benchmark results.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=1.1,
+            help='Ratio of after/before above which a benchmark is a regression (default: %(default)s)')
+    args = parser.parse_args(args)
+
+    before, after = load(args.before), load(args.after)
+    regressions = 0
+    print('{:<40} {:>7} {:>11} {:>11} {:>7}'.format('benchmark', 'size', 'before', 'after', 'ratio'))
+    for key in sorted(set(before) & set(after), key=lambda key: (key[1], key[0])):
+        old, new = before[key]['seconds'], after[key]['seconds']
+        ratio = new / old if old else float('inf')
+        flag = ''
+        if ratio > args.threshold:
+            regressions += 1
+            flag = '  <- slower'
+        print('{:<40} {:>7} {:>10.4f}s {:>10.4f}s {:>6.2f}x{}'.format(key[0], key[1], old, new, ratio, flag))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(compare())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks for expyre, run against the fake `at` in this directory.
+
+The fake `at` is put first on PATH and its spool is pre-populated with the
+requested number of jobs, a fraction of which are expyre jobs, so that no
+running atd is needed. Results are written as JSON so that runs for
+different commits can be compared with `compare.py`.
+
+    python benchmarks/run.py --sizes 100,10000 --output before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from expyre import helpers                          # noqa: E402
+from expyre.__main__ import main                    # noqa: E402
+
+# - there is no atd to probe for
+helpers.atd_probe._probe = lambda: True
+
+
+# - what atd keeps of a job, and `at -c` shows, as written by the fake `at`
+AT_JOB = """#!/bin/sh
+# atrun uid=0 gid=0
+umask 22
+cd /tmp || exit 1
+${{SHELL:-/bin/sh}} << 'marcinDELIMITER{job_id:08x}'
+{script}
+marcinDELIMITER{job_id:08x}
+"""
+
+
+def populate(spool, size, expyre_ratio):
+    """Fill `spool` with `size` jobs due in a day, `expyre_ratio` of which are expyre jobs"""
+    minutes = int(time.time()) // 60 + 1440
+    when = datetime.fromtimestamp(minutes * 60).strftime('%a %b %e %H:%M:%S %Y')
+    user = os.environ.get('USER') or 'bench'
+    every = max(int(round(1 / expyre_ratio)), 1) if expyre_ratio else 0
+    listing = []
+    for job_id in range(1, size + 1):
+        if every and job_id % every == 0:
+            path = '/bench/dir{:03d}/file{:06d}'.format(job_id % 100, job_id)
+            script = helpers._expiry_script(path, 'now + 1day', True, True, time.time())[0]
+        else:
+            script = 'echo unrelated job {}\n'.format(job_id)
+        with open(os.path.join(spool, 'a{:05x}{:08x}'.format(job_id, minutes)), 'w') as fd:
+            fd.write(AT_JOB.format(job_id=job_id, script=script))
+        listing.append('{}\t{} a {}\n'.format(job_id, when, user))
+    with open(os.path.join(spool, '.list'), 'w') as fd:
+        fd.writelines(listing)
+    with open(os.path.join(spool, '.SEQ'), 'w') as fd:
+        fd.write('{}\n'.format(size))
+
+
+class Bench(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+
+    def calls(self):
+        try:
+            with open(os.environ['FAKE_AT_CALLS']) as fd:
+                return sum(1 for _ in fd)
+        except IOError:
+            return 0
+
+    def measure(self, name, size, func, ops=1, setup=None, **details):
+        """Time `func` over the configured number of repeats, keeping the best run"""
+        timings, calls = [], 0
+        for _ in range(self.args.repeat):
+            if setup:
+                setup()
+            before = self.calls()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            calls = self.calls() - before
+        result = dict(benchmark=name, size=size, seconds=min(timings), per_op=min(timings) / ops,
+                      at_calls=calls, **details)
+        self.results.append(result)
+        sys.stderr.write('{benchmark:<40} {size:>7} {seconds:>10.4f}s {at_calls:>7} at calls\n'.format(**result))
+
+    def skip(self, name, size, reason):
+        self.results.append(dict(benchmark=name, size=size, skipped=reason))
+        sys.stderr.write('{:<40} {:>7} skipped: {}\n'.format(name, size, reason))
+
+    def run(self, size):
+        workdir = tempfile.mkdtemp(prefix='expyre-bench-')
+        spool = os.path.join(workdir, 'spool')
+        os.makedirs(spool)
+        os.environ.update(FAKE_AT_SPOOL=spool, FAKE_AT_CALLS=os.path.join(workdir, 'calls'),
+                          FAKE_AT_LATENCY=str(self.args.latency),
+                          EXPYRE_INDEX=os.path.join(workdir, 'jobs.json'))
+        os.environ.pop('EXPYRE_SPOOL', None)
+        os.environ.pop('EXPYRE_DAEMON', None)
+        try:
+            self._run(size, workdir, spool)
+        finally:
+            shutil.rmtree(workdir)
+
+    def _run(self, size, workdir, spool):
+        populate(spool, size, self.args.expyre_ratio)
+        at_backend = helpers.AtCommandBackend()
+        spool_backend = helpers.SpoolBackend(spool)
+        target = os.path.join(workdir, 'file')
+        open(target, 'w').close()
+        drop_index = lambda: os.path.exists(os.environ['EXPYRE_INDEX']) and os.unlink(os.environ['EXPYRE_INDEX'])
+
+        if size <= self.args.max_forks:
+            self.measure('get_scheduled_jobs[at,cold]', size, setup=drop_index,
+                         func=lambda: helpers.get_scheduled_jobs(backend=at_backend))
+            if self.args.workers:
+                self.measure('get_scheduled_jobs[at,cold,workers]', size, setup=drop_index,
+                             func=lambda: helpers.get_scheduled_jobs(backend=at_backend,
+                                                                     workers=self.args.workers),
+                             workers=self.args.workers)
+        else:
+            self.skip('get_scheduled_jobs[at,cold]', size, 'more than --max-forks jobs')
+
+        helpers.get_scheduled_jobs(backend=at_backend)
+        self.measure('get_scheduled_jobs[at,warm]', size,
+                     func=lambda: helpers.get_scheduled_jobs(backend=at_backend))
+        self.measure('get_scheduled_jobs[at,warm,prefix]', size,
+                     func=lambda: helpers.get_scheduled_jobs('/bench/dir042', backend=at_backend))
+        self.measure('get_scheduled_jobs[spool,cold]', size, setup=drop_index,
+                     func=lambda: helpers.get_scheduled_jobs(backend=spool_backend))
+        self.measure('get_scheduled_jobs[spool,no-index]', size,
+                     func=lambda: helpers.get_scheduled_jobs(backend=spool_backend, use_index=False))
+
+        ops = self.args.ops
+        self.measure('expire_path', size, ops=ops,
+                     func=lambda: [helpers.expire_path(target, 'now + 1day') for _ in range(ops)])
+        self.measure('expire_paths', size, ops=ops,
+                     func=lambda: helpers.expire_paths([target] * ops, 'now + 1day'))
+
+        def open_expiring():
+            for _ in range(ops):
+                with helpers.open_expiring(target, 'now + 1day', True, True, 'w') as fd:
+                    fd.write('data')
+        self.measure('open_expiring', size, ops=ops, func=open_expiring)
+
+        schedule = lambda: helpers.expire_paths(['/bench/removed{}'.format(i) for i in range(ops)], 'now + 1day')
+        self.measure('remove_from_schedule', size, ops=ops, setup=schedule,
+                     func=lambda: helpers.remove_from_schedule(['/bench/removed{}'.format(i) for i in range(ops)],
+                                                               backend=at_backend))
+
+        os.environ['EXPYRE_SPOOL'] = spool
+        self.measure('cli[-l]', size, func=lambda: main(['-l']))
+        self.measure('cli[-L]', size, func=lambda: main(['-L', '/bench/dir042']))
+        self.measure('cli[-l --next 10]', size, func=lambda: main(['-l', '--next', '10']))
+        self.measure('cli[-r]', size, setup=schedule,
+                     func=lambda: main(['-r'] + ['/bench/removed{}'.format(i) for i in range(ops)]))
+        self.measure('cli[-p]', size, func=lambda: main(['-p', target, '@now + 1day']))
+        os.environ.pop('EXPYRE_SPOOL')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(('git', 'rev-parse', 'HEAD'), cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Benchmark expyre against a fake `at`.')
+    parser.add_argument('--sizes', default='100,10000,100000',
+            help='Comma separated numbers of queued jobs to benchmark with (default: %(default)s)')
+    parser.add_argument('--expyre-ratio', type=float, default=0.5,
+            help='Fraction of the queued jobs which are expyre jobs (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0,
+            help='Extra seconds spent by every invocation of the fake `at` (default: %(default)s)')
+    parser.add_argument('--ops', type=int, default=20,
+            help='Number of paths scheduled or removed by the per-path benchmarks (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='Number of runs of every benchmark, the best of which is kept (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8,
+            help='Workers used by the threaded listing benchmark, 0 to skip it (default: %(default)s)')
+    parser.add_argument('--max-forks', type=int, default=20000,
+            help='Skip the benchmarks running `at -c` for every job above this many jobs '
+                 '(default: %(default)s)')
+    parser.add_argument('--output', help='File to write the JSON results to (default: stdout)')
+    return parser.parse_args(args)
+
+
+def run(args=None):
+    args = parse_args(args)
+    bench = Bench(args)
+    # - put the fake `at` first on PATH, for the commands run by the jobs,
+    # and use it rather than the `at` expyre found when it was imported
+    bin_dir = tempfile.mkdtemp(prefix='expyre-bench-bin-')
+    os.symlink(os.path.join(HERE, 'fake_at'), os.path.join(bin_dir, 'at'))
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    helpers.atcmd = os.path.join(bin_dir, 'at')
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            bench.run(size)
+    finally:
+        shutil.rmtree(bin_dir)
+
+    report = {'meta': {'revision': git_revision(), 'python': platform.python_version(),
+                       'platform': platform.platform(), 'date': datetime.now().isoformat(),
+                       'latency': args.latency, 'expyre_ratio': args.expyre_ratio,
+                       'repeat': args.repeat, 'ops': args.ops},
+              'results': bench.results}
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    run()
@@ -4,37 +4,91 @@
 Command-line for the expyre module.
 """
 import argparse
+import heapq
+import itertools
+import json
 import logging
 import os
+import subprocess
 import sys
 from operator import attrgetter
 
 from expyre import __version__
-from .helpers import expire_path, get_scheduled_jobs, remove_from_schedule
+from .helpers import STRATEGIES, JobTable, Stats, add_stats_hook, reap, remove_stats_hook, touched_since
+from .helpers import _check_paths
+from .helpers import dedupe, expire_path, expire_paths, get_scheduled_jobs, iter_scheduled_jobs
+from .helpers import migrate, queue_re, reconcile, remove_from_schedule
+from .quota import enforce_quota, parse_size
+from .sweep import parse_policy, sweep
 
 log = logging.getLogger('expyre')
 
+# - examples of the timespecs understood by at(1), and by `expyre.timespec`
+TIMESPEC_EXAMPLES = ('now+2days', '18:00 tomorrow', '18:00 2017-12-31', '5pm Friday')
+
+
+def _queue_letter(value):
+    if not queue_re.match(value):
+        raise argparse.ArgumentTypeError('invalid at queue {!r}, expected a lowercase letter other than b'
+                                         .format(value))
+    return value
+
+
 def _parse_args(args):
     parser = argparse.ArgumentParser(description="Schedule paths for deletion.", prog='expyre',
                 usage="\n  %(prog)s [-h] [--version]"
-                      "\n  %(prog)s [-m] [-a] -p path @TIMESPEC"
-                      "\n  %(prog)s -l"
-                      "\n  %(prog)s -L [directory]"
-                      "\n  %(prog)s -r path [path ...]",
-                epilog="Timespec examples: "
-                       "now+2days, 18:00 tomorrow, 18:00 2017-12-31, 5pm Friday"
+                      "\n  %(prog)s [--stats] [--stats-file FILE] [--queue X] ..."
+                      "\n  %(prog)s [-m] [-a] [--tree] [--reschedule] [--strategy S] [--rate N] [--nice N] [--ionice]"
+                      " [--trash-dir DIR] -p path @TIMESPEC"
+                      "\n  %(prog)s [scheduling options] --from-stdin [-0] [--json] [--batch-size N] @TIMESPEC"
+                      "\n  %(prog)s [-w N] -l [--stream | --next N]"
+                      "\n  %(prog)s [-w N] -L [directory] [--stream | --next N]"
+                      "\n  %(prog)s [-w N] [-R] -r [path ...] [--from-file FILE | --from-stdin [-0]] [--json]"
+                      "\n  %(prog)s daemon [--socket path] [--journal path]"
+                      "\n  %(prog)s reap [--rate N] path [path ...]"
+                      "\n  %(prog)s check [--accessed-after T] [--modified-after T] [-w N] path"
+                      "\n  %(prog)s dedupe [--queue X] [-w N] [--dry-run]"
+                      "\n  %(prog)s migrate [--queue X] [-w N] [--dry-run]"
+                      "\n  %(prog)s gc [--queue X] [-w N] [--cancel-doomed] [--dry-run]"
+                      "\n  %(prog)s sweep directory --policy SPEC ... (--delete | --at TIMESPEC) [--dry-run]"
+                      "\n  %(prog)s quota directory --max-size SIZE [--low-water SIZE] [--by atime|mtime] [--dry-run]",
+                epilog="Timespec examples: " + ', '.join(TIMESPEC_EXAMPLES)
                        )
 
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('--stats', action='store_true', default=False,
+            help='Print the count and duration of the `at` commands run and the parsing done to stderr')
+    parser.add_argument('--stats-file', metavar='FILE',
+            help='Write the same stats to FILE for the Prometheus node exporter textfile collector')
+    parser.add_argument('--queue', type=_queue_letter, metavar='X',
+            help='Schedule, list and remove expiry jobs in the dedicated at queue X '
+                 '(default: $EXPYRE_QUEUE, else the default queue of at)')
     at_group = parser.add_argument_group('Options for scheduling path expiry')
     atq_group = parser.add_argument_group('Options to query paths scheduled for expiry')
     atrm_group = parser.add_argument_group('Options to remove paths from expiry schedule')
+    batch_group = parser.add_argument_group('Options to schedule or remove many paths at once')
 
     at_group.add_argument('-m', '--unless-modified', action='store_true', default=False,
             help='Do not expire path if modified before scheduled time')
     at_group.add_argument('-a', '--unless-accessed', action='store_true', default=False,
             help='Do not expire path if accessed before scheduled time')
+    at_group.add_argument('--reschedule', dest='replace', action='store_true', default=False,
+            help='Cancel any job already scheduling the path for expiry')
+    at_group.add_argument('--tree', action='store_true', default=False,
+            help='Apply -m and -a to everything under a directory rather than to the directory alone')
     at_group.add_argument('-p', '--path', help='Path to schedule for expiry')
+    at_group.add_argument('--strategy', choices=STRATEGIES, default='rm',
+            help='How to delete the path: rm -rf it, move it to a trash directory and delete it '
+                 'from there in the background (rename-reap), or delete at most --rate files '
+                 'per second (throttled). Default: %(default)s')
+    at_group.add_argument('--rate', type=int, metavar='N',
+            help='Delete at most N files per second with the rename-reap and throttled strategies')
+    at_group.add_argument('--nice', type=int, metavar='N',
+            help='Run the deletion with niceness increment N')
+    at_group.add_argument('--ionice', action='store_true', default=False,
+            help='Run the deletion in the idle I/O scheduling class')
+    at_group.add_argument('--trash-dir', metavar='DIR',
+            help='Trash directory for the rename-reap strategy, on the same filesystem as the path')
     at_group.add_argument('@', metavar='TIMESPEC', nargs=argparse.REMAINDER,
             help='Time specification in the same format as recognized by at(1)')
 
@@ -45,62 +99,523 @@ def _parse_args(args):
                            metavar='directory', default='',
             help='List paths scheduled for expiry within directory')
 
-    atrm_group.add_argument('-r', '--reset', nargs='+', metavar='path',
+    atq_group.add_argument('--stream', action='store_true', default=False,
+            help='Print paths as soon as they are found rather than sorted by expiry time')
+    atq_group.add_argument('--next', type=int, metavar='N',
+            help='Only list the N paths which will expire next')
+    atq_group.add_argument('-w', '--workers', type=int, metavar='N',
+            help='Fetch up to N job scripts concurrently when listing or removing paths')
+
+    atrm_group.add_argument('-r', '--reset', nargs='*', metavar='path',
             help='Remove specified paths from expiry schedule')
+    atrm_group.add_argument('--from-file', metavar='FILE', type=argparse.FileType('r'),
+            help='Also remove the paths listed in FILE, one per line, or read from stdin if FILE is -')
+    atrm_group.add_argument('-R', '--recursive', action='store_true', default=False,
+            help='Also remove every path scheduled for expiry under the specified directories')
+
+    batch_group.add_argument('--from-stdin', action='store_true', default=False,
+            help='Schedule, or with -r remove, the paths read from stdin, one per line')
+    batch_group.add_argument('-0', '--null', action='store_true', default=False,
+            help='Paths read from stdin are terminated by a NUL character, as written by find -print0')
+    batch_group.add_argument('--json', action='store_true', default=False,
+            help='Print the outcome for every path as a line of JSON')
+    batch_group.add_argument('--batch-size', type=int, default=1000, metavar='N',
+            help='Schedule or remove the paths read from stdin N at a time (default: %(default)s)')
 
     args = parser.parse_args(args or sys.argv[1:])
 
+    if args.null and not args.from_stdin:
+        parser.error('-0 can only be used with --from-stdin')
+    if args.reset is not None:
+        # - the paths given after another option following -r, as in
+        # `-r --recursive DIR`, end up in the timespec remainder
+        args.reset.extend(vars(args)['@'])
+        vars(args)['@'] = []
+    if args.from_file:
+        if args.reset is None:
+            parser.error('--from-file can only be used with --reset')
+        if args.from_stdin:
+            parser.error('--from-file can not be used with --from-stdin')
+        with args.from_file as fd:
+            args.reset.extend(line.rstrip('\n') for line in fd if line.strip())
+    if args.reset == [] and not args.from_stdin:
+        parser.error('Missing path')
+
+    # - the tree and deletion strategy options, passed on only when given
+    args.options = dict((option, getattr(args, option))
+                        for option in ('replace', 'tree', 'rate', 'nice', 'ionice', 'trash_dir')
+                        if getattr(args, option))
+    if args.strategy != 'rm':
+        args.options['strategy'] = args.strategy
+    scheduling = any((args.unless_modified, args.unless_accessed, args.path, args.options))
+
     # - arguments from only one arg group can be provided at a time
-    if any(((args.list or args.list_in) and any((args.unless_modified, args.unless_accessed, args.path)),
+    if any(((args.list or args.list_in) and scheduling,
             (args.list or args.list_in) and (args.reset is not None),
-            args.reset and any((args.unless_modified, args.unless_accessed, args.path)),
+            args.reset and scheduling,
+            args.recursive and not args.reset,
+            (args.stream or args.next) and not (args.list or args.list_in),
+            args.stream and args.next,
+            (args.list or args.list_in) and (args.from_stdin or args.json),
             )):
         parser.error("Conflicting options provided; "
                      "you can either schedule paths for deletion or list or reset")
-    if not any((args.list, args.list_in, args.reset)):
+    if not (args.list or args.list_in or args.reset is not None):
         # - if the scheduling options were specified, ensure we have
         # both path and timespec
-        timespec = ''.join(s.strip("@ ") for s in vars(args)['@'])
+        # - the words of an unquoted timespec are separate arguments, which
+        # at(1) needs separated, as in `@5pm Friday`
+        timespec = ' '.join(part for part in (s.strip("@ ") for s in vars(args)['@']) if part)
         args.timespec = timespec
-        if not args.path:
+        if not (args.path or args.from_stdin):
             parser.error('Missing path')
         elif not timespec:
             parser.error('Missing timespec')
     return args
 
 
+def _read_paths(stream, null=False):
+    """Yield the paths read from `stream`, one per line or NUL terminated"""
+    # - read whatever is available rather than waiting for a full buffer, so
+    # that paths are acted upon as soon as a producer like find writes them
+    read = getattr(stream, 'read1', stream.read)
+    fsdecode = getattr(os, 'fsdecode', lambda path: path)
+    separator = '\0' if null else '\n'
+    pending = None
+    while True:
+        data = read(65536)
+        if not data:
+            break
+        if pending is None:
+            pending = data[:0]
+            if isinstance(data, bytes):
+                separator = separator.encode('ascii')
+        paths = (pending + data).split(separator)
+        pending = paths.pop()
+        for path in paths:
+            if path:
+                yield fsdecode(path)
+    if pending:
+        yield fsdecode(pending)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _input_paths(args, paths):
+    """Return the batches of the given paths followed by those read from stdin"""
+    if not args.from_stdin:
+        return [paths]
+    stream = getattr(sys.stdin, 'buffer', sys.stdin)
+    return _batches(itertools.chain(paths, _read_paths(stream, args.null)), max(args.batch_size, 1))
+
+
+# - the errors which fail a batch of paths, rather than the whole command
+BATCH_ERRORS = (RuntimeError, subprocess.CalledProcessError, OSError)
+
+
+def _schedule_paths(args):
+    """Schedule the paths given on the command line or read from stdin,
+    printing the job of every path as it is scheduled and the paths which
+    could not be at the end.
+    """
+    failed = []
+    for batch in _input_paths(args, [args.path] if args.path else []):
+        if args.from_stdin:
+            # - paths which can't be scheduled at all fail on their own
+            # rather than with the rest of their batch
+            valid = []
+            for path in batch:
+                try:
+                    _check_paths([path])
+                except RuntimeError as exc:
+                    failed.append((path, str(exc)))
+                    continue
+                valid.append(path)
+            batch = valid
+            if not batch:
+                continue
+        try:
+            if not args.from_stdin:
+                jobs = [expire_path(args.path, args.timespec, args.unless_modified, args.unless_accessed,
+                                    **args.options)]
+            else:
+                jobs = expire_paths(batch, args.timespec, args.unless_modified, args.unless_accessed,
+                                    batch_size=args.batch_size, **args.options)
+        except BATCH_ERRORS as exc:
+            if not args.from_stdin and isinstance(exc, RuntimeError):
+                raise
+            log.debug('could not schedule %d paths: %s', len(batch), exc)
+            failed.extend((path, str(exc)) for path in batch)
+            continue
+        for job in jobs:
+            if args.json:
+                print(json.dumps({'path': job.path, 'status': 'scheduled', 'job_id': job.job_id,
+                                  'timestamp': job.timestamp.isoformat()}))
+            else:
+                print('[{0.job_id}] {0.path} will expire at {0.timestamp:%F %R}'.format(job))
+        sys.stdout.flush()
+    if failed and not args.json:
+        print('Failed to schedule these paths for expiry:')
+    for path, error in failed:
+        print(json.dumps({'path': path, 'status': 'failed', 'error': error}) if args.json
+              else '{}: {}'.format(path, error))
+    return 0 if not failed else -1
+
+
+def _remove_paths(args, query_opts):
+    """Remove the paths given on the command line or read from stdin from the
+    schedule, printing the paths as they are removed and those which could
+    not be at the end.
+    """
+    failed = []
+    if not args.json:
+        print('Successfully removed these paths from expiry list:')
+    for batch in _input_paths(args, args.reset):
+        try:
+            success, failure = remove_from_schedule(batch, **query_opts)
+        except BATCH_ERRORS as exc:
+            if not args.from_stdin and isinstance(exc, RuntimeError):
+                raise
+            log.debug('could not remove %d paths: %s', len(batch), exc)
+            success, failure = [], batch
+        failed.extend(failure)
+        for path in success:
+            print(json.dumps({'path': path, 'status': 'removed'}) if args.json else path)
+        sys.stdout.flush()
+    if failed and not args.json:
+        print('Failed to remove these paths from expiry list:')
+    for path in failed:
+        print(json.dumps({'path': path, 'status': 'failed'}) if args.json else path)
+    return 0 if not failed else -1
+
+
+def _daemon_main(args):
+    parser = argparse.ArgumentParser(prog='expyre daemon',
+                description="Run the expyre daemon, which schedules expiry jobs without atd. "
+                            "Clients use it when EXPYRE_DAEMON is set to its socket path.")
+    parser.add_argument('--socket', help='Path of the Unix socket to listen on')
+    parser.add_argument('--journal', help='Path of the journal in which jobs are persisted')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+            help='Log every expired path')
+    args = parser.parse_args(args)
+
+    from .daemon import run
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    run(args.socket, args.journal)
+    return 0
+
+
+def _reap_main(args):
+    parser = argparse.ArgumentParser(prog='expyre reap',
+                description="Delete paths and everything under them, optionally at a limited rate. "
+                            "This is what expiry jobs scheduled with --strategy throttled run.")
+    parser.add_argument('--rate', type=int, metavar='N',
+            help='Delete at most N files and directories per second')
+    parser.add_argument('paths', nargs='+', metavar='path')
+    args = parser.parse_args(args)
+
+    ret = 0
+    for path in args.paths:
+        try:
+            reap(path, args.rate)
+        except OSError as exc:
+            sys.stderr.write('{}\n'.format(exc))
+            ret = 1
+    return ret
+
+
+def _check_main(args):
+    parser = argparse.ArgumentParser(prog='expyre check',
+                description="Exit with status 0 if nothing under path was accessed or modified after "
+                            "the given times (in seconds since the epoch), 1 otherwise. This is what "
+                            "expiry jobs scheduled with --tree run.")
+    parser.add_argument('--accessed-after', type=float, metavar='T')
+    parser.add_argument('--modified-after', type=float, metavar='T')
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+            help='Scan up to N directories concurrently')
+    parser.add_argument('path')
+    args = parser.parse_args(args)
+
+    # - check both conditions in the same walk when they share a timestamp,
+    # as they do in expiry jobs
+    checks = []
+    if args.accessed_after is not None and args.accessed_after == args.modified_after:
+        checks.append((args.accessed_after, True, True))
+    else:
+        if args.accessed_after is not None:
+            checks.append((args.accessed_after, True, False))
+        if args.modified_after is not None:
+            checks.append((args.modified_after, False, True))
+    try:
+        touched = any(touched_since(args.path, timestamp, accessed, modified, args.workers)
+                      for timestamp, accessed, modified in checks)
+    except OSError as exc:
+        sys.stderr.write('{}\n'.format(exc))
+        return 1
+    return 1 if touched else 0
+
+
+def _dedupe_main(args):
+    parser = argparse.ArgumentParser(prog='expyre dedupe',
+                description="Remove the duplicate jobs of paths scheduled for expiry more than once, "
+                            "keeping the most recently scheduled one.")
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+            help='Fetch up to N job scripts concurrently')
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+            help='Only list the duplicate jobs')
+    parser.add_argument('--queue', type=_queue_letter, metavar='X',
+            help='Only look at the jobs in the at queue X (default: $EXPYRE_QUEUE)')
+    args = parser.parse_args(args)
+
+    try:
+        removed, failed = dedupe(workers=args.workers, dry_run=args.dry_run,
+                                 **({'at_queue': args.queue} if args.queue else {}))
+    except RuntimeError as exc:
+        sys.stderr.write(str(exc) + '\n')
+        return -1
+    if not (removed or failed):
+        print('No duplicate expiry jobs')
+    for job in removed:
+        print('{1} [{0.job_id}] {0.path} scheduled to expire at {0.timestamp:%F %R}'.format(
+              job, 'Duplicate' if args.dry_run else 'Removed'))
+    for job in failed:
+        print('Failed to remove [{0.job_id}] {0.path}'.format(job))
+    return 0 if not failed else -1
+
+
+def _migrate_main(args):
+    parser = argparse.ArgumentParser(prog='expyre migrate',
+                description="Move the expiry jobs scheduled in other at queues to the dedicated queue, "
+                            "so that listing and removing paths only needs to look at that queue.")
+    parser.add_argument('--queue', type=_queue_letter, metavar='X',
+            help='The dedicated at queue (default: $EXPYRE_QUEUE)')
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+            help='Fetch up to N job scripts concurrently')
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+            help='Only list the jobs to move')
+    args = parser.parse_args(args)
+
+    try:
+        moved, failed = migrate(args.queue, workers=args.workers, dry_run=args.dry_run)
+    except RuntimeError as exc:
+        sys.stderr.write(str(exc) + '\n')
+        return -1
+    if not (moved or failed):
+        print('No expiry jobs to move')
+    for job in moved:
+        print('{1} [{0.job_id}] {0.path} scheduled to expire at {0.timestamp:%F %R}'.format(
+              job, 'To move' if args.dry_run else 'Moved'))
+    for job in failed:
+        print('Failed to move [{0.job_id}] {0.path}'.format(job))
+    return 0 if not failed else -1
+
+
+def _gc_main(args):
+    parser = argparse.ArgumentParser(prog='expyre gc',
+                description="Remove the paths which no longer exist from the schedule, and list those "
+                            "which will not be expired because they were accessed or modified since "
+                            "they were scheduled.")
+    parser.add_argument('--queue', type=_queue_letter, metavar='X',
+            help='Only look at the jobs in the at queue X (default: $EXPYRE_QUEUE)')
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+            help='Fetch up to N job scripts and check up to N paths concurrently')
+    parser.add_argument('--cancel-doomed', action='store_true', default=False,
+            help='Also remove the paths which will not be expired because of their conditions')
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+            help='Only list the paths to remove')
+    args = parser.parse_args(args)
+
+    try:
+        result = reconcile(workers=args.workers, dry_run=args.dry_run, cancel_doomed=args.cancel_doomed,
+                           **({'at_queue': args.queue} if args.queue else {}))
+    except RuntimeError as exc:
+        sys.stderr.write(str(exc) + '\n')
+        return -1
+    for job in result.missing:
+        print('Missing [{0.job_id}] {0.path}'.format(job))
+    for job in result.doomed:
+        print('Doomed [{0.job_id}] {0.path} ({0.conditions})'.format(job))
+    for job in result.failed:
+        print('Failed to remove [{0.job_id}] {0.path}'.format(job))
+    cancelled = len(result.missing) + len(result.doomed if args.cancel_doomed else [])
+    if args.dry_run:
+        sys.stderr.write('Would cancel {} of {} scheduled paths\n'.format(cancelled, result.paths))
+    else:
+        sys.stderr.write('Cancelled {} of {} scheduled paths, the queue shrank from {} to {} jobs\n'.format(
+                         len(result.removed), result.paths, result.jobs, result.jobs_left))
+    return 0 if not result.failed else -1
+
+
+def _sweep_main(args):
+    parser = argparse.ArgumentParser(prog='expyre sweep',
+                description="Delete, or schedule for expiry, the files and directories under a directory "
+                            "matching any of the given policies.",
+                epilog="Policies are written KIND:PATTERN:AGE[:TIMES], where KIND is f for files or d for "
+                       "directories, PATTERN a glob matched against names, AGE a duration such as 30m, 2d "
+                       "or 1w and TIMES some of atime,mtime,ctime (default: mtime) which must all be older "
+                       "than AGE. For directories, everything under them is checked. "
+                       "Eg. --policy 'f:*.tmp:2d' --policy 'd:*:7d'")
+    parser.add_argument('directory')
+    parser.add_argument('--policy', dest='policies', action='append', required=True, metavar='SPEC',
+            help='Policy to apply, the first matching policy applies to a path')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--delete', action='store_true', default=False,
+            help='Delete the matching paths right away')
+    action.add_argument('--at', metavar='TIMESPEC',
+            help='Schedule the matching paths for expiry at TIMESPEC')
+    parser.add_argument('-m', '--unless-modified', action='store_true', default=False,
+            help='Do not expire scheduled paths if modified before the scheduled time')
+    parser.add_argument('-a', '--unless-accessed', action='store_true', default=False,
+            help='Do not expire scheduled paths if accessed before the scheduled time')
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+            help='Only list the matching paths')
+    parser.add_argument('--state', metavar='FILE',
+            help='Record the progress of the sweep in FILE, and resume from it if it exists')
+    parser.add_argument('-w', '--workers', type=int, metavar='N',
+            help='Walk up to N top-level directories concurrently')
+    args = parser.parse_args(args)
+    if not (args.delete or args.at or args.dry_run):
+        parser.error('either --delete or --at TIMESPEC is required')
+    try:
+        policies = [parse_policy(spec) for spec in args.policies]
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    def on_match(path, policy):
+        print(path)
+        sys.stdout.flush()
+
+    try:
+        result = sweep(args.directory, policies, 'delete' if args.delete else 'schedule',
+                       timespec=args.at or 'now', workers=args.workers, dry_run=args.dry_run,
+                       state_file=args.state, on_match=on_match,
+                       unless_modified=args.unless_modified, unless_accessed=args.unless_accessed)
+    except RuntimeError as exc:
+        sys.stderr.write(str(exc) + '\n')
+        return -1
+    sys.stderr.write('{0.scanned} paths scanned, {0.matched} matched, {0.failed} failed\n'.format(result))
+    return 0 if not result.failed else -1
+
+
+def _quota_main(args):
+    parser = argparse.ArgumentParser(prog='expyre quota',
+                description="Delete the least recently used files under a directory, if they use more "
+                            "than a given size, until they use less than a low-water mark.",
+                epilog="Sizes are a number of bytes, optionally followed by K, M, G, T or P, eg. 500G.")
+    parser.add_argument('directory')
+    parser.add_argument('--max-size', type=parse_size, required=True, metavar='SIZE',
+            help='Size above which files are deleted')
+    parser.add_argument('--low-water', type=parse_size, metavar='SIZE',
+            help='Size below which deleting files stops (default: 90%% of the maximum size)')
+    parser.add_argument('--by', choices=('atime', 'mtime'), default='atime',
+            help='Delete the files least recently accessed or modified first (default: %(default)s)')
+    parser.add_argument('-m', '--unless-modified', action='store_true', default=False,
+            help='Do not delete files modified since the scan')
+    parser.add_argument('-a', '--unless-accessed', action='store_true', default=False,
+            help='Do not delete files accessed since the scan. '
+                 'Without -m or -a, files whose --by time changed since the scan are not deleted')
+    parser.add_argument('--snapshot', metavar='FILE',
+            help='Record the scan in FILE, so that the next scan only lists modified directories')
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+            help='Only list the files which would be deleted')
+    args = parser.parse_args(args)
+    unless_modified, unless_accessed = args.unless_modified, args.unless_accessed
+    if not (unless_modified or unless_accessed):
+        unless_modified, unless_accessed = args.by == 'mtime', args.by == 'atime'
+
+    def on_evict(path, size):
+        print(path)
+        sys.stdout.flush()
+
+    try:
+        result = enforce_quota(args.directory, args.max_size, args.low_water, args.by,
+                               snapshot_file=args.snapshot, unless_modified=unless_modified,
+                               unless_accessed=unless_accessed, dry_run=args.dry_run, on_evict=on_evict)
+    except RuntimeError as exc:
+        sys.stderr.write(str(exc) + '\n')
+        return -1
+    sys.stderr.write('{} bytes used, {} files {} freeing {} bytes, {} skipped\n'.format(
+                     result.usage, len(result.evicted), 'to delete' if args.dry_run else 'deleted',
+                     result.freed, len(result.skipped)))
+    return 0
+
+
+# - subcommands, which are parsed separately from the path scheduling options
+SUBCOMMANDS = {
+    'daemon': _daemon_main,
+    'reap': _reap_main,
+    'check': _check_main,
+    'dedupe': _dedupe_main,
+    'migrate': _migrate_main,
+    'gc': _gc_main,
+    'sweep': _sweep_main,
+    'quota': _quota_main,
+}
+
+
 def main(args=None):
     ret = -1
+    args = args or sys.argv[1:]
+    if args and args[0] in SUBCOMMANDS:
+        return SUBCOMMANDS[args[0]](args[1:])
+    args = _parse_args(args)
+    stats = Stats() if (args.stats or args.stats_file) else None
+    if stats:
+        add_stats_hook(stats)
     try:
-        args = _parse_args(args)
+        query_opts = {'workers': args.workers} if args.workers else {}
+        if args.queue:
+            query_opts['at_queue'] = args.options['at_queue'] = args.queue
         if args.list or args.list_in:
             # - list expiry schedule
-            jobs = get_scheduled_jobs(args.list_in)
-            if not jobs:
+            if args.stream:
+                jobs = iter_scheduled_jobs(args.list_in, **query_opts)
+            elif args.next:
+                jobs = heapq.nsmallest(args.next, iter_scheduled_jobs(args.list_in, **query_opts),
+                                       key=attrgetter('timestamp'))
+            else:
+                jobs = get_scheduled_jobs(args.list_in, **query_opts)
+                jobs = (jobs.by_timestamp() if isinstance(jobs, JobTable)
+                        else sorted(jobs.values(), key=attrgetter('timestamp')))
+            listed = 0
+            for job in jobs:
+                print('{0.path} scheduled to expire at {0.timestamp:%F %R} {0.conditions}'.format(job))
+                sys.stdout.flush()
+                listed += 1
+            if not listed:
                 msg = 'No paths scheduled for expiry{}'.format(' under {}'.format(args.list_in)
                                                                if args.list_in else '')
                 print(msg)
-            for job in sorted(jobs.values(), key=attrgetter('timestamp')):
-                print('{0.path} scheduled to expire at {0.timestamp:%F %R} {0.conditions}'.format(job))
             ret = 0
-        elif args.reset:
+        elif args.reset is not None:
             # - remove path from expiry schedule
-            success, faliure = remove_from_schedule(args.reset)
-            print('Successfully removed these paths from expiry list:')
-            print('\n'.join(success))
-            if faliure:
-                print('Failed to remove these paths from expiry list:')
-                print('\n'.join(faliure))
-            ret = (0 if not faliure else -1)
+            if args.recursive:
+                query_opts['recursive'] = True
+            ret = _remove_paths(args, query_opts)
         else:
             # - schedule path for expiry
-            job = expire_path(args.path, args.timespec, args.unless_modified, args.unless_accessed)
-            print('[{0.job_id}] {0.path} will expire at {0.timestamp:%F %R}'.format(job))
-            ret = 0
+            ret = _schedule_paths(args)
     except RuntimeError as exc:
         sys.stderr.write(str(exc) + '\n')
+    finally:
+        if stats:
+            remove_stats_hook(stats)
+            if args.stats:
+                sys.stderr.write(stats.report())
+            if args.stats_file:
+                stats.write_textfile(args.stats_file)
 
     return ret
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
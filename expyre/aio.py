@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""asyncio versions of the functions in `expyre.helpers`.
+
+The coroutines here run the `at` command with `asyncio.create_subprocess_exec`
+so that they do not block the event loop, and return the same `JobSpec`
+objects and raise the same exceptions as their counterparts in
+`expyre.helpers`. When the `EXPYRE_DAEMON` environment variable is set, they
+run their counterparts, which talk to the expyre daemon, in the default
+executor of the event loop instead.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import subprocess
+import time
+
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from . import helpers
+from .helpers import JobSpec
+from .index import JobIndex
+
+log = logging.getLogger('expyre')
+
+# - maximum number of `at` commands run concurrently when fetching job scripts
+DEFAULT_CONCURRENCY = 16
+
+
+async def _in_executor(func, *args, **kwargs):
+    """Run the blocking `func` in the default executor of the running loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def at_call(*args, input=None):
+    """Run the `at` command with `args`, returning its exit status and output"""
+    process = await asyncio.create_subprocess_exec(
+            helpers.atcmd, *args,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+    stdout, _ = await process.communicate(input.encode('utf-8') if input is not None else None)
+    return process.returncode, stdout.decode('utf-8')
+
+
+async def _at_check_output(*args):
+    returncode, stdout = await at_call(*args)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, helpers.atcmd, stdout)
+    return stdout
+
+
+async def at_submit(script, timespec, queue=None):
+    """Schedule `script` to be run by `at` at `timespec`, in the `queue` letter
+    if given, returning the job id and the time at which it will run.
+    """
+    args = ('-q', queue, timespec) if queue else (timespec,)
+    return helpers._parse_submit_output(*(await at_call(*args, input=script)))
+
+
+async def _at_list(queue=None):
+    listing = await _at_check_output('-l', *(('-q', queue) if queue else ()))
+    return helpers._parse_at_list(job for job in listing.split('\n') if job.strip())
+
+
+async def expire_path(path, timespec, unless_modified=True, unless_accessed=True, **options):
+    """Schedule expiry for a path. See `expyre.helpers.expire_path`."""
+    if helpers.get_daemon():
+        return await _in_executor(helpers.expire_path, path, timespec, unless_modified, unless_accessed,
+                                  **options)
+    path = os.path.abspath(os.path.expanduser(path))
+    helpers._check_paths([path])
+    timespec = timespec.strftime("%R %F") if isinstance(timespec, datetime) else timespec
+    queue = helpers.get_queue(options.pop('at_queue', None))
+    replace = options.pop('replace', False)
+    helpers._check_timespec(timespec)
+
+    script, conditions = helpers._expiry_script(path, timespec, unless_modified, unless_accessed, time.time(),
+                                                **options)
+
+    helpers.pre_exec_check(verify_running=True)
+    # - as with `expyre.helpers.expire_paths`, the previous jobs are only
+    # removed once the path is rescheduled
+    previous = await _job_specs(queue=queue) if replace else []
+    job_id, timestamp = await at_submit(script, timespec, queue)
+    _, to_remove = helpers._removal_plan(previous, [path])
+    if to_remove:
+        failed_jobs = await _apply_removals(to_remove, queue)
+        if failed_jobs:
+            log.warning('could not remove the previous expiry jobs %s', ', '.join(sorted(failed_jobs, key=int)))
+    return JobSpec(job_id, path, timestamp, conditions)
+
+
+async def _parse_job(job_id, semaphore):
+    async with semaphore:
+        try:
+            script = await _at_check_output('-c', job_id)
+        except subprocess.CalledProcessError as exc:
+            log.debug('could not fetch job %s, skipping: %s', job_id, exc)
+            return job_id, False, None
+    return job_id, True, helpers._parse_script(script)
+
+
+async def _job_specs(prefix=None, use_index=True, concurrency=DEFAULT_CONCURRENCY, queue=None):
+    """Return the list of JobSpec for every path in every expyre job"""
+    if prefix:
+        prefix = os.path.abspath(os.path.expanduser(prefix))
+    helpers.pre_exec_check()
+    index = JobIndex.load() if use_index else JobIndex()
+    queued = await _at_list(queue)
+
+    unseen = helpers._unseen_jobs(index, queued)
+    semaphore = asyncio.Semaphore(concurrency)
+    for job_id, fetched, entries in await asyncio.gather(*(_parse_job(job_id, semaphore)
+                                                           for job_id in unseen)):
+        if fetched:
+            index.add(job_id, unseen[job_id], entries)
+
+    job_specs = list(helpers._indexed_jobs(index, queued, prefix))
+    if use_index:
+        index.retain(job.job_id for job in queued)
+        index.save()
+    return job_specs
+
+
+async def get_scheduled_jobs(prefix=None, use_index=True, concurrency=DEFAULT_CONCURRENCY, at_queue=None):
+    """Return a `JobTable` mapping paths to JobSpec for all paths scheduled
+    for expiry.
+
+    The scripts of the jobs missing from the job index are fetched
+    concurrently, with at most `concurrency` `at` commands running at a time.
+    See `expyre.helpers.get_scheduled_jobs` for the other parameters.
+    """
+    if helpers.get_daemon():
+        return await _in_executor(helpers.get_scheduled_jobs, prefix, use_index)
+    return helpers.JobTable(await _job_specs(prefix, use_index, concurrency, helpers.get_queue(at_queue)))
+
+
+async def _rewrite_job(job_spec, keep, queue=None):
+    script = await _at_check_output('-c', job_spec.job_id)
+    blocks = [block for path, _, block in helpers._script_blocks(script) if path in keep]
+    job_id, _ = await at_submit(''.join(blocks), job_spec.timestamp.strftime('%R %F'), queue)
+    log.debug('rescheduled %d paths from job %s as job %s', len(blocks), job_spec.job_id, job_id)
+
+
+async def _remove_jobs(job_ids):
+    """Remove `job_ids` in as few `at -r` invocations as possible. See
+    `expyre.helpers._remove_jobs`.
+    """
+    failed = set()
+    for chunk in helpers.arg_chunks(job_ids, reserved=len(helpers.atcmd or '') + 4):
+        try:
+            output = await _at_check_output('-r', *chunk)
+            log.debug('output: %s', output)
+        except subprocess.CalledProcessError as exc:
+            log.debug('could not remove all of jobs %s: %s', ', '.join(chunk), exc)
+            queued = set(job.job_id for job in await _at_list())
+            failed.update(job_id for job_id in chunk if job_id in queued)
+    return failed
+
+
+async def _apply_removals(to_remove, queue=None):
+    """Remove the jobs in the map returned by `expyre.helpers._job_removals`.
+    See `expyre.helpers._apply_removals`.
+    """
+    # - see `expyre.helpers._apply_removals`
+    queues = {}
+    if not queue and any(keep for _, keep in to_remove.values()):
+        queues = dict((job.job_id, job.queue) for job in await _at_list())
+    failed_jobs, job_ids = set(), []
+    for job_id, (job_spec, keep) in to_remove.items():
+        if keep:
+            try:
+                await _rewrite_job(job_spec, keep, queue or queues.get(job_id))
+            except (subprocess.CalledProcessError, OSError, RuntimeError) as exc:
+                log.debug('could not reschedule the rest of job %s: %s', job_id, exc)
+                failed_jobs.add(job_id)
+                continue
+        job_ids.append(job_id)
+    failed_jobs.update(await _remove_jobs(job_ids))
+    return failed_jobs
+
+
+async def remove_from_schedule(paths, concurrency=DEFAULT_CONCURRENCY, at_queue=None):
+    """Remove paths from the expiry schedule. See `expyre.helpers.remove_from_schedule`."""
+    assert(isinstance(paths, (list, tuple)))
+    if helpers.get_daemon():
+        return await _in_executor(helpers.remove_from_schedule, paths)
+    queue = helpers.get_queue(at_queue)
+    scheduled_jobs, to_remove = helpers._removal_plan(await _job_specs(concurrency=concurrency, queue=queue),
+                                                      paths)
+
+    failed_jobs = await _apply_removals(to_remove, queue)
+    return helpers._removal_result(paths, scheduled_jobs, failed_jobs)
+
+
+@asynccontextmanager
+async def open_expiring(filename, at, unless_modified=True, unless_accessed=True, *args, **options):
+    """An async contextmanager that provides a open file descriptor to a file
+    that will be scheduled for expiry on exit. See `expyre.helpers.open_expiring`.
+    """
+    with open(filename, *args) as fd:
+        yield fd
+    await expire_path(filename, at, unless_modified, unless_accessed, **options)
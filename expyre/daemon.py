@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A small expiry daemon which can be used in place of atd.
+
+The daemon keeps the scheduled expiry jobs in a heap ordered by deadline,
+persists every change to an append-only journal so that no job is lost if
+it crashes, and expires paths itself, evaluating the unless-modified and
+unless-accessed conditions with `os.lstat`. Unlike atd it has second level
+precision and its cost does not grow with the number of queued jobs.
+
+Clients talk to the daemon over a local Unix socket with one JSON request
+and one JSON response per line. `expyre.helpers` uses it instead of atd
+when the `EXPYRE_DAEMON` environment variable names the daemon socket.
+"""
+
+import heapq
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+
+from datetime import datetime
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .helpers import JobSpec, _conditions_string, is_under
+from .index import default_index_path
+from .timespec import parse_timespec, to_epoch
+
+log = logging.getLogger('expyre')
+
+
+def default_socket_path():
+    """Return the path of the daemon socket, from `EXPYRE_DAEMON` or the user's runtime dir"""
+    if os.environ.get('EXPYRE_DAEMON'):
+        return os.path.expanduser(os.environ['EXPYRE_DAEMON'])
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or os.path.dirname(default_index_path())
+    return os.path.join(runtime_dir, 'expyre.sock')
+
+
+def default_journal_path():
+    return os.path.join(os.path.dirname(default_index_path()), 'daemon-journal.jsonl')
+
+
+def resolve_timespec(timespec, now=None):
+    """Return the deadline, in seconds since the epoch, for a datetime, a number
+    of seconds since the epoch or an at(1) timespec, which unlike for at(1)
+    may have increments in seconds, eg. 'now + 30 seconds'.
+    """
+    now = time.time() if now is None else now
+    if isinstance(timespec, datetime):
+        return to_epoch(timespec)
+    if isinstance(timespec, (int, float)):
+        return float(timespec)
+    try:
+        return to_epoch(parse_timespec(timespec, now, seconds=True))
+    except ValueError as exc:
+        log.debug('%s', exc)
+        raise RuntimeError('Timespec not recognized by expyre daemon')
+
+
+class Journal(object):
+    """Append-only, fsync'ed log of the jobs added to and removed from the schedule.
+
+    The journal is replayed on startup, ignoring a partially written last
+    record, and compacted into a snapshot of the live jobs once it holds
+    mostly stale records.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = None
+        self._records = 0
+
+    def replay(self):
+        """Return the map of job id to job of the live jobs recorded in the journal"""
+        jobs = {}
+        try:
+            with open(self.filename) as fd:
+                for line in fd:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.warning('ignoring corrupt record in %s: %r', self.filename, line)
+                        continue
+                    self._records += 1
+                    if record['op'] == 'add':
+                        jobs[record['job']['job_id']] = record['job']
+                    elif record['op'] == 'remove':
+                        jobs.pop(record['job_id'], None)
+        except (IOError, OSError):
+            pass
+        return jobs
+
+    def _open(self):
+        if self._fd is None:
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self._fd = open(self.filename, 'a')
+        return self._fd
+
+    def write(self, records):
+        if not records:
+            return
+        fd = self._open()
+        fd.write(''.join(json.dumps(record) + '\n' for record in records))
+        fd.flush()
+        os.fsync(fd.fileno())
+        self._records += len(records)
+
+    def needs_compaction(self, live):
+        return self._records > 2 * live + 1000
+
+    def compact(self, jobs):
+        """Replace the journal by a snapshot of `jobs`"""
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fd:
+            fd.write(''.join(json.dumps({'op': 'add', 'job': job}) + '\n' for job in jobs))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.rename(tmpname, self.filename)
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        self._records = len(jobs)
+
+
+def expire(job):
+    """Remove the path of `job` unless its conditions say otherwise. Return
+    True if the path was removed.
+    """
+    path = job['path']
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        log.info('%s no longer exists, nothing to expire', path)
+        return False
+    if job['unless_accessed'] and stat.st_atime > job['scheduled_at']:
+        log.info('%s was accessed after %s, not expiring', path, job['scheduled_at'])
+        return False
+    if job['unless_modified'] and stat.st_mtime > job['scheduled_at']:
+        log.info('%s was modified after %s, not expiring', path, job['scheduled_at'])
+        return False
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    except OSError as exc:
+        log.error('could not expire %s: %s', path, exc)
+        return False
+    log.info('expired %s', path)
+    return True
+
+
+class Scheduler(object):
+    """Heap of expiry jobs ordered by deadline.
+
+    Adding a job is O(log n). Cancelling a job only drops it from the map of
+    live jobs and leaves its heap entry to be skipped when it reaches the
+    top; the heap is rebuilt when stale entries outnumber live ones.
+    """
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.jobs = journal.replay()
+        self._heap = [(job['deadline'], int(job_id)) for job_id, job in self.jobs.items()]
+        heapq.heapify(self._heap)
+        self._next_id = max([int(job_id) for job_id in self.jobs] or [0]) + 1
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def add(self, paths, deadline, unless_modified, unless_accessed):
+        now = time.time()
+        with self._cond:
+            jobs = []
+            for path in paths:
+                job = {'job_id': str(self._next_id), 'path': path, 'deadline': deadline,
+                       'scheduled_at': now, 'unless_modified': unless_modified,
+                       'unless_accessed': unless_accessed}
+                self._next_id += 1
+                jobs.append(job)
+            self.journal.write([{'op': 'add', 'job': job} for job in jobs])
+            for job in jobs:
+                self.jobs[job['job_id']] = job
+                heapq.heappush(self._heap, (deadline, int(job['job_id'])))
+            self._cond.notify()
+        return jobs
+
+    def cancel(self, job_ids):
+        with self._cond:
+            cancelled = [job_id for job_id in job_ids if job_id in self.jobs]
+            self.journal.write([{'op': 'remove', 'job_id': job_id} for job_id in cancelled])
+            for job_id in cancelled:
+                del self.jobs[job_id]
+            if len(self._heap) > 2 * len(self.jobs) + 1000:
+                self._heap = [(job['deadline'], int(job_id)) for job_id, job in self.jobs.items()]
+                heapq.heapify(self._heap)
+            self._maybe_compact()
+        return cancelled
+
+    def list(self, prefix=None):
+        with self._cond:
+            jobs = list(self.jobs.values())
+        if prefix:
+            jobs = [job for job in jobs if is_under(job['path'], prefix)]
+        return jobs
+
+    def _maybe_compact(self):
+        if self.journal.needs_compaction(len(self.jobs)):
+            self.journal.compact(list(self.jobs.values()))
+
+    def _pop_due(self):
+        """Wait for and return the next job which is due, or None once stopped"""
+        with self._cond:
+            while not self._stopped:
+                while self._heap and str(self._heap[0][1]) not in self.jobs:
+                    heapq.heappop(self._heap)
+                timeout = (self._heap[0][0] - time.time()) if self._heap else None
+                if timeout is not None and timeout <= 0:
+                    deadline, job_id = heapq.heappop(self._heap)
+                    return self.jobs[str(job_id)]
+                self._cond.wait(timeout)
+
+    def run(self):
+        while True:
+            job = self._pop_due()
+            if job is None:
+                return
+            expire(job)
+            self.cancel([job['job_id']])
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        scheduler = self.server.scheduler
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                op = request['op']
+                if op == 'add':
+                    response = {'jobs': scheduler.add(request['paths'], request['deadline'],
+                                                      request['unless_modified'],
+                                                      request['unless_accessed'])}
+                elif op == 'list':
+                    response = {'jobs': scheduler.list(request.get('prefix'))}
+                elif op == 'cancel':
+                    response = {'cancelled': scheduler.cancel(request['job_ids'])}
+                else:
+                    response = {'error': 'unknown operation {!r}'.format(op)}
+            except (ValueError, KeyError, TypeError) as exc:
+                response = {'error': 'bad request: {}'.format(exc)}
+            except (IOError, OSError) as exc:
+                response = {'error': str(exc)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server exposing a `Scheduler`, whose jobs are run in a
+    background thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, journal_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.scheduler = Scheduler(Journal(journal_path or default_journal_path()))
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._runner = threading.Thread(target=self.scheduler.run, name='expyre-runner')
+        self._runner.daemon = True
+
+    def serve_forever(self, *args, **kwargs):
+        self._runner.start()
+        log.info('expyre daemon listening on %s with %d jobs', self.socket_path, len(self.scheduler.jobs))
+        try:
+            socketserver.UnixStreamServer.serve_forever(self, *args, **kwargs)
+        finally:
+            self.scheduler.stop()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class DaemonClient(object):
+    """Client for the expyre daemon, providing the operations used by `expyre.helpers`"""
+
+    def __init__(self, socket_path=None, timeout=30):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+
+    def _request(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            response = sock.makefile('rb').readline()
+        except (IOError, OSError) as exc:
+            raise RuntimeError('Could not reach the expyre daemon at {}: {}'.format(self.socket_path, exc))
+        finally:
+            sock.close()
+        response = json.loads(response.decode('utf-8'))
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    @staticmethod
+    def _job_spec(job):
+        return JobSpec(job['job_id'], job['path'], datetime.fromtimestamp(job['deadline']),
+                       _conditions_string(job['unless_modified'], job['unless_accessed'], job['scheduled_at']))
+
+    def expire_paths(self, paths, timespec, unless_modified=True, unless_accessed=True):
+        """Schedule expiry for `paths`, returning a list of JobSpec"""
+        response = self._request({'op': 'add', 'paths': list(paths), 'deadline': resolve_timespec(timespec),
+                                  'unless_modified': bool(unless_modified),
+                                  'unless_accessed': bool(unless_accessed)})
+        return [self._job_spec(job) for job in response['jobs']]
+
+    def jobs(self, prefix=None):
+        """Return a list of JobSpec for all jobs, or those for paths under `prefix`"""
+        response = self._request({'op': 'list', 'prefix': prefix})
+        return [self._job_spec(job) for job in sorted(response['jobs'], key=lambda job: int(job['job_id']))]
+
+    def cancel(self, job_ids):
+        """Cancel the jobs with the given ids, returning those which were cancelled"""
+        return self._request({'op': 'cancel', 'job_ids': list(job_ids)})['cancelled']
+
+
+def run(socket_path=None, journal_path=None):
+    """Run the expyre daemon until interrupted or terminated"""
+    server = Daemon(socket_path, journal_path)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
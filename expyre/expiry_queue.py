@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Write-behind scheduling of path expiry.
+
+An `ExpiryQueue` takes the scheduling of expiry jobs off the caller's path:
+paths submitted to it are scheduled by a background thread, which groups the
+paths sharing the same timespec and options into batches scheduled with a
+single call to `expyre.helpers.expire_paths`, and callers get a future for
+the resulting `JobSpec`.
+
+    >>> queue = ExpiryQueue()
+    >>> with open_expiring('/tmp/file', 'now + 1day', True, True, 'w', queue=queue) as fd:
+    ...     fd.write('data')
+    >>> queue.flush()
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+
+from . import helpers
+from .timespec import parse_timespec
+
+try:
+    from concurrent.futures import Future
+except ImportError:
+    Future = None
+
+log = logging.getLogger('expyre')
+
+
+def _due(resolved, timespec):
+    """Return the timespec to schedule a batch with: the minute its paths
+    resolved to when submitted, or 'now' once that minute has passed, and the
+    timespec of its first path if it could not be resolved.
+    """
+    if not isinstance(resolved, datetime):
+        return timespec
+    if resolved <= datetime.now().replace(second=0, microsecond=0):
+        return 'now'
+    return resolved.strftime('%R %F')
+
+
+def _resolved(timespec):
+    """Return the minute at which `timespec` resolves, for the paths expiring
+    at the same minute to share a batch whatever their timespecs, or the
+    timespec itself if it cannot be resolved.
+    """
+    if isinstance(timespec, datetime):
+        return timespec.replace(second=0, microsecond=0)
+    try:
+        return parse_timespec(timespec)
+    except ValueError:
+        return timespec
+
+
+class ExpiryQueue(object):
+    """Schedule path expiry in the background, in batches.
+
+    Paths are batched by the minute at which their timespec resolves when
+    submitted, and each batch is scheduled at that minute, whatever the time it
+    is scheduled at, or with the timespec of its first path if it did not resolve.
+    A batch of paths is scheduled once it holds `max_batch` paths or its first
+    path has been waiting for `max_delay` seconds, whichever comes first, or
+    when `flush()` or `close()` is called. The queue is closed, and so the
+    pending paths scheduled, when the interpreter exits.
+
+    :param int max_batch: Maximum number of paths scheduled in one job.
+        Default: 1000
+    :param float max_delay: Maximum number of seconds a path waits before its
+        batch is scheduled. Default: 1.0
+    """
+
+    def __init__(self, max_batch=1000, max_delay=1.0):
+        if Future is None:
+            raise RuntimeError('ExpiryQueue requires the concurrent.futures module')
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # - map of (resolved timespec, unless_modified, unless_accessed,
+        # options) to the time the first pending path was added, its timespec
+        # and the list of pending (path, future), and the list of (key,
+        # timespec, pending) of the full batches
+        self._groups = OrderedDict()
+        self._full = []
+        self._cond = threading.Condition()
+        self._force = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='expyre-queue')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, path, timespec, unless_modified=True, unless_accessed=True, **options):
+        """Queue a path for expiry. The parameters are those of `expire_path`.
+
+        :return: A future for the `JobSpec` of the path, which is cancelled
+            if the future is cancelled before the path is scheduled.
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        key = (_resolved(timespec), unless_modified, unless_accessed, tuple(sorted(options.items())))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('ExpiryQueue is closed')
+            if key not in self._groups:
+                self._groups[key] = (time.time(), timespec, [])
+                self._cond.notify_all()
+            pending = self._groups[key][2]
+            pending.append((os.path.abspath(os.path.expanduser(path)), future))
+            if len(pending) >= self.max_batch:
+                self._full.append((key,) + self._groups.pop(key)[1:])
+                self._cond.notify_all()
+        return future
+
+    def flush(self):
+        """Schedule all the pending paths and wait until they are scheduled"""
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            while self._force and self._thread.is_alive():
+                self._cond.wait()
+
+    def close(self):
+        """Schedule all the pending paths and stop the background thread"""
+        with self._cond:
+            self._closed = True
+            self._force = True
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        unregister = getattr(atexit, 'unregister', None)
+        if unregister:
+            unregister(self.close)
+
+    def _take_due(self):
+        now = time.time()
+        due, self._full = self._full, []
+        for key in [key for key, (started, _, _) in self._groups.items()
+                    if self._force or now - started >= self.max_delay]:
+            due.append((key,) + self._groups.pop(key)[1:])
+        return due
+
+    def _run(self):
+        with self._cond:
+            while True:
+                due = self._take_due()
+                if due:
+                    self._cond.release()
+                    try:
+                        for key, timespec, pending in due:
+                            self._schedule(key, timespec, pending)
+                    finally:
+                        self._cond.acquire()
+                elif self._groups:
+                    started = min(started for started, _, _ in self._groups.values())
+                    self._cond.wait(max(started + self.max_delay - time.time(), 0))
+                else:
+                    self._force = False
+                    self._cond.notify_all()
+                    if self._closed:
+                        return
+                    self._cond.wait()
+
+    def _schedule(self, key, timespec, pending):
+        resolved, unless_modified, unless_accessed, options = key
+        pending = [(path, future) for path, future in pending if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+        try:
+            job_specs = helpers.expire_paths([path for path, _ in pending], _due(resolved, timespec),
+                                             unless_modified, unless_accessed,
+                                             batch_size=self.max_batch, **dict(options))
+        except Exception as exc:
+            log.warning('could not schedule expiry of %d paths: %s', len(pending), exc)
+            for _, future in pending:
+                future.set_exception(exc)
+            return
+        for (_, future), job_spec in zip(pending, job_specs):
+            future.set_result(job_spec)
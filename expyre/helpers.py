@@ -2,31 +2,73 @@
 # -*- coding: utf-8 -*-
 """Wrapper functions for the `at` commands"""
 
+import bisect
+import errno
 import functools
 import logging
 import os
 import re
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 
-from collections import namedtuple
+from array import array
+from collections import OrderedDict, namedtuple
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
+from stat import S_ISDIR
+
+from .index import JobIndex
+from .timespec import parse_at_time, parse_timespec
 
 try:
     from shutil import which
-    atcmd = which('at')
 except ImportError:
-    try:
-        atcmd = subprocess.check_output(('which', 'at')).strip()
-    except subprocess.CalledProcessError:
-        atcmd = None
+    def which(cmd):
+        try:
+            return subprocess.check_output(('which', cmd)).strip()
+        except subprocess.CalledProcessError:
+            return None
+
+atcmd = which('at')
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 log = logging.getLogger('expyre')
 
 # - Object to represent a scheduled expiry job
 JobSpec = namedtuple('JobSpec', ('job_id', 'path', 'timestamp', 'conditions'))
 
+# - Object to represent an entry in the `at` queue, as returned by the backends
+QueuedJob = namedtuple('QueuedJob', ('job_id', 'timestamp', 'queue'))
+
+# - Object to represent the outcome of `reconcile`: the number of paths and of
+# jobs scheduled, the JobSpec of the paths which no longer exist and of those
+# whose conditions can no longer hold, the JobSpec removed from the schedule
+# and those which could not be, and the number of jobs left
+ReconcileResult = namedtuple('ReconcileResult', ('paths', 'jobs', 'missing', 'doomed', 'removed', 'failed',
+                                                 'jobs_left'))
+
 # - The expiry shell script where the comments serve to identify the job
 # as something that was created by this module.
 SCRIPT_TEMPLATE = """
@@ -45,34 +87,140 @@ SCRIPT_RE = re.compile(SCRIPT_TEMPLATE.format(path=r'(?P<path>.*)',
                                               action=r'(?P<action>.*)$'
                                               ), re.DOTALL)
 
+# - regex to extract the path and conditions_string of every path in a job
+# script, which holds one SCRIPT_TEMPLATE block per path when several paths
+# were scheduled together by `expire_paths`
+BLOCK_RE = re.compile(r'^# expyre path: (?P<path>.*)\n# expyre conditions: (?P<conditions_string>.*)$',
+                      re.MULTILINE)
+
+# - regex to extract the delimiter of the heredoc in which `at -c` shows the
+# script of a job, eg. ${SHELL:-/bin/sh} << 'marcinDELIMITER2b4e1d2f'
+HEREDOC_RE = re.compile(r"<< '(?P<delimiter>[^'\n]+)'$", re.MULTILINE)
+
+# - regex to extract the conditions of a conditions_string
+condition_re = re.compile(r'unless (?P<field>accessed|modified) after (?P<when>\d{2}:\d{2} \d{4}-\d{2}-\d{2})')
+
 # - regex to extract job id and time from the stdout right after scheduling a job
 jobid_re = re.compile(r'^job (?P<job_id>\d+) at (?P<timespec>.*)$', re.MULTILINE)
 
 # - regex to extract job id and other details from `at -l` listing
 job_info_re = re.compile(r'(^\d+)\t(.*) (\w) (\w+)')
 
+# - regex to extract the queue, job number and run time (in minutes since the
+# epoch) from the name of a job file in the atd spool directory
+spool_file_re = re.compile(r'^(?P<queue>[a-zA-Z=])(?P<job_id>[0-9a-f]{5})(?P<minutes>[0-9a-f]{8})$')
+
+# - the letters naming an `at` queue which expiry jobs can use: at(1) runs
+# the jobs of 'b' and of the uppercase queues as batch jobs, when the load
+# allows rather than at their time, and '=' is reserved for running jobs
+queue_re = re.compile(r'^[ac-z]$')
+
+# - locations of the atd spool directory on the common distributions
+SPOOL_DIRS = ('/var/spool/cron/atjobs', '/var/spool/at', '/var/spool/atjobs')
+
+
+class AtdProbe(object):
+    """Check whether the at daemon is running, caching the result for `ttl` seconds.
+
+    The check looks for a live process named `atd` through the atd pidfile or
+    by scanning /proc, and only falls back to running `ps` on systems which
+    have neither.
+    """
+
+    PIDFILES = ('/run/atd.pid', '/var/run/atd.pid')
+
+    def __init__(self, ttl=None):
+        self.ttl = float(os.environ.get('EXPYRE_PROBE_TTL', 60) if ttl is None else ttl)
+        self._running = None
+        self._checked_at = None
+
+    def is_running(self):
+        now = time.time()
+        if self._checked_at is None or now - self._checked_at >= self.ttl:
+            self._running = self._probe()
+            self._checked_at = now
+        return self._running
+
+    def reset(self):
+        """Forget the cached result so that the next check probes again"""
+        self._checked_at = None
+
+    @staticmethod
+    def _is_atd(pid):
+        try:
+            with open('/proc/{}/comm'.format(pid)) as fd:
+                return fd.read().strip() == 'atd'
+        except (IOError, OSError):
+            return False
+
+    def _probe(self):
+        have_proc = os.path.isdir('/proc/self')
+        for pidfile in self.PIDFILES:
+            try:
+                with open(pidfile) as fd:
+                    pid = int(fd.read().strip())
+            except (IOError, OSError, ValueError):
+                continue
+            if have_proc:
+                if self._is_atd(pid):
+                    return True
+                continue
+            try:
+                os.kill(pid, 0)
+                return True
+            except OSError as exc:
+                if exc.errno == errno.EPERM:
+                    return True
+
+        if have_proc:
+            return any(self._is_atd(pid) for pid in os.listdir('/proc') if pid.isdigit())
+
+        try:
+            subprocess.check_output('ps -e | grep atd', shell=True)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+
+atd_probe = AtdProbe()
+
 
 def pre_exec_check(verify_running=False):
+    """Check that the `at` command is available and that atd is running.
+
+    This is called once before running a batch of `at` commands rather than
+    for each of them, with the state of atd being cached by `atd_probe`.
+    """
     if not atcmd:
         raise RuntimeError("Could not find `at` command")
 
     err_msg = ("The at daemon (atd) doesn't appear to be running."
                " Expiry jobs cannot be scheduled or executed if atd is not running")
-    try:
-        output = subprocess.check_output('ps -e | grep atd', shell=True).strip()
-    except:
+    if not atd_probe.is_running():
         if verify_running:
             raise RuntimeError(err_msg)
         else:
             log.warn(err_msg)
 
 
-at_call = functools.partial(subprocess.check_output, preexec_fn=pre_exec_check)
+at_call = subprocess.check_output
+
+
+def get_queue(queue=None):
+    """Return the `at` queue letter of expyre jobs: `queue` if given, else that
+    of the `EXPYRE_QUEUE` environment variable, else None for the default
+    queue of `at`. An empty string is returned as is, meaning every queue.
+    """
+    queue = (os.environ.get('EXPYRE_QUEUE') or None) if queue is None else queue
+    if queue and not queue_re.match(queue):
+        raise RuntimeError('Invalid at queue {!r}, expected a lowercase letter other than b'.format(queue))
+    return queue
 
 
-def at_list():
-    """List of all `at` scheduled jobs"""
-    return [job for job in at_call((atcmd, '-l')).decode('utf-8').split('\n') if job.strip()]
+def at_list(queue=None):
+    """List of all `at` scheduled jobs, or of those in `queue`"""
+    cmd = (atcmd, '-l') + (('-q', queue) if queue else ())
+    return [job for job in at_call(cmd).decode('utf-8').split('\n') if job.strip()]
 
 
 def at_cat(job_id):
@@ -80,12 +228,426 @@ def at_cat(job_id):
     return at_call((atcmd, '-c', job_id)).decode('utf-8')
 
 
-def at_rm(job_id):
-    """Remove the specified `job_id` from the `at` schedule"""
-    return at_call((atcmd, '-r', job_id)).decode('utf-8')
+def at_rm(*job_ids):
+    """Remove the specified `job_ids` from the `at` schedule"""
+    return at_call((atcmd, '-r') + job_ids).decode('utf-8')
+
+
+def arg_chunks(args, reserved=0):
+    """Split `args` into lists that can each be passed on a single command
+    line without exceeding ARG_MAX, `reserved` being the size of the rest
+    of the command line.
+    """
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError, AttributeError):
+        arg_max = 131072
+    # - the environment shares ARG_MAX with the arguments, and every
+    # argument also costs a pointer in argv
+    env_size = sum(len(key) + len(value) + 2 + 8 for key, value in os.environ.items())
+    budget = max(arg_max - env_size - reserved - 4096, 4096)
+
+    chunk, size = [], 0
+    for arg in args:
+        if chunk and size + len(arg) + 1 + 8 > budget:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(arg)
+        size += len(arg) + 1 + 8
+    if chunk:
+        yield chunk
+
+
+def _parse_at_time(timespec):
+    """Return the datetime for a run time as printed by the `at` command"""
+    return parse_at_time(timespec)
+
+
+def _check_timespec(timespec):
+    """Raise the error `at` would for an invalid `timespec`, without running it"""
+    try:
+        parse_timespec(timespec)
+    except ValueError as exc:
+        log.debug('%s', exc)
+        raise RuntimeError('Timespec not recognized by at command')
+
+
+def _parse_at_list(lines):
+    """Return a list of `QueuedJob` from the lines of an `at -l` listing"""
+    queued = []
+    for job in lines:
+        job_id, timespec, queue, user = re.search(job_info_re, job).groups()
+        queued.append(QueuedJob(job_id, _parse_at_time(timespec), queue))
+    return queued
+
+
+class AtCommandBackend(object):
+    """Query the `at` queue using the `at` command, only listing the jobs of
+    the `at_queue` letter if given.
+    """
+
+    name = 'at'
+
+    def __init__(self, at_queue=None):
+        self.at_queue = at_queue
+
+    def jobs(self):
+        """Return a list of `QueuedJob` for all `at` scheduled jobs"""
+        pre_exec_check()
+        return _parse_at_list(at_list(self.at_queue))
+
+    def script(self, job_id):
+        return at_cat(job_id)
+
+    def remove(self, *job_ids):
+        return at_rm(*job_ids)
+
+
+class SpoolBackend(object):
+    """Query the `at` queue by reading the job files in the atd spool directory.
+
+    The name of every job file encodes the queue, the job number and the run
+    time of the job, so a listing is a single directory scan and fetching a
+    job script is a plain file read, with no subprocesses involved. Removing
+    jobs is left to the `at` command, as is reading a job file which turns out
+    not to be readable. Only the jobs of the `at_queue` letter are listed if
+    given.
+    """
+
+    name = 'spool'
+
+    def __init__(self, spool_dir, fallback=None, at_queue=None):
+        self.spool_dir = spool_dir
+        self.at_queue = at_queue
+        self.fallback = fallback or AtCommandBackend(at_queue)
+        self._files = {}
+
+    @staticmethod
+    def available(spool_dir):
+        return os.path.isdir(spool_dir) and os.access(spool_dir, os.R_OK | os.X_OK)
+
+    def jobs(self):
+        """Return a list of `QueuedJob` for the jobs in the spool owned by the current user.
+
+        As with `at -l`, root gets to see the jobs of all users.
+        """
+        uid = os.getuid()
+        queued, self._files = [], {}
+        for entry in scandir(self.spool_dir):
+            match = spool_file_re.match(entry.name)
+            if not match or (self.at_queue and match.group('queue') != self.at_queue):
+                continue
+            try:
+                if uid != 0 and entry.stat().st_uid != uid:
+                    continue
+            except OSError:
+                # - the job was executed or removed under our feet
+                continue
+            job_id = str(int(match.group('job_id'), 16))
+            timestamp = datetime.fromtimestamp(int(match.group('minutes'), 16) * 60)
+            self._files[job_id] = entry.path
+            queued.append(QueuedJob(job_id, timestamp, match.group('queue')))
+        return queued
+
+    def script(self, job_id):
+        if job_id not in self._files:
+            self.jobs()
+        try:
+            with open(self._files[job_id], 'rb') as fd:
+                return fd.read().decode('utf-8')
+        except (KeyError, IOError, OSError) as exc:
+            log.debug('could not read job %s from %s (%s), using `at`', job_id, self.spool_dir, exc)
+            return self.fallback.script(job_id)
+
+    def remove(self, *job_ids):
+        for job_id in job_ids:
+            self._files.pop(job_id, None)
+        return self.fallback.remove(*job_ids)
+
+
+def get_daemon():
+    """Return a `DaemonClient` for the expyre daemon if the `EXPYRE_DAEMON`
+    environment variable is set, in which case the daemon is used instead of
+    atd to schedule, list and remove expiry jobs. Otherwise return None.
+    """
+    if os.environ.get('EXPYRE_DAEMON'):
+        from .daemon import DaemonClient
+        return DaemonClient(os.environ['EXPYRE_DAEMON'])
+    return None
+
+
+def get_backend(queue=None):
+    """Return the backend to use for querying the `at` queue.
+
+    The `SpoolBackend` is used if the atd spool directory (the first of the
+    `EXPYRE_SPOOL` environment variable or `SPOOL_DIRS`) is readable,
+    otherwise the `AtCommandBackend`. Either only lists the jobs of the `at`
+    queue returned by `get_queue(queue)`.
+    """
+    queue = get_queue(queue)
+    spool_dirs = (os.environ['EXPYRE_SPOOL'],) if os.environ.get('EXPYRE_SPOOL') else SPOOL_DIRS
+    if scandir is not None:
+        for spool_dir in spool_dirs:
+            if SpoolBackend.available(spool_dir):
+                return SpoolBackend(spool_dir, at_queue=queue)
+    return AtCommandBackend(queue)
+
+
+def at_submit(script, timespec, queue=None):
+    """Schedule `script` to be run by `at` at `timespec`, in the `queue` letter
+    if given, returning the job id and the time at which it will run.
+    """
+    process = subprocess.Popen([atcmd] + (['-q', queue] if queue else []) + [timespec],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT
+                               )
+    stdout, _ = process.communicate(script.encode('utf-8'))
+    return _parse_submit_output(process.returncode, stdout.decode('utf-8'))
+
+
+def _parse_submit_output(returncode, stdout):
+    """Return the job id and run time from the output of `at` scheduling a job"""
+    log.debug('output: %s', stdout)
+    if returncode != 0:
+        if 'Garbled time' in stdout:
+            raise RuntimeError('Timespec not recognized by at command')
+        else:
+            raise subprocess.CalledProcessError(returncode, atcmd)
+
+    match = jobid_re.search(stdout, re.MULTILINE)
+    return match.group('job_id'), _parse_at_time(match.group('timespec'))
+
+
+# - the ways in which an expiry job can delete a path:
+#   rm: `rm -rf` the path
+#   rename-reap: atomically move the path into a trash directory on the same
+#     filesystem and delete it from there in the background
+#   throttled: delete the files under the path at a limited rate
+STRATEGIES = ('rm', 'rename-reap', 'throttled')
+
+# - files deleted per second by the throttled strategy when no rate is given
+DEFAULT_REAP_RATE = 1000
+
+# - name of the trash directory created next to the paths expired with the
+# rename-reap strategy when no trash directory is given
+TRASH_DIR = '.expyre-trash'
+
+
+def _deletion_action(path, strategy='rm', rate=None, nice=None, ionice=False, trash_dir=None):
+    """Return the shell commands deleting `path` with the given strategy"""
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown deletion strategy {!r}, expected one of {}'.format(
+                         strategy, ', '.join(STRATEGIES)))
+
+    priority = []
+    if ionice:
+        if not which('ionice'):
+            raise RuntimeError("Could not find `ionice` command")
+        priority.append('ionice -c 3')
+    if nice is not None:
+        priority.append('nice -n {:d}'.format(nice))
+    prefix = ''.join(command + ' ' for command in priority)
+
+    if strategy == 'rm':
+        return prefix + 'rm {} {}'.format('-rf' if os.path.isdir(path) else '', quote(path))
+
+    def reaper(target):
+        if strategy == 'throttled' or rate:
+            return '{}{} -m expyre reap --rate {:d} -- {}'.format(
+                   prefix, quote(sys.executable), rate or DEFAULT_REAP_RATE, target)
+        return '{}rm -rf {}'.format(prefix, target)
+
+    if strategy == 'throttled':
+        return reaper(quote(path))
+
+    # - the rename is only atomic (and cheap) within a filesystem, otherwise
+    # the path is deleted in place
+    trash = quote(trash_dir or os.path.join(os.path.dirname(path), TRASH_DIR))
+    return ('if mkdir -p {trash} && [ "$(stat -c %d {trash})" = "$(stat -c %d {path})" ] &&\n'
+            '        reap_dir="$(mktemp -d {trash}/expyre.XXXXXX)" && mv {path} "$reap_dir"/; then\n'
+            '        ({reap_dir} >/dev/null 2>&1 &)\n'
+            '    else\n'
+            '        {in_place}\n'
+            '    fi').format(trash=trash, path=quote(path),
+                            reap_dir=reaper('"$reap_dir"'), in_place=reaper(quote(path)))
+
+
+def _expiry_script(path, timespec, unless_modified, unless_accessed, now, tree=False, **deletion):
+    """Return the SCRIPT_TEMPLATE block that expires `path` along with its
+    conditions string. `tree` and `deletion` are the options of `expire_path`.
+    """
+    if os.path.isdir(path) and deletion.get('strategy', 'rm') == 'rm':
+        log.warn('Will execute `rm -rf %s` at %s', path, timespec)
+    action = _deletion_action(path, **deletion)
+
+    conditions = []
+    if tree and (unless_accessed or unless_modified) and os.path.isdir(path):
+        conditions.append('{} -m expyre check {}{}-- {}'.format(
+                          quote(sys.executable),
+                          '--accessed-after {:.0f} '.format(now) if unless_accessed else '',
+                          '--modified-after {:.0f} '.format(now) if unless_modified else '',
+                          quote(path)))
+    else:
+        for condition, option in ((unless_accessed, 'X'), (unless_modified, 'Y')):
+            if condition:
+                conditions.append('''[ ! "$(stat -c '%{0}' {1})" -gt {2:.0f} ]'''.format(option, quote(path),
+                                                                                          now))
+    if conditions:
+        conditions.append('')
+
+    as_string = _conditions_string(unless_modified, unless_accessed, now)
+    script = SCRIPT_TEMPLATE.format(path=path,
+                                    action=action,
+                                    conditions_string=as_string,
+                                    conditions=' &&\n'.join(conditions)
+                                    )
+    return script, as_string
+
+
+def reap(path, rate=None):
+    """Delete `path` and everything under it, removing at most `rate` files
+    and directories per second if `rate` is given, so that deleting a large
+    tree does not saturate the disk.
+
+    :return: The number of files and directories removed.
+    :rtype: int
+    :raises OSError: If any of them could not be removed, once all the others
+        have been.
+    """
+    def entries():
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, files in os.walk(path, topdown=False):
+                for name in files:
+                    yield os.unlink, os.path.join(root, name)
+                for name in dirs:
+                    entry = os.path.join(root, name)
+                    yield (os.unlink if os.path.islink(entry) else os.rmdir), entry
+            yield os.rmdir, path
+        else:
+            yield os.unlink, path
+
+    removed, failed, start = 0, [], time.time()
+    for remove, entry in entries():
+        if rate:
+            ahead = removed / float(rate) - (time.time() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+        try:
+            remove(entry)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                log.warn('could not remove %s: %s', entry, exc)
+                failed.append((entry, exc))
+            continue
+        removed += 1
+    if failed:
+        entry, exc = failed[0]
+        raise OSError(exc.errno, 'Could not remove {} of the entries of {}, first {}: {}'.format(
+                      len(failed), path, entry, exc.strerror))
+    return removed
+
+
+def _conditions_string(unless_modified, unless_accessed, now):
+    """Return the human readable description of the expiry conditions"""
+    localtime = datetime.fromtimestamp(now)
+    return ' or '.join('unless {0} after {1:%R %F}'.format(description, localtime)
+                       for condition, description in ((unless_accessed, 'accessed'),
+                                                      (unless_modified, 'modified'))
+                       if condition)
+
+
+def _scan_dir(directory):
+    """Return a list of `(path, stat_result, is_dir)` for the entries of a
+    directory, without following symlinks.
+    """
+    if scandir is None:
+        entries = []
+        for name in os.listdir(directory):
+            entry = os.path.join(directory, name)
+            stat = os.lstat(entry)
+            entries.append((entry, stat, S_ISDIR(stat.st_mode)))
+        return entries
+    return [(entry.path, entry.stat(follow_symlinks=False), entry.is_dir(follow_symlinks=False))
+            for entry in scandir(directory)]
+
+
+def touched_since(path, timestamp, accessed=True, modified=True, workers=None):
+    """Return whether `path` or anything under it was accessed or modified
+    after `timestamp`, stopping at the first such file or directory.
+
+    :param str path: The path to check.
+    :param float timestamp: The time, in seconds since the epoch, to compare
+        access and modification times to.
+    :param bool accessed: Whether to check access times. Default: True
+    :param bool modified: Whether to check modification times. Default: True
+    :param int workers: Scan up to this many directories concurrently, which
+        helps for wide trees. Default: None, scan sequentially
+    :rtype: bool
+    """
+    def newer(stat):
+        return ((accessed and stat.st_atime > timestamp) or
+                (modified and stat.st_mtime > timestamp))
+
+    def scan(directory):
+        # - returns None as soon as a newer entry is found, otherwise the
+        # subdirectories left to scan
+        try:
+            entries = _scan_dir(directory)
+        except OSError as exc:
+            log.debug('could not scan %s: %s', directory, exc)
+            return []
+        subdirs = []
+        for entry, stat, is_dir in entries:
+            if newer(stat):
+                return None
+            if is_dir:
+                subdirs.append(entry)
+        return subdirs
+
+    stat = os.lstat(path)
+    if newer(stat):
+        return True
+    if not S_ISDIR(stat.st_mode):
+        return False
+
+    if workers and workers > 1 and ThreadPoolExecutor is not None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = [path]
+            while pending:
+                found = pool.map(scan, pending)
+                pending = []
+                for subdirs in found:
+                    if subdirs is None:
+                        return True
+                    pending.extend(subdirs)
+        return False
+
+    pending = [path]
+    while pending:
+        subdirs = scan(pending.pop())
+        if subdirs is None:
+            return True
+        pending.extend(subdirs)
+    return False
 
 
-def expire_path(path, timespec, unless_modified=True, unless_accessed=True):
+def _check_daemon_options(options):
+    if options.get('strategy', 'rm') != 'rm' or any(options.get(option) for option in
+                                                    ('rate', 'nice', 'ionice', 'trash_dir', 'tree')):
+        raise RuntimeError('Deletion strategies and tree conditions are not supported by the expyre daemon')
+
+
+def _check_paths(paths):
+    """Raise a RuntimeError if any of `paths` can't be written in a job script"""
+    for path in paths:
+        # - the path is written as is in the `# expyre path:` comment of the
+        # script, so a newline would end the comment
+        if '\n' in path:
+            raise RuntimeError('Paths containing a newline cannot be scheduled for expiry: {!r}'.format(path))
+
+
+def expire_path(path, timespec, unless_modified=True, unless_accessed=True, **options):
     """Schedule expiry for a path and return the job_id for the scheduled task.
 
     :param str path: The path to schedule for expiry. Warning: if the path is a
@@ -97,97 +659,925 @@ def expire_path(path, timespec, unless_modified=True, unless_accessed=True):
     :param bool unless_accessed: Whether a condition has to be added to the job
         expiry script to expire the path only if it has not been accessed since
         it was scheduled for expiry. Default: True
+    :param bool tree: Whether the conditions of a directory check the access
+        and modification times of everything under it, rather than those of
+        the directory alone, by running `python -m expyre check`. Default: False
+    :param str strategy: How the path is deleted, one of `STRATEGIES`:
+        'rm' (`rm -rf`), 'rename-reap' (move the path to a trash directory
+        on the same filesystem and delete it from there in the background) or
+        'throttled' (delete at most `rate` files per second). Default: 'rm'
+    :param int rate: Maximum number of files deleted per second, for the
+        'throttled' and 'rename-reap' strategies. Default: None
+    :param int nice: Run the deletion with this niceness increment. Default: None
+    :param bool ionice: Run the deletion in the idle I/O scheduling class.
+        Default: False
+    :param str trash_dir: The trash directory of the 'rename-reap' strategy.
+        Default: a `.expyre-trash` directory next to the path
+    :param bool replace: Whether to cancel the jobs which already schedule
+        the path for expiry, once the new job is scheduled. Default: False
+    :param str at_queue: The `at` queue letter to schedule the job in, see
+        `get_queue`. Ignored by the expyre daemon. Default: None
+    :param queue: An `expyre.expiry_queue.ExpiryQueue` to schedule the path
+        in the background, in which case a future for the JobSpec is returned.
+        Default: None
     :return: `JobSpec` object describing the scheduled expiry job.
     :rtype: JobSpec
     """
-    path = os.path.abspath(os.path.expanduser(path))
+    queue = options.pop('queue', None)
+    if queue is not None:
+        return queue.submit(path, timespec, unless_modified, unless_accessed, **options)
+    return expire_paths([path], timespec, unless_modified, unless_accessed, **options)[0]
+
+
+def expire_paths(paths, timespec, unless_modified=True, unless_accessed=True, batch_size=1000,
+                 **options):
+    """Schedule expiry for many paths sharing the same timespec and conditions.
+
+    Rather than scheduling one `at` job per path, the paths are packed into
+    jobs of up to `batch_size` paths each. Every path keeps its own conditions
+    in the job script, so a path that was modified or accessed is skipped
+    without affecting the other paths in the same job.
+
+    :param paths: An iterable of paths to schedule for expiry.
+    :param timespec: A datetime object or string as recognized by the `at` command.
+    :param bool unless_modified: See `expire_path`. Default: True
+    :param bool unless_accessed: See `expire_path`. Default: True
+    :param int batch_size: Maximum number of paths in a single `at` job. Default: 1000
+    :param options: The `tree`, `replace`, `at_queue` and deletion strategy
+        options of `expire_path`.
+    :return: list of `JobSpec` objects, one per path.
+    :rtype: list
+    """
+    paths = [os.path.abspath(os.path.expanduser(path)) for path in paths]
+    _check_paths(paths)
+    replace = options.pop('replace', False)
+    queue = options.pop('at_queue', None)
+    daemon = get_daemon()
+    if daemon:
+        _check_daemon_options(options)
+        if replace:
+            replaced = set(paths)
+            previous = [job.job_id for job in daemon.jobs() if job.path in replaced]
+        job_specs = daemon.expire_paths(paths, timespec, unless_modified, unless_accessed)
+        if replace and previous:
+            daemon.cancel(previous)
+        return job_specs
     timespec = timespec.strftime("%R %F") if isinstance(timespec, datetime) else timespec
+    _check_timespec(timespec)
+    now = time.time()
 
-    if os.path.isdir(path):
-        log.warn('Will execute `rm -rf %s` at %s', path, timespec)
-    action = 'rm {} {}'.format('-rf' if os.path.isdir(path) else '', path)
+    queue = get_queue(queue)
+    pre_exec_check(verify_running=True)
+    if replace:
+        backend = get_backend(queue)
+        previous = _scheduled_entries(paths, backend)
+    job_specs = []
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        scripts, conditions = [], []
+        for path in batch:
+            script, as_string = _expiry_script(path, timespec, unless_modified, unless_accessed, now,
+                                               **options)
+            scripts.append(script)
+            conditions.append(as_string)
+        job_id, timestamp = at_submit(''.join(scripts), timespec, queue)
+        job_specs.extend(JobSpec(job_id, path, timestamp, condition)
+                         for path, condition in zip(batch, conditions))
 
-    conditions = []
-    as_string = []
+    # - the previous jobs are only removed once the paths are rescheduled,
+    # so that they are never left unscheduled
+    if replace and previous:
+        scheduled_jobs, to_remove = _removal_plan(previous, paths)
+        failed_jobs = _apply_removals(backend, to_remove)
+        if failed_jobs:
+            log.warning('could not remove the previous expiry jobs %s', ', '.join(sorted(failed_jobs, key=int)))
+    return job_specs
 
-    if unless_modified or unless_accessed:
-        now = time.time()
-        localtime = datetime.fromtimestamp(now)
 
-        for condition, description, option in ((unless_accessed, 'accessed', 'X'),
-                                               (unless_modified, 'modified', 'Y')):
-            if condition:
-                conditions.append('''[ ! "$(stat -c '%{0}' {1})" -gt {2:.0f} ]'''.format(option, path, now))
-                as_string.append('unless {0} after {1:%R %F}'.format(description, localtime))
-        conditions.append(' &&')
+def _script_blocks(script):
+    """Return a list of `(path, conditions_string, block)` for every path in a
+    job script, where `block` is the part of the script expiring that path.
+    """
+    matches = list(BLOCK_RE.finditer(script))
+    end = len(script)
+    # - `at -c` shows the script within the heredoc of the job's shell, the
+    # last block ends at its terminator
+    heredoc = HEREDOC_RE.search(script, 0, matches[0].start()) if matches else None
+    if heredoc:
+        terminator = re.compile('^{}$'.format(re.escape(heredoc.group('delimiter'))), re.MULTILINE)
+        found = terminator.search(script, matches[-1].end())
+        end = found.start() if found else end
+    ends = [match.start() - 1 for match in matches[1:]] + [end]
+    return [(match.group('path'), match.group('conditions_string'), script[match.start() - 1:end])
+            for match, end in zip(matches, ends)]
 
-    script = SCRIPT_TEMPLATE.format(path=path,
-                                    action=action,
-                                    conditions_string=' or '.join(as_string),
-                                    conditions=' ||\n'.join(conditions)
-                                    )
 
-    pre_exec_check(verify_running=True)
-    process = subprocess.Popen([atcmd, timespec],
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT
-                               )
-    stdout, _ = process.communicate(script.encode('utf-8'))
-    stdout = stdout.decode('utf-8')
+def _parse_script(script):
+    """Return the list of `(path, conditions_string)` of an expyre job script,
+    or `None` if the script is not that of an expyre job.
+    """
+    return [(path, conditions) for path, conditions, _ in _script_blocks(script)] or None
 
-    log.debug('output: %s', stdout)
-    if process.returncode != 0:
-        if 'Garbled time' in stdout:
-            raise RuntimeError('Timespec not recognized by at command')
-        else:
-            raise subprocess.CalledProcessError(process.returncode, atcmd)
 
-    match = jobid_re.search(stdout, re.MULTILINE)
-    job_id = match.group('job_id')
-    timestamp = datetime.strptime(match.group('timespec'), '%c')
-    return JobSpec(job_id, path, timestamp, ' or '.join(as_string))
+def _parse_job(backend, job_id):
+    """Fetch and parse the script of a job, returning `(job_id, fetched, entries)`
+
+    `entries` is a list of `(path, conditions_string)` for an expyre job or
+    `None`, and `fetched` is False if the script could not be fetched, which
+    happens when the job was executed or removed after the queue was listed.
+    """
+    try:
+        script = backend.script(job_id)
+    except (subprocess.CalledProcessError, IOError, OSError) as exc:
+        log.debug('could not fetch job %s, skipping: %s', job_id, exc)
+        return job_id, False, None
+    return job_id, True, _parse_script(script)
+
+
+def _parse_jobs(backend, job_ids, workers=None):
+    """Return an iterator of `_parse_job` results for all `job_ids`, fetching
+    the job scripts with a pool of `workers` threads if requested.
+    """
+    if workers and workers > 1 and len(job_ids) > 1 and ThreadPoolExecutor:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(functools.partial(_parse_job, backend), job_ids):
+                yield result
+    else:
+        for job_id in job_ids:
+            yield _parse_job(backend, job_id)
+
+
+def is_under(path, directory):
+    """Whether `path` is `directory` or lies under it, comparing whole path
+    components so that '/data/foobar' is not under '/data/foo'.
+    """
+    directory = directory.rstrip('/')
+    return path == directory or path.startswith(directory + '/') or not directory
+
+
+class PathIndex(object):
+    """Sorted index of the paths of scheduled jobs for fast subtree queries.
+
+    Building the index is O(n log n), after which the jobs under a directory
+    are found in O(log n + k) for k matching paths. Several jobs for the same
+    path are all kept.
+    """
+
+    def __init__(self, job_specs):
+        self._jobs = {}
+        for job_spec in job_specs:
+            self._jobs.setdefault(job_spec.path, []).append(job_spec)
+        self._paths = sorted(self._jobs)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path):
+        return path in self._jobs
+
+    def get(self, path):
+        """Return the list of JobSpec for exactly `path`"""
+        return list(self._jobs.get(path, ()))
+
+    def subtree(self, directory):
+        """Return the list of JobSpec for `directory` and every path under it"""
+        directory = directory.rstrip('/')
+        # - every path under `directory` sorts between directory + '/' and
+        # directory + '0', '0' being the character right after '/'
+        lo = bisect.bisect_left(self._paths, directory + '/')
+        hi = bisect.bisect_left(self._paths, directory + '0', lo)
+        paths = ([directory] if directory in self._jobs else []) + self._paths[lo:hi]
+        return [job_spec for path in paths for job_spec in self._jobs[path]]
+
+
+class JobTable(Mapping):
+    """Compact map of paths to JobSpec, as returned by `get_scheduled_jobs`.
+
+    Rather than a JobSpec per path, the table keeps arrays of small ints
+    referring to the distinct job ids, timestamps, directories and conditions
+    strings, which are shared by many paths, and only builds the JobSpec and
+    datetime of a path when it is looked up. As with a dict, a path added
+    again keeps its position but takes the job of the last one added.
+    """
+
+    _EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, job_specs=()):
+        # - per job: its id and timestamp, as microseconds since 1970 of the
+        # naive timestamp so that it converts back exactly
+        self._job_ids, self._times, self._jobs = [], array('q'), {}
+        self._prefixes, self._prefix_ids = [], {}
+        self._conditions, self._condition_ids = [], {}
+        self._datetimes = {}
+        # - per path: its name and the ids of its job, directory and conditions
+        self._names = []
+        self._job, self._prefix, self._condition = array('i'), array('i'), array('i')
+        # - hash table of the rows of the paths, by directory id and name,
+        # with linear probing and kept at most half full
+        self._slots = array('i', [-1]) * 8
+        self.extend(job_specs)
+
+    def _slot(self, prefix, name):
+        """Return the slot of the path `name` in the directory `prefix`, or the
+        empty slot where it goes.
+        """
+        slots, prefix_col, names = self._slots, self._prefix, self._names
+        mask = len(slots) - 1
+        slot = hash((prefix, name)) & mask
+        row = slots[slot]
+        while row != -1 and (prefix_col[row] != prefix or names[row] != name):
+            slot = (slot + 1) & mask
+            row = slots[slot]
+        return slot
+
+    def _grow(self):
+        self._slots = array('i', [-1]) * (len(self._slots) * 4)
+        for row, (prefix, name) in enumerate(zip(self._prefix, self._names)):
+            self._slots[self._slot(prefix, name)] = row
+
+    def _lookup(self, path):
+        """Return the row of `path`, or -1"""
+        head, sep, name = path.rpartition('/')
+        prefix = self._prefix_ids.get(head + sep)
+        return -1 if prefix is None else self._slots[self._slot(prefix, name)]
+
+    def extend(self, job_specs):
+        """Add the JobSpec of `job_specs`, replacing the job of the paths
+        already in the table.
+        """
+        jobs, job_ids, times, epoch = self._jobs, self._job_ids, self._times, self._EPOCH
+        prefix_ids, prefixes = self._prefix_ids, self._prefixes
+        condition_ids, conditions_list = self._condition_ids, self._conditions
+        names, job_col, prefix_col, condition_col = self._names, self._job, self._prefix, self._condition
+        slots = self._slots
+        mask = len(slots) - 1
+        for job_id, path, timestamp, conditions in job_specs:
+            job = jobs.get(job_id)
+            if job is None:
+                delta = timestamp - epoch
+                job = jobs[job_id] = len(job_ids)
+                job_ids.append(job_id)
+                times.append((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+            condition = condition_ids.get(conditions)
+            if condition is None:
+                condition = condition_ids[conditions] = len(conditions_list)
+                conditions_list.append(conditions)
+            head, sep, name = path.rpartition('/')
+            prefix = prefix_ids.get(head + sep)
+            if prefix is None:
+                prefix = prefix_ids[head + sep] = len(prefixes)
+                prefixes.append(head + sep)
+            # - see `_slot`, inlined as this is run for every path
+            slot = hash((prefix, name)) & mask
+            row = slots[slot]
+            while row != -1 and (prefix_col[row] != prefix or names[row] != name):
+                slot = (slot + 1) & mask
+                row = slots[slot]
+            if row != -1:
+                job_col[row], condition_col[row] = job, condition
+                continue
+            slots[slot] = len(names)
+            names.append(name)
+            job_col.append(job)
+            prefix_col.append(prefix)
+            condition_col.append(condition)
+            if len(names) * 2 > mask:
+                self._grow()
+                slots = self._slots
+                mask = len(slots) - 1
+
+    def add(self, job_id, path, timestamp, conditions):
+        """Add the `path` scheduled by `job_id`, replacing the job it had if any"""
+        self.extend([(job_id, path, timestamp, conditions)])
 
+    def _timestamp(self, job):
+        try:
+            return self._datetimes[job]
+        except KeyError:
+            timestamp = self._datetimes[job] = self._EPOCH + timedelta(microseconds=self._times[job])
+            return timestamp
 
-def get_scheduled_jobs(prefix=None):
-    """Return a map of paths to JobSpec for all paths scheduled for expiry.
+    def _job_spec(self, row):
+        job = self._job[row]
+        return JobSpec(self._job_ids[job], self._prefixes[self._prefix[row]] + self._names[row],
+                       self._timestamp(job), self._conditions[self._condition[row]])
+
+    def __getitem__(self, path):
+        row = self._lookup(path)
+        if row == -1:
+            raise KeyError(path)
+        return self._job_spec(row)
+
+    def __contains__(self, path):
+        return self._lookup(path) != -1
+
+    def __iter__(self):
+        prefixes = self._prefixes
+        for prefix, name in zip(self._prefix, self._names):
+            yield prefixes[prefix] + name
+
+    def __len__(self):
+        return len(self._names)
+
+    def by_timestamp(self, reverse=False):
+        """Return an iterator of the JobSpec in the table ordered by timestamp,
+        the paths of the same job in the order they were added.
+
+        Only the jobs are sorted, their paths are then taken job by job.
+        """
+        rows = [[] for _ in self._job_ids]
+        for row, job in enumerate(self._job):
+            rows[job].append(row)
+        job_ids, prefixes, names, conditions = self._job_ids, self._prefixes, self._names, self._conditions
+        prefix_col, condition_col = self._prefix, self._condition
+        for job in sorted(range(len(rows)), key=self._times.__getitem__, reverse=reverse):
+            if not rows[job]:
+                continue
+            job_id, timestamp = job_ids[job], self._timestamp(job)
+            for row in rows[job]:
+                yield JobSpec(job_id, prefixes[prefix_col[row]] + names[row], timestamp,
+                              conditions[condition_col[row]])
+
+
+def _unseen_jobs(index, queued):
+    """Return a map of job id to run time for the `queued` jobs missing from `index`"""
+    unseen = {}
+    for job_id, timestamp, queue in queued:
+        if not index.lookup(job_id, timestamp.isoformat())[0]:
+            unseen[job_id] = timestamp.isoformat()
+    return unseen
+
+
+def _indexed_jobs(index, queued, prefix=None):
+    """Return an iterator of JobSpec for the `queued` jobs known to `index` as
+    expyre jobs, with paths under `prefix` if given.
+    """
+    for job_id, timestamp, queue in queued:
+        found, entries = index.lookup(job_id, timestamp.isoformat())
+        for path, conditions in entries or ():
+            if prefix and not is_under(path, prefix):
+                continue
+            yield JobSpec(job_id, path, timestamp, conditions)
+
+
+def _scheduled_entries(paths, backend, workers=None):
+    """Return the JobSpec of every path in the queued expyre jobs which
+    schedule any of `paths`, looking the paths up in the job index rather
+    than going through every job.
+    """
+    index = JobIndex.load()
+    queued = backend.jobs()
+    unseen = _unseen_jobs(index, queued)
+    for job_id, fetched, entries in _parse_jobs(backend, list(unseen), workers):
+        if fetched:
+            index.add(job_id, unseen[job_id], entries)
+    index.retain(job.job_id for job in queued)
+    index.save()
+
+    queued = dict((job.job_id, job) for job in queued)
+    job_ids = set()
+    for path in paths:
+        job_ids.update(index.jobs_for(os.path.abspath(os.path.expanduser(path))))
+    job_specs = []
+    for job_id in sorted(job_ids.intersection(queued), key=int):
+        timestamp = queued[job_id].timestamp
+        for path, conditions in index.lookup(job_id, timestamp.isoformat())[1] or ():
+            job_specs.append(JobSpec(job_id, path, timestamp, conditions))
+    return job_specs
+
+
+def iter_scheduled_jobs(prefix=None, use_index=True, backend=None, workers=None, at_queue=None):
+    """Return an iterator of JobSpec for all paths scheduled for expiry.
+
+    Unlike `get_scheduled_jobs`, the JobSpec of every job is yielded as soon
+    as the job has been parsed, in the order of the `at` queue, and paths
+    scheduled more than once are yielded once for every job. See
+    `get_scheduled_jobs` for the parameters.
     """
-    jobs = {}
     if prefix:
         prefix = os.path.abspath(os.path.expanduser(prefix))
-    for job in at_list():
-        job_id, timespec, queue, user = re.search(job_info_re, job).groups()
-        job_spec = at_cat(job_id)
-        match = SCRIPT_RE.search(job_spec)
-        if match:
-            path, conditions, _, _ = match.groups()
-            if prefix and not path.startswith(prefix):
+    daemon = get_daemon() if backend is None else None
+    if daemon:
+        for job_spec in daemon.jobs(prefix):
+            yield job_spec
+        return
+    backend = backend or get_backend(at_queue)
+    index = JobIndex.load() if use_index else JobIndex()
+    queued = backend.jobs()
+
+    unseen = _unseen_jobs(index, queued)
+    # - the scripts of unseen jobs are parsed in queue order, possibly ahead
+    # of the loop below when using workers
+    parsed = _parse_jobs(backend, list(unseen), workers)
+    try:
+        for job_id, timestamp, queue in queued:
+            if job_id in unseen:
+                _, fetched, entries = next(parsed)
+                if fetched:
+                    index.add(job_id, unseen[job_id], entries)
+            else:
+                entries = index.lookup(job_id, timestamp.isoformat())[1]
+            for path, conditions in entries or ():
+                if prefix and not is_under(path, prefix):
+                    continue
+                yield JobSpec(job_id, path, timestamp, conditions)
+    finally:
+        parsed.close()
+        if use_index:
+            index.retain(job.job_id for job in queued)
+            index.save()
+
+
+def get_scheduled_jobs(prefix=None, use_index=True, backend=None, workers=None, at_queue=None):
+    """Return a `JobTable` mapping paths to JobSpec for all paths scheduled
+    for expiry.
+
+    :param str prefix: Only return paths under this directory.
+    :param bool use_index: Whether to consult the persistent `JobIndex` so that
+        job scripts are only fetched for jobs which have not been seen before.
+        Default: True
+    :param backend: The backend used to query the `at` queue. Default: the
+        one returned by `get_backend()`
+    :param int workers: Number of threads used to fetch job scripts
+        concurrently. Default: fetch them one at a time
+    :param str at_queue: The `at` queue letter of the jobs, see `get_queue`,
+        when no backend is given. Default: None
+    :rtype: JobTable
+    """
+    return JobTable(iter_scheduled_jobs(prefix, use_index, backend, workers, at_queue))
+
+
+def _rewrite_job(backend, job_spec, keep, queue=None):
+    """Reschedule the paths in `keep` from the job of `job_spec` as a new job,
+    in `queue` or else in the queue listed by `backend`, and return its id.
+    The original job is left for the caller to remove.
+    """
+    blocks = [block for path, _, block in _script_blocks(backend.script(job_spec.job_id))
+              if path in keep]
+    job_id, _ = at_submit(''.join(blocks), job_spec.timestamp.strftime('%R %F'),
+                          queue or getattr(backend, 'at_queue', None))
+    log.debug('rescheduled %d paths from job %s as job %s', len(blocks), job_spec.job_id, job_id)
+    return job_id
+
+
+def _remove_jobs(backend, job_ids):
+    """Remove `job_ids` with as few `at -r` invocations as ARG_MAX allows and
+    return the set of job ids which could not be removed.
+
+    If an invocation fails, typically because one of its jobs was executed
+    in the meantime, the queue is listed again and only the jobs of that
+    invocation which are still queued are considered as not removed.
+    """
+    failed = set()
+    for chunk in arg_chunks(job_ids, reserved=len(atcmd or '') + 4):
+        try:
+            output = backend.remove(*chunk)
+            log.debug('output: %s', output)
+        except (subprocess.CalledProcessError, IOError, OSError) as exc:
+            log.debug('could not remove all of jobs %s: %s', ', '.join(chunk), exc)
+            queued = set(job.job_id for job in backend.jobs())
+            failed.update(job_id for job_id in chunk if job_id in queued)
+    return failed
+
+
+def _removal_plan(job_specs, paths):
+    """Work out how to remove `paths` given the scheduled `job_specs`, which
+    must include every path of the jobs scheduling any of `paths`.
+
+    Return the map of paths to the list of JobSpec scheduling them, and the
+    map of job ids to remove returned by `_job_removals` for all of those
+    JobSpec, so that every job scheduling a path is removed.
+    """
+    scheduled_jobs = {}
+    for job_spec in job_specs:
+        scheduled_jobs.setdefault(job_spec.path, []).append(job_spec)
+
+    paths = set(os.path.abspath(os.path.expanduser(path)) for path in paths)
+    removed = [job_spec for job_spec in job_specs if job_spec.path in paths]
+    return scheduled_jobs, _job_removals(job_specs, removed)
+
+
+def _job_removals(job_specs, removed):
+    """Return a map of the ids of the jobs of the `removed` JobSpec to the
+    `(job_spec, keep)` of one of the removed paths and the set of the other
+    paths in the job, according to `job_specs`, which have to be rescheduled.
+    """
+    paths_in_job = {}
+    for job_spec in job_specs:
+        paths_in_job.setdefault(job_spec.job_id, set()).add(job_spec.path)
+
+    removed_from_job = {}
+    for job_spec in removed:
+        removed_from_job.setdefault(job_spec.job_id, (job_spec, set()))[1].add(job_spec.path)
+    return dict((job_id, (job_spec, paths_in_job[job_id].difference(paths)))
+                for job_id, (job_spec, paths) in removed_from_job.items())
+
+
+def _apply_removals(backend, to_remove):
+    """Remove the jobs in the map returned by `_job_removals`, rescheduling
+    the paths to keep first, and return the set of job ids which could not
+    be removed.
+    """
+    # - the rest of a job is rescheduled in the queue of the job, which is only
+    # known from the listing when the backend lists every queue
+    queues = {}
+    if not getattr(backend, 'at_queue', None) and any(keep for _, keep in to_remove.values()):
+        queues = dict((job.job_id, job.queue) for job in backend.jobs())
+    failed_jobs, job_ids = set(), []
+    for job_id in sorted(to_remove, key=int):
+        job_spec, keep = to_remove[job_id]
+        if keep:
+            try:
+                _rewrite_job(backend, job_spec, keep, queues.get(job_id))
+            except (subprocess.CalledProcessError, IOError, OSError, RuntimeError) as exc:
+                log.debug('could not reschedule the rest of job %s: %s', job_id, exc)
+                failed_jobs.add(job_id)
                 continue
-            timestamp = datetime.strptime(timespec, '%c')
-            jobs[path] = JobSpec(job_id, path, timestamp, conditions)
-    return jobs
+        job_ids.append(job_id)
+    log.debug('removing %d jobs from expiry schedule', len(job_ids))
+    failed_jobs.update(_remove_jobs(backend, job_ids))
+    return failed_jobs
 
 
-def remove_from_schedule(paths):
-    assert(isinstance(paths, (list, tuple)))
-    scheduled_jobs = get_scheduled_jobs()
+def _removal_result(paths, scheduled_jobs, failed_jobs):
+    """Return the lists of paths removed and not removed from the schedule"""
     success, faliure = [], []
     for path in paths:
         path = os.path.abspath(os.path.expanduser(path))
         if path not in scheduled_jobs:
             log.debug('%s was not scheduled for expiry, skipping...', path)
             faliure.append(path)
-            continue
-        job_spec = scheduled_jobs[path]
-        log.debug('removing %s with job id %s from expiry schedule', job_spec.path, job_spec.job_id)
-        output = at_rm(job_spec.job_id)
-        success.append(path)
-        log.debug('output: %s', output)
+        elif any(job_spec.job_id in failed_jobs for job_spec in scheduled_jobs[path]):
+            faliure.append(path)
+        else:
+            success.append(path)
     return success, faliure
 
 
+def _expand_subtrees(paths, job_specs):
+    """Replace every directory in `paths` by the scheduled paths under it.
+    Directories without any scheduled paths are kept as they are.
+    """
+    index = PathIndex(job_specs)
+    expanded = []
+    for path in paths:
+        path = os.path.abspath(os.path.expanduser(path))
+        under = sorted(set(job_spec.path for job_spec in index.subtree(path)))
+        expanded.extend(under or [path])
+    return list(OrderedDict.fromkeys(expanded))
+
+
+def remove_from_schedule(paths, backend=None, workers=None, recursive=False, at_queue=None):
+    """Remove paths from the expiry schedule.
+
+    Every job scheduling the paths is removed, including the duplicates left
+    by scheduling a path more than once. Paths which were scheduled together
+    with other paths by `expire_paths` are removed by rescheduling the rest of
+    the paths in their job.
+
+    :param paths: list of paths to remove from the schedule.
+    :param bool recursive: Whether to also remove every path scheduled under
+        the given paths. Default: False
+    :param str at_queue: See `get_scheduled_jobs`.
+    :return: A tuple of the list of paths removed and of those which could not be.
+    :rtype: tuple
+    """
+    assert(isinstance(paths, (list, tuple)))
+    daemon = get_daemon() if backend is None else None
+    if daemon:
+        job_specs = daemon.jobs()
+        if recursive:
+            paths = _expand_subtrees(paths, job_specs)
+        scheduled_jobs, to_remove = _removal_plan(job_specs, paths)
+        cancelled = daemon.cancel(to_remove)
+        return _removal_result(paths, scheduled_jobs, set(to_remove).difference(cancelled))
+
+    backend = backend or get_backend(at_queue)
+    if recursive:
+        job_specs = list(iter_scheduled_jobs(backend=backend, workers=workers))
+        paths = _expand_subtrees(paths, job_specs)
+    else:
+        job_specs = _scheduled_entries(paths, backend, workers)
+    scheduled_jobs, to_remove = _removal_plan(job_specs, paths)
+    return _removal_result(paths, scheduled_jobs, _apply_removals(backend, to_remove))
+
+
+def dedupe(backend=None, workers=None, dry_run=False, at_queue=None):
+    """Remove the duplicate expiry jobs of paths scheduled more than once,
+    keeping the most recently scheduled one, ie. that with the highest job id.
+
+    :param backend: See `get_scheduled_jobs`.
+    :param int workers: See `get_scheduled_jobs`.
+    :param bool dry_run: Only return the duplicates, without removing them.
+        Default: False
+    :param str at_queue: See `get_scheduled_jobs`.
+    :return: A tuple of the list of JobSpec of the duplicates removed and of
+        those which could not be removed.
+    :rtype: tuple
+    """
+    daemon = get_daemon() if backend is None else None
+    backend = backend or (None if daemon else get_backend(at_queue))
+    job_specs = list(iter_scheduled_jobs(backend=backend, workers=workers))
+
+    scheduled_jobs = {}
+    for job_spec in job_specs:
+        scheduled_jobs.setdefault(job_spec.path, []).append(job_spec)
+    duplicates = []
+    for path, path_specs in scheduled_jobs.items():
+        latest = max(int(job_spec.job_id) for job_spec in path_specs)
+        duplicates.extend(job_spec for job_spec in path_specs if int(job_spec.job_id) != latest)
+    duplicates.sort(key=lambda job_spec: (job_spec.path, int(job_spec.job_id)))
+    if dry_run or not duplicates:
+        return duplicates, []
+
+    to_remove = _job_removals(job_specs, duplicates)
+    if daemon:
+        failed_jobs = set(to_remove).difference(daemon.cancel(to_remove))
+    else:
+        failed_jobs = _apply_removals(backend, to_remove)
+    return ([job_spec for job_spec in duplicates if job_spec.job_id not in failed_jobs],
+            [job_spec for job_spec in duplicates if job_spec.job_id in failed_jobs])
+
+
+def migrate(at_queue=None, backend=None, workers=None, dry_run=False):
+    """Move the expyre jobs scheduled in other `at` queues, as they were before
+    a dedicated queue was configured, to the dedicated queue.
+
+    Every job is rescheduled at the same time in the dedicated queue before
+    being removed, and its copy is removed instead if it cannot be.
+
+    :param str at_queue: The dedicated `at` queue letter, see `get_queue`.
+    :param backend: A backend listing the jobs of every queue. Default: the
+        one returned by `get_backend('')`
+    :param int workers: See `get_scheduled_jobs`.
+    :param bool dry_run: Only return the jobs to move. Default: False
+    :return: A tuple of the list of JobSpec of the paths moved and of those
+        which could not be.
+    :rtype: tuple
+    """
+    queue = get_queue(at_queue)
+    if not queue:
+        raise RuntimeError('No dedicated at queue to migrate jobs to, set EXPYRE_QUEUE')
+    if get_daemon():
+        raise RuntimeError('at queues are not used by the expyre daemon')
+    backend = backend or get_backend('')
+    legacy = set(job.job_id for job in backend.jobs() if job.queue not in (queue, '='))
+    job_specs = [job_spec for job_spec in iter_scheduled_jobs(backend=backend, workers=workers)
+                 if job_spec.job_id in legacy]
+    if dry_run or not job_specs:
+        return job_specs, []
+
+    paths_in_job = {}
+    for job_spec in job_specs:
+        paths_in_job.setdefault(job_spec.job_id, (job_spec, set()))[1].add(job_spec.path)
+    failed_jobs, copies = set(), {}
+    for job_id in sorted(paths_in_job, key=int):
+        job_spec, paths = paths_in_job[job_id]
+        try:
+            copies[job_id] = _rewrite_job(backend, job_spec, paths, queue)
+        except (subprocess.CalledProcessError, IOError, OSError, RuntimeError) as exc:
+            log.debug('could not move job %s to queue %s: %s', job_id, queue, exc)
+            failed_jobs.add(job_id)
+    not_removed = _remove_jobs(backend, sorted(copies, key=int))
+    if not_removed:
+        _remove_jobs(backend, [copies[job_id] for job_id in sorted(not_removed, key=int)])
+        failed_jobs.update(not_removed)
+    return ([job_spec for job_spec in job_specs if job_spec.job_id not in failed_jobs],
+            [job_spec for job_spec in job_specs if job_spec.job_id in failed_jobs])
+
+
+def _stat_paths(paths, workers=None):
+    """Return a map of `paths` to their `os.lstat` result, or to None for those
+    which do not exist. Paths which could not be checked are left out.
+    """
+    def lstat(path):
+        try:
+            return path, os.lstat(path)
+        except OSError as exc:
+            if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+                return path, None
+            log.debug('could not check %s: %s', path, exc)
+            return path, False
+
+    if workers and workers > 1 and len(paths) > 1 and ThreadPoolExecutor:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lstat, paths))
+    else:
+        results = [lstat(path) for path in paths]
+    return dict((path, stat) for path, stat in results if stat is not False)
+
+
+def _doomed(job_spec, stat, cache):
+    """Return whether the conditions of `job_spec` can no longer hold for the
+    path with the `stat` result, ie. it was accessed or modified since it was
+    scheduled. `cache` maps conditions strings to their parsed conditions.
+    """
+    if job_spec.conditions not in cache:
+        # - the conditions only give the minute the path was scheduled at, so
+        # only times past the end of that minute are known to be later
+        cache[job_spec.conditions] = [
+            ('st_atime' if match.group('field') == 'accessed' else 'st_mtime',
+             time.mktime(time.strptime(match.group('when'), '%H:%M %Y-%m-%d')) + 60)
+            for match in condition_re.finditer(job_spec.conditions)]
+    return any(getattr(stat, field) >= after for field, after in cache[job_spec.conditions])
+
+
+def reconcile(backend=None, workers=None, dry_run=False, cancel_doomed=False, at_queue=None):
+    """Remove the scheduled paths which no longer exist from the schedule,
+    and find those which exist but will not be expired because they were
+    accessed or modified since they were scheduled.
+
+    :param backend: See `get_scheduled_jobs`.
+    :param int workers: Number of threads used to fetch job scripts and to
+        check paths concurrently. Default: one at a time
+    :param bool dry_run: Only report the paths to remove. Default: False
+    :param bool cancel_doomed: Also remove the paths which will not be
+        expired because of their conditions. Default: False
+    :param str at_queue: See `get_scheduled_jobs`.
+    :rtype: ReconcileResult
+    """
+    daemon = get_daemon() if backend is None else None
+    backend = backend or (None if daemon else get_backend(at_queue))
+    job_specs = list(iter_scheduled_jobs(backend=backend, workers=workers))
+    stats = _stat_paths(sorted(set(job_spec.path for job_spec in job_specs)), workers)
+
+    missing, doomed, cache = [], [], {}
+    for job_spec in job_specs:
+        if job_spec.path not in stats:
+            continue
+        if stats[job_spec.path] is None:
+            missing.append(job_spec)
+        elif job_spec.conditions and _doomed(job_spec, stats[job_spec.path], cache):
+            doomed.append(job_spec)
+    to_cancel = missing + (doomed if cancel_doomed else [])
+
+    failed_jobs = set()
+    if to_cancel and not dry_run:
+        to_remove = _job_removals(job_specs, to_cancel)
+        if daemon:
+            failed_jobs = set(to_remove).difference(daemon.cancel(to_remove))
+        else:
+            failed_jobs = _apply_removals(backend, to_remove)
+    removed = [job_spec for job_spec in to_cancel if job_spec.job_id not in failed_jobs]
+    failed = [job_spec for job_spec in to_cancel if job_spec.job_id in failed_jobs]
+    # - the jobs left are those with paths which were not removed, the jobs
+    # with other paths than the removed ones being rewritten
+    jobs_left = set(job_spec.job_id for job_spec in set(job_specs).difference(removed))
+    return ReconcileResult(len(job_specs), len(set(job_spec.job_id for job_spec in job_specs)),
+                           missing, doomed, removed, failed, len(jobs_left))
+
+
+# - callables called with the name of the operation and the seconds it took,
+# for every instrumented operation, while at least one is registered
+_stats_hooks = []
+
+# - the functions and methods timed while there are stats hooks, as
+# (owner, attribute, operation name or callable returning it from the args)
+_INSTRUMENTED = (
+    ('at_call', lambda cmd, *args, **kwargs: 'at {}'.format(cmd[1]) if len(cmd) > 1 else 'at'),
+    ('at_submit', 'at submit'),
+    ('AtdProbe._probe', 'atd probe'),
+    ('SpoolBackend.jobs', 'spool scan'),
+    ('SpoolBackend.script', 'spool read'),
+    ('JobIndex.load', 'index load'),
+    ('JobIndex.save', 'index save'),
+    ('_parse_at_time', 'parse timestamp'),
+    ('_parse_script', 'parse script'),
+)
+
+# - the original attributes replaced by their instrumented wrappers
+_uninstrumented = {}
+
+_perf_counter = getattr(time, 'perf_counter', time.time)
+
+
+def _timed(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = _perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = _perf_counter() - start
+            operation = name(*args, **kwargs) if callable(name) else name
+            for hook in list(_stats_hooks):
+                hook(operation, elapsed)
+    return wrapper
+
+
+def _instrument():
+    module = sys.modules[__name__]
+    for target, name in _INSTRUMENTED:
+        owner_name, _, attr = target.rpartition('.')
+        owner = getattr(module, owner_name) if owner_name else module
+        original = vars(owner)[attr]
+        if isinstance(original, (classmethod, staticmethod)):
+            wrapper = type(original)(_timed(original.__func__, name))
+        else:
+            wrapper = _timed(original, name)
+        _uninstrumented[(owner, attr)] = original
+        setattr(owner, attr, wrapper)
+
+
+def _uninstrument():
+    while _uninstrumented:
+        (owner, attr), original = _uninstrumented.popitem()
+        setattr(owner, attr, original)
+
+
+def add_stats_hook(hook):
+    """Register `hook` to be called with the name of the operation and the
+    seconds it took, for every `at` command run and every `at` output or job
+    script parsed.
+
+    The operations are only timed while a hook is registered: the functions
+    involved are replaced by timed wrappers when the first hook is added and
+    put back when the last one is removed, so there is no overhead otherwise.
+    """
+    if not _stats_hooks:
+        _instrument()
+    _stats_hooks.append(hook)
+
+
+def remove_stats_hook(hook):
+    """Unregister a hook registered with `add_stats_hook`"""
+    _stats_hooks.remove(hook)
+    if not _stats_hooks:
+        _uninstrument()
+
+
+class Stats(object):
+    """Count, total and maximum duration of every instrumented operation,
+    to be registered with `add_stats_hook`, most conveniently through
+    `collect_stats`.
+    """
+
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, operation, elapsed):
+        with self._lock:
+            count, total, longest = self.operations.get(operation, (0, 0.0, 0.0))
+            self.operations[operation] = (count + 1, total + elapsed, max(longest, elapsed))
+
+    def report(self):
+        """Return a human readable table of the collected stats"""
+        lines = ['{:<20} {:>8} {:>12} {:>12}'.format('operation', 'count', 'total (s)', 'max (s)')]
+        for operation, (count, total, longest) in sorted(self.operations.items()):
+            lines.append('{:<20} {:>8} {:>12.6f} {:>12.6f}'.format(operation, count, total, longest))
+        return '\n'.join(lines) + '\n'
+
+    def prometheus(self):
+        """Return the collected stats in the Prometheus text exposition format"""
+        metrics = (('expyre_operations_total', 'counter', 'Number of operations run', 0),
+                   ('expyre_operation_seconds_total', 'counter', 'Total seconds spent in operations', 1),
+                   ('expyre_operation_seconds_max', 'gauge', 'Longest single operation in seconds', 2))
+        lines = []
+        for metric, kind, description, field in metrics:
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} {}'.format(metric, kind))
+            for operation, values in sorted(self.operations.items()):
+                lines.append('{}{{operation="{}"}} {}'.format(metric, operation, values[field]))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, filename):
+        """Atomically write the collected stats to `filename`, for the
+        textfile collector of the Prometheus node exporter.
+        """
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                       prefix='.expyre-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp:
+                tmp.write(self.prometheus())
+            os.chmod(tmpname, 0o644)
+            os.rename(tmpname, filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+
+@contextmanager
+def collect_stats():
+    """A contextmanager collecting the stats of the operations run within it.
+
+    >>> with collect_stats() as stats:
+    ...     get_scheduled_jobs()
+    >>> print(stats.report())
+
+    :return: The `Stats` collected so far.
+    :rtype: Stats
+    """
+    stats = Stats()
+    add_stats_hook(stats)
+    try:
+        yield stats
+    finally:
+        remove_stats_hook(stats)
+
+
 @contextmanager
-def open_expiring(filename, at, unless_modified=True, unless_accessed=True, *args):
+def open_expiring(filename, at, unless_modified=True, unless_accessed=True, *args, **options):
     """A contextmanager that provides a open file descriptor to a file that
     will be scheduled for expiry on exit.
 
@@ -200,6 +1590,8 @@ def open_expiring(filename, at, unless_modified=True, unless_accessed=True, *arg
         expiry script to expire the path only if it has not been accessed since
         it was scheduled for expiry. Default: True
     :param *args: Any additional arguments to be passed on to the `open` builtin.
+    :param **options: The `tree`, `replace`, `queue` and deletion strategy
+        options of `expire_path`.
     :return: An open file object.
     :rtype: file
     """
@@ -209,4 +1601,4 @@ def open_expiring(filename, at, unless_modified=True, unless_accessed=True, *arg
     except:
         raise
     else:
-        expire_path(filename, at, unless_modified, unless_accessed)
+        expire_path(filename, at, unless_modified, unless_accessed, **options)
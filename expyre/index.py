@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Persistent index of the `at` jobs already inspected by expyre.
+
+Finding out whether an `at` job was created by expyre requires fetching its
+script with `at -c`, which is one subprocess per queued job. Since a job's
+script never changes once it is queued, the result of that inspection is
+cached here, keyed on the job id, so that a listing only needs to fetch the
+scripts of jobs it has not seen before.
+"""
+
+import json
+import logging
+import os
+import socket
+import tempfile
+
+log = logging.getLogger('expyre')
+
+INDEX_VERSION = 3
+
+
+def default_index_path():
+    """Return the location of the job index for the current user and host.
+
+    The location may be overridden with the `EXPYRE_INDEX` environment
+    variable, otherwise it is placed under `$XDG_STATE_HOME/expyre/`. The
+    hostname is part of the file name since `at` queues are local to a host
+    whereas home directories are often shared.
+    """
+    if os.environ.get('EXPYRE_INDEX'):
+        return os.path.expanduser(os.environ['EXPYRE_INDEX'])
+    state_dir = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+    return os.path.join(state_dir, 'expyre', 'jobs-{}.json'.format(socket.gethostname()))
+
+
+class JobIndex(object):
+    """Map of `at` job ids to the expyre details parsed from their scripts.
+
+    Each entry records the run time of the job as an ISO 8601 string (to
+    guard against job ids being reused by atd) along with a list of the
+    `(path, conditions_string)` of every path in the expyre job, or `None`
+    for jobs that were not created by expyre.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or default_index_path()
+        self._jobs = {}
+        self._paths = None
+        self._dirty = False
+
+    @classmethod
+    def load(cls, filename=None):
+        """Load the index from disk, returning an empty index if it cannot be read."""
+        index = cls(filename)
+        try:
+            with open(index.filename) as fd:
+                data = json.load(fd)
+            if data.get('version') == INDEX_VERSION:
+                index._jobs = data['jobs']
+        except (IOError, OSError, ValueError, KeyError, AttributeError) as exc:
+            log.debug('not using job index %s: %s', index.filename, exc)
+        return index
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def lookup(self, job_id, timespec):
+        """Return `(found, entries)` for the job; `entries` is `None` for non-expyre jobs."""
+        record = self._jobs.get(job_id)
+        if record is None or record[0] != timespec:
+            return False, None
+        return True, ([tuple(entry) for entry in record[1]] if record[1] is not None else None)
+
+    def jobs_for(self, path):
+        """Return the set of ids of the indexed jobs scheduling `path`."""
+        if self._paths is None:
+            self._paths = {}
+            for job_id, (timespec, entries) in self._jobs.items():
+                for entry in entries or ():
+                    self._paths.setdefault(entry[0], set()).add(job_id)
+        return set(self._paths.get(path, ()))
+
+    def add(self, job_id, timespec, entries=None):
+        """Record a job, with `entries=None` marking it as not being an expyre job."""
+        self._jobs[job_id] = [timespec, [list(entry) for entry in entries] if entries is not None else None]
+        self._paths = None
+        self._dirty = True
+
+    def discard(self, job_id):
+        if self._jobs.pop(job_id, None) is not None:
+            self._paths = None
+            self._dirty = True
+
+    def retain(self, job_ids):
+        """Drop every entry whose job id is not in `job_ids`."""
+        for job_id in set(self._jobs).difference(job_ids):
+            del self._jobs[job_id]
+            self._paths = None
+            self._dirty = True
+
+    def save(self):
+        """Atomically write the index to disk if it has changed.
+
+        Failing to save the index is not an error, it only means that the
+        next listing will have to fetch the job scripts again.
+        """
+        if not self._dirty:
+            return
+        dirname = os.path.dirname(self.filename)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.jobs-')
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump({'version': INDEX_VERSION, 'jobs': self._jobs}, tmp)
+            os.rename(tmpname, self.filename)
+            self._dirty = False
+        except (IOError, OSError) as exc:
+            log.warning('could not save job index %s: %s', self.filename, exc)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Size based, least recently used, eviction of the files in a directory.
+
+`enforce_quota` scans a directory once, and if the files in it use more than
+the allowed size, deletes the files which were least recently accessed (or
+modified) until the usage is below a low-water mark. A file accessed (or
+modified) since it was scanned is skipped, as an expiry job would skip it.
+
+The result of a scan can be persisted to a snapshot file, in which case the
+next scan only lists the directories which were modified since, ie. those in
+which files were created, renamed or removed, and reuses the recorded sizes
+and times of the files in the other directories.
+"""
+
+import heapq
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from collections import namedtuple
+from stat import S_ISREG
+
+from .helpers import scandir
+
+log = logging.getLogger('expyre')
+
+SNAPSHOT_VERSION = 1
+
+# - the outcome of enforcing a quota: the usage, in bytes, found by the scan,
+# the list of the paths evicted, the bytes they freed, and the list of the
+# paths which were skipped because they were used since the scan
+QuotaResult = namedtuple('QuotaResult', ('usage', 'evicted', 'freed', 'skipped'))
+
+size_re = re.compile(r'^\s*(?P<count>\d+(?:\.\d+)?)\s*(?P<unit>[kmgtp]?)(?:i?b)?\s*$', re.IGNORECASE)
+
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40, 'p': 1 << 50}
+
+
+def parse_size(size):
+    """Return the number of bytes in a size like '4096', '500M', '1.5G' or '2TiB'"""
+    match = size_re.match(size)
+    if not match:
+        raise ValueError('Invalid size {!r}'.format(size))
+    return int(float(match.group('count')) * SIZE_UNITS[match.group('unit').lower()])
+
+
+def _usage(stat):
+    # - the space actually used on disk, when the platform tells
+    blocks = getattr(stat, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else stat.st_size
+
+
+def _mtime_ns(stat):
+    return getattr(stat, 'st_mtime_ns', None) or int(stat.st_mtime * 1e9)
+
+
+def _load_snapshot(snapshot_file, directory):
+    try:
+        with open(snapshot_file) as fd:
+            snapshot = json.load(fd)
+        if snapshot.get('version') == SNAPSHOT_VERSION and snapshot['directory'] == directory:
+            return snapshot['dirs']
+        log.debug('not using snapshot %s, which is for another directory', snapshot_file)
+    except (IOError, OSError, ValueError, KeyError) as exc:
+        log.debug('not using snapshot %s: %s', snapshot_file, exc)
+    return {}
+
+
+def _save_snapshot(snapshot_file, directory, dirs):
+    dirname = os.path.dirname(os.path.abspath(snapshot_file))
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.expyre-quota-')
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump({'version': SNAPSHOT_VERSION, 'directory': directory, 'dirs': dirs}, tmp)
+        os.rename(tmpname, snapshot_file)
+    except (IOError, OSError) as exc:
+        log.warning('could not save snapshot %s: %s', snapshot_file, exc)
+
+
+def scan(directory, snapshot=None):
+    """Return the snapshot of the regular files under `directory`, as a map
+    of the path of every directory relative to `directory` to the list of its
+    modification time in nanoseconds, of a map of the names of its files to
+    their `[usage, atime, mtime]` and of the names of its subdirectories.
+
+    The directories of `snapshot` whose modification time did not change are
+    not listed again.
+    """
+    snapshot = snapshot or {}
+    # - a directory modified in the same second as the scan might be modified
+    # again without its modification time changing, so it is not trusted
+    untrusted_after = int((time.time() - 1) * 1e9)
+    dirs, pending = {}, ['']
+    while pending:
+        relpath = pending.pop()
+        path = os.path.join(directory, relpath) if relpath else directory
+        try:
+            mtime_ns = _mtime_ns(os.lstat(path))
+        except OSError as exc:
+            log.debug('could not scan %s: %s', path, exc)
+            continue
+        cached = snapshot.get(relpath)
+        if cached and cached[0] == mtime_ns:
+            files, subdirs = cached[1], cached[2]
+        else:
+            files, subdirs = {}, []
+            try:
+                for entry in scandir(path):
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if S_ISREG(stat.st_mode):
+                        files[entry.name] = [_usage(stat), stat.st_atime, stat.st_mtime]
+            except OSError as exc:
+                log.debug('could not scan %s: %s', path, exc)
+        dirs[relpath] = [mtime_ns if mtime_ns < untrusted_after else -1, files, subdirs]
+        pending.extend(os.path.join(relpath, name) for name in subdirs)
+    return dirs
+
+
+def enforce_quota(directory, max_size, low_water=None, by='atime', snapshot_file=None,
+                  unless_modified=True, unless_accessed=True, dry_run=False, on_evict=None):
+    """Evict the least recently used files under `directory` if they use more
+    than `max_size` bytes, until they use less than `low_water` bytes.
+
+    :param str directory: The directory to enforce the quota on.
+    :param int max_size: The size, in bytes, above which files are evicted.
+    :param int low_water: The size, in bytes, below which eviction stops.
+        Default: 90% of `max_size`
+    :param str by: Whether the least recently used files are those with the
+        oldest 'atime' or 'mtime'. Default: 'atime'
+    :param str snapshot_file: File in which the scan is persisted, for the
+        next scan to only list the directories modified since. Default: None
+    :param bool unless_modified: Whether to skip the files modified since the
+        scan. Default: True
+    :param bool unless_accessed: Whether to skip the files accessed since the
+        scan. Default: True
+    :param bool dry_run: Only return the files which would be evicted.
+        Default: False
+    :param on_evict: Callable called with the path and size of every file
+        evicted. Default: None
+    :rtype: QuotaResult
+    """
+    if by not in ('atime', 'mtime'):
+        raise ValueError("Invalid eviction order {!r}, expected 'atime' or 'mtime'".format(by))
+    if scandir is None:
+        raise RuntimeError('enforce_quota requires os.scandir or the scandir module')
+    directory = os.path.abspath(os.path.expanduser(directory))
+    low_water = int(max_size * 0.9) if low_water is None else min(low_water, max_size)
+
+    dirs = scan(directory, _load_snapshot(snapshot_file, directory) if snapshot_file else None)
+    usage = sum(size for _, files, _ in dirs.values() for size, _, _ in files.values())
+    evicted, skipped, freed = [], [], 0
+    if usage > max_size:
+        field = 1 if by == 'atime' else 2
+        heap = [(times[field], relpath, name) for relpath, (_, files, _) in dirs.items()
+                for name, times in files.items()]
+        heapq.heapify(heap)
+        remaining = usage
+        while heap and remaining > low_water:
+            _, relpath, name = heapq.heappop(heap)
+            files = dirs[relpath][1]
+            size, atime, mtime = files[name]
+            path = os.path.join(directory, relpath, name)
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                # - removed by someone else in the meantime
+                remaining -= size
+                del files[name]
+                continue
+            if (unless_accessed and stat.st_atime > atime) or (unless_modified and stat.st_mtime > mtime):
+                log.debug('%s was used since it was scanned, skipping...', path)
+                # - for the snapshot to hold its times of use, as its directory
+                # is not listed again if it is unchanged
+                files[name] = [_usage(stat), stat.st_atime, stat.st_mtime]
+                skipped.append(path)
+                continue
+            if not dry_run:
+                try:
+                    os.unlink(path)
+                except OSError as exc:
+                    log.warning('could not evict %s: %s', path, exc)
+                    continue
+                del files[name]
+                dirs[relpath][0] = -1
+            remaining -= size
+            freed += size
+            evicted.append(path)
+            if on_evict:
+                on_evict(path, size)
+
+    if snapshot_file:
+        _save_snapshot(snapshot_file, directory, dirs)
+    return QuotaResult(usage, evicted, freed, skipped)
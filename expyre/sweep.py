@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A policy driven, tmpwatch-like directory sweeper.
+
+`sweep` walks a tree and applies a list of policies, such as "files matching
+*.tmp not modified for 2 days" or "directories in which nothing was modified
+for 7 days", to every file and directory in it. The paths matching a policy
+are either deleted right away or scheduled for expiry, in batches, through an
+`ExpiryQueue`. A directory which matches a policy is not descended into.
+
+The top-level directories of the tree are walked concurrently. Each of them is
+walked depth first in sorted order, so that the progress of the walk can be
+recorded as a single cursor per top-level directory in a state file, from
+which an interrupted sweep resumes. Memory use is bounded by the size of the
+largest directory times the depth of the tree, plus the number of directories
+under a directory checked against a 'd' policy until they are walked.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from collections import namedtuple
+
+from .expiry_queue import ExpiryQueue
+from .helpers import ThreadPoolExecutor, _scan_dir, reap, scandir
+
+log = logging.getLogger('expyre')
+
+STATE_VERSION = 1
+
+# - a sweep policy: paths of `kind` ('f' for anything but directories, 'd'
+# for directories) with a name matching the `pattern` glob, whose `times`
+# (a tuple of 'atime', 'mtime' and 'ctime') are all older than `age` seconds.
+# For directories, the times of everything under the directory are checked.
+Policy = namedtuple('Policy', ('kind', 'pattern', 'age', 'times'))
+
+# - the outcome of a sweep: the number of files and directories looked at,
+# of those matching a policy, and of those which could not be deleted or
+# scheduled for expiry
+SweepResult = namedtuple('SweepResult', ('scanned', 'matched', 'failed'))
+
+duration_re = re.compile(r'^\s*(?P<count>\d+(?:\.\d+)?)\s*(?P<unit>[smhdw]?)\s*$')
+
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(duration):
+    """Return the number of seconds in a duration like '90', '30m', '2d' or '1w'"""
+    match = duration_re.match(duration)
+    if not match:
+        raise ValueError('Invalid duration {!r}'.format(duration))
+    return float(match.group('count')) * DURATION_UNITS[match.group('unit')]
+
+
+def parse_policy(spec):
+    """Return the `Policy` for a 'KIND:PATTERN:AGE[:TIMES]' spec.
+
+    KIND is 'f' (or 'file') or 'd' (or 'dir'), AGE is a duration as accepted
+    by `parse_duration` and TIMES a comma separated list of 'atime', 'mtime'
+    and, for files only, 'ctime', which defaults to 'mtime'. For instance
+    'f:*.tmp:2d' or 'd:build-*:7d:atime,mtime'.
+    """
+    parts = spec.split(':')
+    if len(parts) not in (3, 4):
+        raise ValueError('Invalid policy {!r}, expected KIND:PATTERN:AGE[:TIMES]'.format(spec))
+    kind = {'f': 'f', 'file': 'f', 'd': 'd', 'dir': 'd'}.get(parts[0])
+    if kind is None:
+        raise ValueError('Invalid policy kind {!r}, expected f or d'.format(parts[0]))
+    times = tuple(parts[3].split(',')) if len(parts) == 4 else ('mtime',)
+    allowed = ('atime', 'mtime', 'ctime') if kind == 'f' else ('atime', 'mtime')
+    if not times or any(field not in allowed for field in times):
+        raise ValueError('Invalid policy times {!r}, expected some of {}'.format(parts[3], ', '.join(allowed)))
+    return Policy(kind, parts[1] or '*', parse_duration(parts[2]), times)
+
+
+def _components(root, path):
+    return os.path.relpath(path, root).split(os.sep)
+
+
+class _Sweep(object):
+
+    def __init__(self, root, policies, action, timespec, dry_run, state_file, on_match,
+                 checkpoint, batch_size, options):
+        self.root = root
+        self.policies = policies
+        self.action = action
+        self.timespec = timespec
+        self.dry_run = dry_run
+        self.state_file = state_file
+        self.on_match = on_match
+        self.checkpoint = checkpoint
+        self.options = options
+        self.now = time.time()
+        # - the counts are updated by the `ExpiryQueue` thread too, which
+        # is waited for while holding the state lock
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.scanned = self.matched = self.failed = 0
+        self.done, self.cursors = set(), {}
+        # - map of the directories yet to be walked to the newest access and
+        # modification times under them, and the same for their
+        # subdirectories, as found when checking one of their parents
+        self.newest = {}
+        self.queue = None
+        if action == 'schedule' and not dry_run:
+            self.queue = ExpiryQueue(max_batch=batch_size, max_delay=3600)
+
+    # - state
+
+    def _state_key(self):
+        return [self.root, [list(policy) for policy in self.policies], self.action]
+
+    def load_state(self):
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file) as fd:
+                state = json.load(fd)
+            if state.get('version') != STATE_VERSION or state['key'] != json.loads(json.dumps(self._state_key())):
+                log.warning('ignoring sweep state %s, which is for another sweep', self.state_file)
+                return
+            self.done, self.cursors = set(state['done']), state['cursors']
+        except (IOError, OSError, ValueError, KeyError) as exc:
+            log.debug('not resuming from %s: %s', self.state_file, exc)
+
+    def save_state(self):
+        """Write the state file, once everything before the cursors was acted upon"""
+        if not self.state_file or self.dry_run:
+            return
+        if self.queue:
+            self.queue.flush()
+        state = {'version': STATE_VERSION, 'key': self._state_key(),
+                 'done': sorted(self.done), 'cursors': self.cursors}
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.state_file)),
+                                       prefix='.expyre-sweep-')
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump(state, tmp)
+        os.rename(tmpname, self.state_file)
+
+    # - policies
+
+    def _matches(self, policy, entry, is_dir):
+        if (policy.kind == 'd') != is_dir or not fnmatch.fnmatchcase(entry.name, policy.pattern):
+            return False
+        cutoff = self.now - policy.age
+        stat = entry.stat(follow_symlinks=False)
+        if any(getattr(stat, 'st_' + field) > cutoff for field in policy.times):
+            return False
+        if not is_dir:
+            return True
+        atime, mtime, _ = self._newest(entry.path)
+        return not (('atime' in policy.times and atime > cutoff) or
+                    ('mtime' in policy.times and mtime > cutoff))
+
+    def _newest(self, path):
+        """Return the newest access and modification times of everything
+        under the directory `path`, and the same for each of its
+        subdirectories, walking the directory once and bottom-up.
+        """
+        if path in self.newest:
+            return self.newest[path]
+        top = [0, 0, {}]
+        nodes, stack = [], [(path, top)]
+        while stack:
+            directory, node = stack.pop()
+            nodes.append(node)
+            try:
+                entries = _scan_dir(directory)
+            except OSError as exc:
+                log.debug('could not scan %s: %s', directory, exc)
+                continue
+            for entry, stat, is_dir in entries:
+                node[0] = max(node[0], stat.st_atime)
+                node[1] = max(node[1], stat.st_mtime)
+                if is_dir:
+                    node[2][entry] = [0, 0, {}]
+                    stack.append((entry, node[2][entry]))
+        # - subdirectories come after their parent
+        for node in reversed(nodes):
+            for child in node[2].values():
+                node[0] = max(node[0], child[0])
+                node[1] = max(node[1], child[1])
+        self.newest[path] = top
+        return top
+
+    def _match(self, entry, is_dir):
+        for policy in self.policies:
+            try:
+                if self._matches(policy, entry, is_dir):
+                    return policy
+            except OSError as exc:
+                log.debug('could not check %s: %s', entry.path, exc)
+                return None
+        return None
+
+    def _act(self, path, policy):
+        with self.lock:
+            self.matched += 1
+            if self.on_match:
+                self.on_match(path, policy)
+        if self.dry_run:
+            return
+        if self.queue:
+            self.queue.submit(path, self.timespec, **self.options).add_done_callback(self._scheduled)
+            return
+        try:
+            reap(path)
+        except OSError as exc:
+            log.warning('could not delete %s: %s', path, exc)
+            with self.lock:
+                self.failed += 1
+
+    def _scheduled(self, future):
+        if future.cancelled() or future.exception() is not None:
+            with self.lock:
+                self.failed += 1
+
+    # - walking
+
+    def _scandir(self, directory):
+        try:
+            return sorted(scandir(directory), key=lambda entry: entry.name)
+        except OSError as exc:
+            log.warning('could not scan %s: %s', directory, exc)
+            return []
+
+    def walk(self, task, entries):
+        """Apply the policies to `entries` and everything under them, depth
+        first in sorted order, resuming after the cursor of `task`.
+        """
+        # - the cursor is the last path acted upon and whether it was
+        # descended into
+        cursor, descended = self.cursors.get(task) or (None, False)
+        stack = list(reversed(entries))
+        scanned = 0
+        while stack:
+            entry = stack.pop()
+            is_dir = entry.is_dir(follow_symlinks=False)
+            components = _components(self.root, entry.path)
+            # - everything up to the cursor was acted upon, and the cursor and
+            # its parents are only to be descended into
+            if cursor is not None and components <= cursor:
+                if components == cursor:
+                    is_dir = is_dir and descended
+                elif not (is_dir and cursor[:len(components)] == components):
+                    continue
+            else:
+                scanned += 1
+                policy = self._match(entry, is_dir)
+                if policy:
+                    self._act(entry.path, policy)
+                    is_dir = False
+            # - the times under the subdirectories are kept for their own
+            # check, and dropped with the directory if it is not walked
+            subdirs = self.newest.pop(entry.path, None) if self.newest else None
+            if is_dir:
+                if subdirs:
+                    self.newest.update(subdirs[2])
+                stack.extend(reversed(self._scandir(entry.path)))
+            if scanned >= self.checkpoint:
+                with self.lock:
+                    self.scanned += scanned
+                with self.state_lock:
+                    self.cursors[task] = (components, is_dir)
+                    self.save_state()
+                scanned = 0
+        with self.lock:
+            self.scanned += scanned
+        with self.state_lock:
+            self.done.add(task)
+            self.cursors.pop(task, None)
+            self.save_state()
+
+    def run(self, workers):
+        self.load_state()
+        entries = self._scandir(self.root)
+        # - the files directly under the root are one task, and every
+        # top-level directory another
+        tasks = [('', [entry for entry in entries if not entry.is_dir(follow_symlinks=False)])]
+        tasks.extend((entry.name, [entry]) for entry in entries if entry.is_dir(follow_symlinks=False))
+        tasks = [(task, task_entries) for task, task_entries in tasks if task not in self.done]
+        try:
+            if workers and workers > 1 and ThreadPoolExecutor is not None:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    for _ in pool.map(lambda task: self.walk(*task), tasks):
+                        pass
+            else:
+                for task, task_entries in tasks:
+                    self.walk(task, task_entries)
+        finally:
+            if self.queue:
+                self.queue.close()
+        if self.state_file and not self.dry_run and os.path.exists(self.state_file):
+            os.unlink(self.state_file)
+        return SweepResult(self.scanned, self.matched, self.failed)
+
+
+def sweep(root, policies, action='schedule', timespec='now', workers=None, dry_run=False,
+          state_file=None, on_match=None, checkpoint=10000, batch_size=1000,
+          unless_modified=True, unless_accessed=True, **options):
+    """Apply `policies` to every file and directory under `root`.
+
+    :param str root: The directory to sweep.
+    :param policies: A list of `Policy` or of policy specs for `parse_policy`,
+        the first of which matching a path applies.
+    :param str action: 'schedule' to schedule the matching paths for expiry
+        at `timespec`, or 'delete' to delete them right away. Default: 'schedule'
+    :param timespec: The expiry time of the scheduled paths, as accepted by
+        `expire_path`. Default: 'now'
+    :param int workers: Number of top-level directories walked concurrently.
+        Default: walk them one at a time
+    :param bool dry_run: Only report the matching paths. Default: False
+    :param str state_file: File in which the progress of the sweep is
+        recorded, and from which an interrupted sweep resumes. It is removed
+        once the sweep completes. Default: None
+    :param on_match: Callable called with the path and the `Policy` of
+        every matching path. Default: None
+    :param int checkpoint: Number of paths looked at by a walker between
+        updates of the state file. Default: 10000
+    :param int batch_size: Maximum number of paths scheduled in one job.
+        Default: 1000
+    :param bool unless_modified: See `expire_path`. Default: True
+    :param bool unless_accessed: See `expire_path`. Default: True
+    :param options: The other options of `expire_path` for scheduled paths.
+    :return: The counts of paths scanned, matched and failed.
+    :rtype: SweepResult
+    """
+    if action not in ('schedule', 'delete'):
+        raise ValueError("Invalid sweep action {!r}, expected 'schedule' or 'delete'".format(action))
+    if scandir is None:
+        raise RuntimeError('sweep requires os.scandir or the scandir module')
+    policies = [parse_policy(policy) if not isinstance(policy, Policy) else policy for policy in policies]
+    options.update(unless_modified=unless_modified, unless_accessed=unless_accessed)
+    root = os.path.abspath(os.path.expanduser(root))
+    return _Sweep(root, policies, action, timespec, dry_run, state_file, on_match,
+                  checkpoint, batch_size, options).run(workers)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A parser for the timespecs of at(1), and for the run times it prints.
+
+`parse_timespec` resolves timespecs such as 'now + 2days', '18:00 tomorrow',
+'18:00 2017-12-31' or '5pm Friday' to the time at which `at` would run a job,
+so that they can be checked, and compared, without running `at`. It follows
+the grammar described in /usr/share/doc/at/timespec:
+
+    timespec  := (time [date] | date [time] | 'now') [increment]
+    time      := (HH:MM | HHMM | H(am|pm) | 'noon' | 'midnight' | 'teatime') ['utc']
+    date      := 'today' | 'tomorrow' | weekday | month-name day [[','] year]
+                 | day month-name [year] | YYYY-MM-DD | MM/DD/[YY]YY | DD.MM.[YY]YY
+                 | MMDD[YY]YY
+    increment := (('+' | '-') count unit)... | 'next' unit
+    unit      := 'minute' | 'hour' | 'day' | 'week' | 'month' | 'year', possibly plural
+
+As with `at`, a time of day which already passed today is tomorrow, a date
+without a time of day is at the current time of day, and a month and day
+which already passed this year are next year.
+
+`parse_at_time` parses the run times printed by `at -l` and when submitting
+a job, without going through the locale dependent `strptime('%c')`.
+"""
+
+import calendar
+import re
+import time
+
+from datetime import date, datetime, timedelta
+
+token_re = re.compile(r'''
+      (?P<isodate>\d{4}-\d{1,2}-\d{1,2})
+    | (?P<dotdate>\d{1,2}\.\d{1,2}\.(?:\d{4}|\d{2}))
+    | (?P<slashdate>\d{1,2}/\d{1,2}/(?:\d{4}|\d{2}))
+    | (?P<clock>\d{1,2}:\d{2})
+    | (?P<number>\d+)
+    | (?P<word>[a-z]+)
+    | (?P<symbol>[+,-])
+    | (?P<space>\s+)
+''', re.VERBOSE)
+
+MONTHS = dict((name, number) for number, names in enumerate((
+    ('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',),
+    ('jun', 'june'), ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'),
+    ('oct', 'october'), ('nov', 'november'), ('dec', 'december')), 1) for name in names)
+
+WEEKDAYS = dict((name, number) for number, names in enumerate((
+    ('mon', 'monday'), ('tue', 'tues', 'tuesday'), ('wed', 'wednesday'),
+    ('thu', 'thur', 'thurs', 'thursday'), ('fri', 'friday'), ('sat', 'saturday'),
+    ('sun', 'sunday'))) for name in names)
+
+NAMED_TIMES = {'noon': (12, 0), 'midnight': (0, 0), 'teatime': (16, 0)}
+
+# - the units of increments, in minutes, or in months for 'month' and 'year'
+UNITS = {'min': ('minutes', 1), 'minute': ('minutes', 1), 'hour': ('minutes', 60),
+         'day': ('minutes', 1440), 'week': ('minutes', 10080),
+         'month': ('months', 1), 'year': ('months', 12)}
+
+# - the units only understood when `seconds` are allowed, eg. by the daemon
+SECOND_UNITS = {'sec': ('seconds', 1), 'second': ('seconds', 1)}
+
+
+def _tokenize(timespec):
+    text = re.sub(r'\b([ap])\.m\.', r'\1m', timespec.strip().lower())
+    tokens, position = [], 0
+    while position < len(text):
+        match = token_re.match(text, position)
+        if not match:
+            raise ValueError('Unexpected {!r} in timespec {!r}'.format(text[position:], timespec))
+        position = match.end()
+        if match.lastgroup != 'space':
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+
+def _year(text):
+    year = int(text)
+    if len(text) == 2:
+        year += 2000 if year < 70 else 1900
+    return year
+
+
+class _Parser(object):
+    """Parse the tokens of a timespec into its time of day, date and increments"""
+
+    def __init__(self, timespec, seconds):
+        self.timespec = timespec
+        self.tokens = _tokenize(timespec)
+        self.units = dict(UNITS, **SECOND_UNITS) if seconds else UNITS
+        self.position = 0
+        self.now = False
+        self.clock = None
+        self.utc = False
+        # - a callable returning the date from the current date
+        self.date = None
+        self.increments = []
+
+    def error(self, message='Invalid timespec {!r}'):
+        return ValueError(message.format(self.timespec))
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if self.peek() == ('word', 'now'):
+            self.take()
+            self.now = True
+        elif self.parse_time():
+            self.parse_date()
+        elif self.parse_date():
+            self.parse_time()
+        else:
+            raise self.error()
+        self.parse_increments()
+        if self.position != len(self.tokens):
+            raise self.error('Unexpected {!r} in timespec {{!r}}'.format(self.peek()[1]))
+        return self
+
+    def parse_time(self):
+        kind, value = self.peek()
+        suffix = self.peek(1)[1]
+        if kind == 'clock':
+            hour, minute = (int(part) for part in value.split(':'))
+        elif kind == 'number' and len(value) == 4:
+            hour, minute = int(value[:2]), int(value[2:])
+        elif kind == 'number' and len(value) <= 2 and suffix in ('am', 'pm'):
+            hour, minute = int(value), 0
+        elif kind == 'word' and value in NAMED_TIMES:
+            self.take()
+            self.clock = NAMED_TIMES[value]
+            self.parse_utc()
+            return True
+        else:
+            return False
+        self.take()
+        if suffix in ('am', 'pm'):
+            self.take()
+            if not 1 <= hour <= 12:
+                raise self.error()
+            hour = hour % 12 + (12 if suffix == 'pm' else 0)
+        if hour > 23 or minute > 59:
+            raise self.error()
+        self.clock = (hour, minute)
+        self.parse_utc()
+        return True
+
+    def parse_utc(self):
+        if self.peek() in (('word', 'utc'), ('word', 'gmt'), ('word', 'z')):
+            self.take()
+            self.utc = True
+
+    def parse_date(self):
+        kind, value = self.peek()
+        if kind == 'word' and value in ('today', 'tomorrow'):
+            self.take()
+            days = 1 if value == 'tomorrow' else 0
+            self.date = lambda today: today + timedelta(days=days)
+        elif kind == 'word' and value in WEEKDAYS:
+            self.take()
+            weekday = WEEKDAYS[value]
+            self.date = lambda today: today + timedelta(days=(weekday - today.weekday()) % 7)
+        elif kind == 'word' and value in MONTHS:
+            self.take()
+            if self.peek()[0] != 'number':
+                raise self.error()
+            day = int(self.take()[1])
+            if self.peek() == ('symbol', ','):
+                self.take()
+            self.set_date(MONTHS[value], day, self.take_year())
+        elif kind == 'number' and len(value) <= 2 and self.peek(1)[0] == 'word' and self.peek(1)[1] in MONTHS:
+            self.take()
+            month = MONTHS[self.take()[1]]
+            self.set_date(month, int(value), self.take_year())
+        elif kind == 'isodate':
+            self.take()
+            year, month, day = value.split('-')
+            self.set_date(int(month), int(day), int(year))
+        elif kind == 'slashdate':
+            self.take()
+            month, day, year = value.split('/')
+            self.set_date(int(month), int(day), _year(year))
+        elif kind == 'dotdate':
+            self.take()
+            day, month, year = value.split('.')
+            self.set_date(int(month), int(day), _year(year))
+        elif kind == 'number' and len(value) in (6, 8):
+            self.take()
+            self.set_date(int(value[:2]), int(value[2:4]), _year(value[4:]))
+        else:
+            return False
+        return True
+
+    def take_year(self):
+        kind, value = self.peek()
+        if kind == 'number' and len(value) in (2, 4) and self.peek(1)[1] not in ('am', 'pm'):
+            self.take()
+            return _year(value)
+        return None
+
+    def set_date(self, month, day, year):
+        try:
+            # - validated against a leap year when the year is not known yet
+            date(year or 2000, month, day)
+        except ValueError:
+            raise self.error()
+
+        def resolve(today):
+            if year is not None:
+                return date(year, month, day)
+            for candidate in range(today.year, today.year + 8):
+                try:
+                    resolved = date(candidate, month, day)
+                except ValueError:
+                    continue
+                if resolved >= today:
+                    return resolved
+        self.date = resolve
+
+    def parse_increments(self):
+        while True:
+            kind, value = self.peek()
+            if kind == 'symbol' and value in '+-':
+                self.take()
+                kind, count = self.take()
+                if kind != 'number':
+                    raise self.error()
+                count = int(count) if value == '+' else -int(count)
+            elif (kind, value) == ('word', 'next'):
+                self.take()
+                count = 1
+            else:
+                return
+            unit = self.take()[1] or ''
+            unit = unit[:-1] if unit.endswith('s') and unit[:-1] in self.units else unit
+            if unit not in self.units:
+                raise self.error('Unknown unit {!r} in timespec {{!r}}'.format(unit))
+            field, multiplier = self.units[unit]
+            self.increments.append((field, count * multiplier))
+
+
+def _add_months(when, months):
+    month = when.month - 1 + months
+    year, month = when.year + month // 12, month % 12 + 1
+    day = min(when.day, calendar.monthrange(year, month)[1])
+    return when.replace(year=year, month=month, day=day)
+
+
+def _as_datetime(now):
+    if now is None:
+        return datetime.now()
+    if isinstance(now, (int, float)):
+        return datetime.fromtimestamp(now)
+    return now
+
+
+def to_epoch(when):
+    """Return the seconds since the epoch of a naive local datetime"""
+    return time.mktime(when.timetuple()) + when.microsecond / 1e6
+
+
+def parse_timespec(timespec, now=None, seconds=False):
+    """Return the naive local datetime at which `at` would run a job scheduled
+    at `timespec`.
+
+    :param str timespec: A timespec as understood by at(1).
+    :param now: The current time, as a datetime or seconds since the epoch.
+        Default: the current time
+    :param bool seconds: Whether to keep the seconds of the current time and
+        accept increments in seconds, unlike `at` which works with minutes.
+        Default: False
+    :raises ValueError: If `timespec` is not a valid timespec.
+    :rtype: datetime
+    """
+    parsed = _Parser(timespec, seconds).parse()
+    now = _as_datetime(now)
+    if not seconds:
+        now = now.replace(second=0, microsecond=0)
+    if parsed.utc:
+        # - the time and date are those of UTC, turned back into local time below
+        utc_now = datetime.utcfromtimestamp(to_epoch(now))
+        offset, now = now - utc_now, utc_now
+
+    when = now
+    if not parsed.now:
+        when = datetime.combine(parsed.date(now.date()) if parsed.date else now.date(),
+                                now.time() if parsed.clock is None
+                                else now.time().replace(hour=parsed.clock[0], minute=parsed.clock[1],
+                                                        second=0, microsecond=0))
+        if parsed.date is None and when < now:
+            when += timedelta(days=1)
+    if parsed.utc:
+        when += offset
+    for field, count in parsed.increments:
+        if field == 'months':
+            when = _add_months(when, count)
+        else:
+            when += timedelta(**{field: count})
+    return when
+
+
+AT_TIME_RE = re.compile(r'^(?:[A-Za-z]{3} +)?(?P<month>[A-Za-z]{3}) +(?P<day>\d{1,2}) +'
+                        r'(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))? +(?P<year>\d{4})$')
+
+ISO_AT_TIME_RE = re.compile(r'^(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2}) +'
+                            r'(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?$')
+
+# - the run times already parsed, of which there are few distinct ones as
+# jobs tend to be scheduled at the same times
+_at_time_cache = {}
+AT_TIME_CACHE_SIZE = 4096
+
+
+def parse_at_time(text):
+    """Return the datetime for a run time as printed by the `at` command, eg.
+    'Sat Oct 17 10:00:00 2026' or '2026-10-17 10:00'.
+
+    :raises ValueError: If `text` is not a run time.
+    """
+    try:
+        return _at_time_cache[text]
+    except KeyError:
+        pass
+    match = AT_TIME_RE.match(text) or ISO_AT_TIME_RE.match(text)
+    month = match and match.group('month')
+    month = month and (int(month) if month.isdigit() else MONTHS.get(month.lower()))
+    if month:
+        when = datetime(int(match.group('year')), month, int(match.group('day')),
+                        int(match.group('hour')), int(match.group('minute')), int(match.group('second') or 0))
+    else:
+        # - `at` printing run times in the format of the current locale,
+        # which may use month names of the same shape as the English ones
+        when = datetime.strptime(text, '%c')
+    if len(_at_time_cache) >= AT_TIME_CACHE_SIZE:
+        _at_time_cache.clear()
+    _at_time_cache[text] = when
+    return when
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import shutil
+import threading
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+from unittest import mock
+
+from expyre import aio
+from expyre.daemon import Daemon
+
+from .test_index import make_script
+
+
+class FakeProcess(object):
+
+    def __init__(self, returncode, stdout, on_input=None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.on_input = on_input
+
+    async def communicate(self, input=None):
+        if input is not None and self.on_input:
+            self.on_input(input.decode('utf-8'))
+        return self.stdout.encode('utf-8'), None
+
+
+class FakeAt(object):
+    """Stand-in for `asyncio.create_subprocess_exec` running the `at` command"""
+
+    def __init__(self):
+        self.scripts = {}
+        self.calls = []
+
+    async def __call__(self, atcmd, *args, **kwargs):
+        self.calls.append(args)
+        if args[0] == '-l':
+            return FakeProcess(0, ''.join('{}\tSat Oct 17 10:00:00 2026 a user\n'.format(job_id)
+                                          for job_id in sorted(self.scripts)))
+        if args[0] == '-c':
+            if args[1] not in self.scripts:
+                return FakeProcess(1, 'Cannot find jobid {}\n'.format(args[1]))
+            return FakeProcess(0, self.scripts[args[1]])
+        if args[0] == '-r':
+            for job_id in args[1:]:
+                del self.scripts[job_id]
+            return FakeProcess(0, '')
+        if args[0] == 'invalid':
+            return FakeProcess(1, 'syntax error. Last token seen: invalid\nGarbled time\n')
+        job_id = str(len(self.calls))
+        return FakeProcess(0, 'warning: commands will be executed using /bin/sh\n'
+                              'job {} at Sat Oct 17 10:00:00 2026\n'.format(job_id),
+                           on_input=lambda script: self.scripts.__setitem__(job_id, script))
+
+
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.fake_at = FakeAt()
+        self.patches = [mock.patch('asyncio.create_subprocess_exec', new=self.fake_at),
+                        mock.patch('expyre.helpers.pre_exec_check'),
+                        mock.patch.dict(os.environ, {'EXPYRE_INDEX': os.path.join(self.tmpdir, 'jobs.json')})]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def run_coroutine(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_expire_path(self):
+        job = self.run_coroutine(aio.expire_path('/path/to/file', 'now + 1day'))
+        self.assertEqual(job.path, '/path/to/file')
+        self.assertEqual(job.timestamp, datetime(2026, 10, 17, 10, 0))
+        self.assertIn('unless accessed after', job.conditions)
+
+    def test_expire_path_replace(self):
+        self.fake_at.scripts = {'1': make_script('/path/to/file') + make_script('/path/to/other'),
+                                '2': make_script('/path/to/file')}
+        job = self.run_coroutine(aio.expire_path('/path/to/file', 'now + 1day', replace=True))
+        jobs = self.run_coroutine(aio.get_scheduled_jobs())
+        self.assertEqual(jobs['/path/to/file'].job_id, job.job_id)
+        # - the job of both paths was rewritten with the other path only
+        self.assertNotIn(jobs['/path/to/other'].job_id, ('1', '2', job.job_id))
+        self.assertEqual(set(self.fake_at.scripts), set([job.job_id, jobs['/path/to/other'].job_id]))
+
+        filename = os.path.join(self.tmpdir, 'file')
+        self.run_coroutine(self._write_expiring(filename))
+        self.run_coroutine(self._write_expiring(filename))
+        self.assertEqual([job_spec.path for job_spec in self.run_coroutine(aio._job_specs())].count(filename), 1)
+
+    async def _write_expiring(self, filename):
+        async with aio.open_expiring(filename, 'now + 1day', True, True, 'w', replace=True) as fd:
+            fd.write('data')
+
+    def test_garbled_time(self):
+        with self.assertRaisesRegex(RuntimeError, 'Timespec not recognized'):
+            self.run_coroutine(aio.expire_path('/path/to/file', 'invalid'))
+
+    def test_get_scheduled_jobs(self):
+        self.fake_at.scripts = {'1': make_script('/path/to/file'),
+                                '2': 'echo unrelated\n',
+                                '3': make_script('/path/to/other')}
+        jobs = self.run_coroutine(aio.get_scheduled_jobs(concurrency=2))
+        self.assertEqual(sorted(jobs), ['/path/to/file', '/path/to/other'])
+        self.assertEqual(jobs['/path/to/other'].job_id, '3')
+
+    def test_remove_from_schedule(self):
+        self.fake_at.scripts = {'1': make_script('/path/to/file')}
+        result = self.run_coroutine(aio.remove_from_schedule(['/path/to/file', '/path/to/other']))
+        self.assertEqual(result, (['/path/to/file'], ['/path/to/other']))
+        self.assertEqual(self.fake_at.scripts, {})
+
+    def test_open_expiring(self):
+        filename = os.path.join(self.tmpdir, 'file')
+
+        async def write():
+            async with aio.open_expiring(filename, 'now + 1day', True, True, 'w') as fd:
+                fd.write('data')
+
+        self.run_coroutine(write())
+        self.assertEqual(self.fake_at.calls[-1], ('now + 1day',))
+
+
+    def test_daemon(self):
+        # - with EXPYRE_DAEMON set, the daemon is used rather than atd
+        socket_path = os.path.join(self.tmpdir, 'expyre.sock')
+        server = Daemon(socket_path, os.path.join(self.tmpdir, 'journal.jsonl'))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        filename = os.path.join(self.tmpdir, 'file')
+        open(filename, 'w').close()
+
+        with mock.patch.dict(os.environ, {'EXPYRE_DAEMON': socket_path}):
+            job = self.run_coroutine(aio.expire_path(filename, 'now + 1 hour', replace=True))
+            jobs = self.run_coroutine(aio.get_scheduled_jobs(self.tmpdir))
+            self.assertEqual(jobs[filename].job_id, job.job_id)
+            self.assertEqual(self.run_coroutine(aio.remove_from_schedule([filename])), ([filename], []))
+            self.assertEqual(self.run_coroutine(aio.get_scheduled_jobs()), {})
+        self.assertEqual(self.fake_at.calls, [])
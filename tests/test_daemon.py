@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+import time
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre.daemon import Daemon, DaemonClient, Journal, Scheduler, expire, resolve_timespec
+from expyre.helpers import expire_path, get_scheduled_jobs, remove_from_schedule
+
+
+class TestResolveTimespec(unittest.TestCase):
+
+    def test_relative(self):
+        self.assertEqual(resolve_timespec('now', now=100), 100)
+        self.assertEqual(resolve_timespec('now + 30 seconds', now=100), 130)
+        self.assertEqual(resolve_timespec('now+2days', now=100), 100 + 2 * 86400)
+        self.assertEqual(resolve_timespec('now + 1 hour', now=100), 3700)
+
+    def test_absolute(self):
+        when = datetime(2026, 10, 17, 10, 0, 30)
+        self.assertEqual(resolve_timespec(when), time.mktime(when.timetuple()))
+        self.assertEqual(resolve_timespec(12345), 12345.0)
+
+    def test_at_timespecs(self):
+        now = time.mktime(datetime(2026, 10, 17, 10, 0, 30).timetuple())
+        self.assertEqual(resolve_timespec('teatime', now=now),
+                         time.mktime(datetime(2026, 10, 17, 16, 0).timetuple()))
+        self.assertEqual(resolve_timespec('18:00 tomorrow', now=now),
+                         time.mktime(datetime(2026, 10, 18, 18, 0).timetuple()))
+
+    def test_garbled(self):
+        self.assertRaises(RuntimeError, resolve_timespec, 'now + 2 fortnights')
+        self.assertRaises(RuntimeError, resolve_timespec, 'tea time')
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.journal = os.path.join(self.tmpdir, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_journal_replay(self):
+        scheduler = Scheduler(Journal(self.journal))
+        jobs = scheduler.add(['/a', '/b', '/c'], time.time() + 60, True, False)
+        scheduler.cancel([jobs[1]['job_id']])
+
+        # - a crash half way through writing a record
+        with open(self.journal, 'a') as fd:
+            fd.write('{"op": "add", "jo')
+
+        scheduler = Scheduler(Journal(self.journal))
+        self.assertEqual(sorted(job['path'] for job in scheduler.list()), ['/a', '/c'])
+        self.assertEqual(scheduler.add(['/d'], time.time(), False, False)[0]['job_id'], '4')
+
+    def test_compaction(self):
+        journal = Journal(self.journal)
+        scheduler = Scheduler(journal)
+        for _ in range(5):
+            jobs = scheduler.add(['/a'] * 300, time.time() + 60, False, False)
+            scheduler.cancel([job['job_id'] for job in jobs])
+        self.assertLess(journal._records, 1000)
+        self.assertEqual(Scheduler(Journal(self.journal)).list(), [])
+
+    def test_list_prefix(self):
+        scheduler = Scheduler(Journal(self.journal))
+        scheduler.add(['/data/foo', '/data/foo/bar', '/data/foobar'], time.time() + 60, False, False)
+        self.assertEqual(sorted(job['path'] for job in scheduler.list('/data/foo')),
+                         ['/data/foo', '/data/foo/bar'])
+
+    def test_run_expires_due_jobs_in_order(self):
+        scheduler = Scheduler(Journal(self.journal))
+        expired = []
+        scheduler.add(['/later'], time.time() + 0.2, False, False)
+        scheduler.add(['/never'], time.time() + 3600, False, False)
+        cancelled = scheduler.add(['/cancelled'], time.time(), False, False)
+        scheduler.add(['/now'], time.time(), False, False)
+        scheduler.cancel([cancelled[0]['job_id']])
+
+        with mock.patch('expyre.daemon.expire', side_effect=lambda job: expired.append(job['path'])):
+            runner = threading.Thread(target=scheduler.run)
+            runner.start()
+            time.sleep(0.5)
+            scheduler.stop()
+            runner.join()
+        self.assertEqual(expired, ['/now', '/later'])
+        self.assertEqual([job['path'] for job in scheduler.list()], ['/never'])
+
+
+class TestExpire(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_job(self, path, scheduled_at, **conditions):
+        job = {'path': path, 'scheduled_at': scheduled_at, 'unless_modified': False, 'unless_accessed': False}
+        job.update(conditions)
+        return job
+
+    def test_expire_file_and_directory(self):
+        filename = os.path.join(self.tmpdir, 'file')
+        dirname = os.path.join(self.tmpdir, 'dir')
+        os.makedirs(os.path.join(dirname, 'sub'))
+        open(filename, 'w').close()
+        self.assertTrue(expire(self.make_job(filename, time.time())))
+        self.assertTrue(expire(self.make_job(dirname, time.time())))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        self.assertFalse(expire(self.make_job(filename, time.time())))
+
+    def test_unless_modified(self):
+        filename = os.path.join(self.tmpdir, 'file')
+        open(filename, 'w').close()
+        self.assertFalse(expire(self.make_job(filename, time.time() - 60, unless_modified=True)))
+        self.assertTrue(os.path.exists(filename))
+        self.assertTrue(expire(self.make_job(filename, time.time() + 60, unless_modified=True)))
+
+
+class TestDaemonClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'expyre.sock')
+        self.server = Daemon(self.socket_path, os.path.join(self.tmpdir, 'journal.jsonl'))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.env = mock.patch.dict(os.environ, {'EXPYRE_DAEMON': self.socket_path})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_helpers_use_daemon(self):
+        filename = os.path.join(self.tmpdir, 'file')
+        open(filename, 'w').close()
+        job = expire_path(filename, 'now + 1 hour', unless_modified=True, unless_accessed=False)
+        self.assertEqual(job.path, filename)
+        self.assertTrue(job.conditions.startswith('unless modified after'))
+
+        jobs = get_scheduled_jobs(self.tmpdir)
+        self.assertEqual(list(jobs), [filename])
+        self.assertEqual(jobs[filename].job_id, job.job_id)
+
+        self.assertEqual(remove_from_schedule([filename, '/not/scheduled']), ([filename], ['/not/scheduled']))
+        self.assertEqual(get_scheduled_jobs(), {})
+
+    def test_sub_minute_expiry(self):
+        filename = os.path.join(self.tmpdir, 'file')
+        open(filename, 'w').close()
+        expire_path(filename, datetime.fromtimestamp(time.time() + 0.2), False, False)
+        time.sleep(0.6)
+        self.assertFalse(os.path.exists(filename))
+
+    def test_garbled_time(self):
+        self.assertRaisesRegexp(RuntimeError, 'Timespec not recognized', expire_path, '/path', 'whenever')
+
+    def test_unreachable(self):
+        client = DaemonClient(os.path.join(self.tmpdir, 'missing.sock'))
+        self.assertRaisesRegexp(RuntimeError, 'Could not reach', client.jobs)
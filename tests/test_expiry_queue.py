@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from datetime import datetime
+from datetime import timedelta
+from tempfile import mkdtemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre.expiry_queue import ExpiryQueue
+from expyre.helpers import JobSpec
+from expyre.helpers import expire_path
+from expyre.helpers import open_expiring
+
+
+class TestExpiryQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.next_id = 1
+
+        def expire_paths(paths, timespec, unless_modified=True, unless_accessed=True, batch_size=1000,
+                         **options):
+            self.calls.append((list(paths), timespec, unless_modified, unless_accessed, options))
+            job_id, self.next_id = str(self.next_id), self.next_id + 1
+            return [JobSpec(job_id, path, datetime(2026, 10, 17, 10, 0), '') for path in paths]
+
+        patch = mock.patch('expyre.helpers.expire_paths', side_effect=expire_paths)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_coalesces_by_timespec_and_options(self):
+        with ExpiryQueue(max_delay=60) as queue:
+            futures = [queue.submit('/a', 'now + 1day'),
+                       queue.submit('/b', 'now + 1day'),
+                       queue.submit('/c', 'now + 2days'),
+                       queue.submit('/d', 'now + 1day', strategy='rename-reap')]
+            queue.flush()
+            self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(sorted(call[0] for call in self.calls), [['/a', '/b'], ['/c'], ['/d']])
+        self.assertEqual(futures[0].result().job_id, futures[1].result().job_id)
+        self.assertEqual(futures[3].result().path, '/d')
+
+    def test_coalesces_by_resolved_minute(self):
+        with ExpiryQueue(max_delay=60) as queue:
+            queue.submit('/a', '18:00 tomorrow')
+            queue.submit('/b', 'tomorrow 18:00')
+            queue.submit('/c', 'garbled')
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime('18:00 %F')
+        self.assertEqual(sorted((call[0], call[1]) for call in self.calls),
+                         [(['/a', '/b'], tomorrow), (['/c'], 'garbled')])
+
+    def test_schedules_the_resolved_minute(self):
+        # - a relative timespec is not resolved again when the batch is due,
+        # and a batch due after its minute has passed is scheduled now
+        before = (datetime.now() + timedelta(days=1)).strftime('%R %F')
+        with ExpiryQueue(max_delay=60) as queue:
+            queue.submit('/a', 'now + 1day')
+            queue.submit('/b', datetime(2026, 1, 1, 10, 0))
+        after = (datetime.now() + timedelta(days=1)).strftime('%R %F')
+        (paths, timespec), past = sorted((call[0], call[1]) for call in self.calls)
+        self.assertEqual(paths, ['/a'])
+        self.assertIn(timespec, (before, after))
+        self.assertEqual(past, (['/b'], 'now'))
+
+    def test_batch_size_threshold(self):
+        queue = ExpiryQueue(max_batch=2, max_delay=60)
+        self.addCleanup(queue.close)
+        futures = [queue.submit(path, 'now + 1day') for path in ('/a', '/b', '/c')]
+        self.assertEqual(futures[1].result(timeout=5).job_id, '1')
+        self.assertFalse(futures[2].done())
+        queue.flush()
+        self.assertEqual(futures[2].result().job_id, '2')
+
+    def test_delay_threshold(self):
+        queue = ExpiryQueue(max_delay=0.05)
+        self.addCleanup(queue.close)
+        self.assertEqual(queue.submit('/a', 'now + 1day').result(timeout=5).path, '/a')
+
+    def test_close_schedules_pending_paths(self):
+        queue = ExpiryQueue(max_delay=60)
+        future = queue.submit('/a', 'now + 1day')
+        queue.close()
+        self.assertEqual(future.result(timeout=0).path, '/a')
+        self.assertRaises(RuntimeError, queue.submit, '/b', 'now + 1day')
+
+    def test_cancelled_paths_are_not_scheduled(self):
+        with ExpiryQueue(max_delay=60) as queue:
+            cancelled = queue.submit('/a', 'now + 1day')
+            future = queue.submit('/b', 'now + 1day')
+            self.assertTrue(cancelled.cancel())
+        self.assertEqual(self.calls[0][0], ['/b'])
+        self.assertEqual(future.result().path, '/b')
+
+    def test_errors_are_set_on_futures(self):
+        with mock.patch('expyre.helpers.expire_paths', side_effect=RuntimeError('Timespec not recognized')):
+            with ExpiryQueue(max_delay=60) as queue:
+                future = queue.submit('/a', 'garbled')
+        self.assertRaises(RuntimeError, future.result)
+
+    def test_expire_path_and_open_expiring(self):
+        workdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        filename = os.path.join(workdir, 'file')
+        with ExpiryQueue(max_delay=60) as queue:
+            future = expire_path('/a', 'now + 1day', queue=queue)
+            with open_expiring(filename, 'now + 1day', False, False, 'w', queue=queue) as fd:
+                fd.write('data')
+            self.assertEqual(self.calls, [])
+            queue.flush()
+        self.assertEqual(future.result().path, '/a')
+        self.assertEqual(self.calls[0][0], ['/a'])
+        self.assertEqual(self.calls[1][0], [filename])
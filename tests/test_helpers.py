@@ -1,18 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import errno
 import os
+import shutil
+import subprocess
 import time
 import unittest
 
 from datetime import datetime, timedelta
 from io import IOBase
-from tempfile import mkstemp
+from tempfile import mkdtemp, mkstemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
+from expyre import helpers
+from expyre.helpers import AtdProbe
+from expyre.helpers import JobSpec
+from expyre.helpers import JobTable
+from expyre.helpers import PathIndex
+from expyre.helpers import QueuedJob
+from expyre.helpers import arg_chunks
+from expyre.helpers import collect_stats
 from expyre.helpers import expire_path
+from expyre.helpers import expire_paths
 from expyre.helpers import get_scheduled_jobs
+from expyre.helpers import is_under
 from expyre.helpers import open_expiring
+from expyre.helpers import reap
 from expyre.helpers import remove_from_schedule
+from expyre.helpers import touched_since
 
 
 class TestOpenExpiring(unittest.TestCase):
@@ -44,3 +63,544 @@ class TestOpenExpiring(unittest.TestCase):
     def test_garbled_time(self):
         self.assertRaisesRegexp(RuntimeError, 'Timespec not recognized',
                                 expire_path, self.filename, 'now+1hr')
+
+
+# - what `at -c` shows of a job, the script being run within a heredoc
+AT_JOB = """#!/bin/sh
+# atrun uid=1000 gid=1000
+# mail user 0
+umask 22
+HOME=/home/user; export HOME
+cd /home/user || {{
+	 echo 'Execution directory inaccessible' >&2
+	 exit 1
+}}
+${{SHELL:-/bin/sh}} << 'marcinDELIMITER{job_id:0>8}'
+{script}
+marcinDELIMITER{job_id:0>8}
+"""
+
+
+class FakeBackend(object):
+    """In-memory stand-in for the `at` queue"""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.queue = {}
+        self.queues = {}
+        self.next_id = 1
+
+    def submit(self, script, timespec, queue=None):
+        job_id, self.next_id = str(self.next_id), self.next_id + 1
+        timestamp = datetime(2026, 10, 17, 10, 0)
+        self.queue[job_id] = (timestamp, script)
+        self.queues[job_id] = queue or 'a'
+        return job_id, timestamp
+
+    def jobs(self):
+        return [QueuedJob(job_id, timestamp, self.queues.get(job_id, 'a'))
+                for job_id, (timestamp, _) in sorted(self.queue.items())]
+
+    def script(self, job_id):
+        return AT_JOB.format(job_id=job_id, script=self.queue[job_id][1])
+
+    def remove(self, *job_ids):
+        missing = [job_id for job_id in job_ids if job_id not in self.queue]
+        for job_id in job_ids:
+            self.queue.pop(job_id, None)
+        if missing:
+            raise subprocess.CalledProcessError(1, 'at', 'Cannot find jobid {}'.format(missing[0]))
+        return ''
+
+
+class TestExpirePaths(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.patches = [mock.patch('expyre.helpers.at_submit', side_effect=self.backend.submit),
+                        mock.patch('expyre.helpers.pre_exec_check'),
+                        mock.patch('expyre.helpers.get_backend', return_value=self.backend),
+                        mock.patch('expyre.helpers.JobIndex.save')]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_single_job(self):
+        paths = ['/path/to/file{}'.format(i) for i in range(5)]
+        job_specs = expire_paths(paths, 'now + 1day')
+        self.assertEqual([job.path for job in job_specs], paths)
+        self.assertEqual(set(job.job_id for job in job_specs), set(['1']))
+        self.assertEqual(len(self.backend.queue), 1)
+
+        script = self.backend.script('1')
+        for path in paths:
+            self.assertIn('# expyre path: {}\n'.format(path), script)
+            self.assertIn("stat -c '%Y' {})".format(path), script)
+
+        scheduled = get_scheduled_jobs()
+        self.assertEqual(sorted(scheduled), paths)
+        self.assertTrue(scheduled[paths[0]].conditions.startswith('unless accessed after'))
+
+    def test_unsafe_paths(self):
+        path = '/scratch/a b; touch /tmp/pwned'
+        expire_paths([path], 'now + 1day', unless_accessed=False)
+        self.assertIn("stat -c '%Y' '{}')".format(path), self.backend.script('1'))
+        self.assertIn("rm  '{}'".format(path), self.backend.script('1'))
+        self.assertEqual(list(get_scheduled_jobs()), [path])
+
+        self.assertRaises(RuntimeError, expire_paths, ['/scratch/a\n# expyre path: /etc'], 'now + 1day')
+        self.assertEqual(len(self.backend.queue), 1)
+
+    def test_batch_size(self):
+        job_specs = expire_paths(['/a', '/b', '/c'], 'now + 1day', batch_size=2)
+        self.assertEqual([job.job_id for job in job_specs], ['1', '1', '2'])
+
+    def test_remove_one_path_rewrites_job(self):
+        expire_paths(['/a', '/b', '/c'], 'now + 1day', unless_modified=False, unless_accessed=False)
+        success, failure = remove_from_schedule(['/b', '/d'])
+        self.assertEqual((success, failure), (['/b'], ['/d']))
+
+        self.assertEqual(list(self.backend.queue), ['2'])
+        self.assertEqual(sorted(get_scheduled_jobs()), ['/a', '/c'])
+        self.assertNotIn('/b', self.backend.queue['2'][1])
+        self.assertIn('rm  /c', self.backend.queue['2'][1])
+        # - the rewritten job only holds the blocks of the paths, not the
+        # terminator of the heredoc of the original job
+        self.assertNotIn('marcinDELIMITER', self.backend.queue['2'][1])
+        self.assertEqual(helpers._parse_script(self.backend.script('2')),
+                         [(path, '') for path in ('/a', '/c')])
+
+    def test_list_prefix_is_component_aware(self):
+        expire_paths(['/data/foo', '/data/foo/bar', '/data/foobar'], 'now + 1day')
+        self.assertEqual(sorted(get_scheduled_jobs('/data/foo')), ['/data/foo', '/data/foo/bar'])
+        self.assertEqual(sorted(get_scheduled_jobs('/data/foo/')), ['/data/foo', '/data/foo/bar'])
+
+    def test_remove_recursive(self):
+        expire_paths(['/data/foo/a', '/data/foo/b/c', '/data/foobar'], 'now + 1day')
+        expire_path('/data/foo', 'now + 1day')
+        success, failure = remove_from_schedule(['/data/foo', '/data/empty'], recursive=True)
+        self.assertEqual(success, ['/data/foo', '/data/foo/a', '/data/foo/b/c'])
+        self.assertEqual(failure, ['/data/empty'])
+        self.assertEqual(list(get_scheduled_jobs()), ['/data/foobar'])
+
+    def test_remove_all_paths_removes_job(self):
+        expire_paths(['/a', '/b'], 'now + 1day')
+        self.assertEqual(remove_from_schedule(['/b', '/a']), (['/b', '/a'], []))
+        self.assertEqual(self.backend.queue, {})
+
+    def test_remove_uses_one_invocation(self):
+        for path in ('/a', '/b', '/c'):
+            expire_path(path, 'now + 1day')
+        with mock.patch.object(self.backend, 'remove', wraps=self.backend.remove) as remove:
+            self.assertEqual(remove_from_schedule(['/a', '/b', '/c']), (['/a', '/b', '/c'], []))
+        remove.assert_called_once_with('1', '2', '3')
+
+    def test_remove_job_fired_mid_removal(self):
+        for path in ('/a', '/b'):
+            expire_path(path, 'now + 1day')
+        real_remove = self.backend.remove
+
+        def fire_then_remove(*job_ids):
+            # - job 1 is executed by atd before `at -r` gets to it
+            del self.backend.queue['1']
+            return real_remove(*job_ids)
+
+        with mock.patch.object(self.backend, 'remove', side_effect=fire_then_remove):
+            self.assertEqual(remove_from_schedule(['/a', '/b']), (['/a', '/b'], []))
+        self.assertEqual(self.backend.queue, {})
+
+    def test_remove_cancels_duplicates(self):
+        expire_path('/a', 'now + 1day')
+        expire_paths(['/a', '/b'], 'now + 1day')
+        self.assertEqual(remove_from_schedule(['/a']), (['/a'], []))
+        self.assertEqual(list(get_scheduled_jobs()), ['/b'])
+        self.assertEqual(list(self.backend.queue), ['3'])
+
+    def test_replace(self):
+        expire_path('/a', 'now + 1day')
+        expire_paths(['/a', '/b'], 'now + 1day')
+        job_spec = expire_path('/a', 'now + 2days', replace=True)
+        self.assertEqual(job_spec.job_id, '3')
+        self.assertEqual(sorted(self.backend.queue), ['3', '4'])
+        self.assertEqual(dict((path, job.job_id) for path, job in get_scheduled_jobs().items()),
+                         {'/a': '3', '/b': '4'})
+
+    def test_replace_uses_index_lookup(self):
+        expire_path('/a', 'now + 1day')
+        expire_path('/b', 'now + 1day')
+        with mock.patch('expyre.helpers.JobIndex.load', return_value=helpers.JobIndex()) as load:
+            load.return_value.add('1', datetime(2026, 10, 17, 10, 0).isoformat(), [('/a', '')])
+            load.return_value.add('2', datetime(2026, 10, 17, 10, 0).isoformat(), [('/b', '')])
+            with mock.patch.object(self.backend, 'script') as script:
+                expire_path('/a', 'now + 1day', replace=True)
+                self.assertFalse(script.called)
+        self.assertEqual(sorted(self.backend.queue), ['2', '3'])
+
+    def test_dedupe(self):
+        expire_path('/a', 'now + 1day')
+        expire_paths(['/a', '/b'], 'now + 1day')
+        expire_path('/b', 'now + 1day')
+        duplicates, failed = helpers.dedupe(dry_run=True)
+        self.assertEqual([(job.job_id, job.path) for job in duplicates], [('1', '/a'), ('2', '/b')])
+        self.assertEqual(len(self.backend.queue), 3)
+
+        removed, failed = helpers.dedupe()
+        self.assertEqual((removed, failed), (duplicates, []))
+        self.assertEqual(dict((path, job.job_id) for path, job in get_scheduled_jobs().items()),
+                         {'/a': '4', '/b': '3'})
+        self.assertEqual(helpers.dedupe(), ([], []))
+
+    def test_at_queue(self):
+        expire_paths(['/a', '/b'], 'now + 1day', at_queue='e')
+        self.assertEqual(self.backend.queues, {'1': 'e'})
+        with mock.patch.dict(os.environ, {'EXPYRE_QUEUE': 'f'}):
+            self.assertEqual(helpers.get_queue(), 'f')
+            self.assertEqual(helpers.get_queue('e'), 'e')
+            self.assertEqual(helpers.get_queue(''), '')
+            remove_from_schedule(['/a'])
+        # - the rest of the job is rescheduled in the queue of the job, even
+        # when listing every queue
+        self.assertEqual(self.backend.queues['2'], 'e')
+        self.assertEqual(sorted(get_scheduled_jobs()), ['/b'])
+        self.backend.at_queue = 'f'
+        expire_paths(['/c', '/d'], 'now + 1day', at_queue='f')
+        remove_from_schedule(['/c'])
+        self.assertEqual(self.backend.queues['4'], 'f')
+        del self.backend.at_queue
+        with mock.patch.dict(os.environ, {'EXPYRE_QUEUE': 'ee'}):
+            self.assertRaises(RuntimeError, helpers.get_queue)
+        # - the jobs of batch queues don't run at their time
+        for queue in ('b', 'E', '='):
+            self.assertRaises(RuntimeError, helpers.get_queue, queue)
+        with mock.patch('expyre.helpers.at_call', return_value=b'') as at_call:
+            helpers.at_list('e')
+            at_call.assert_called_with((helpers.atcmd, '-l', '-q', 'e'))
+
+    def test_migrate(self):
+        expire_paths(['/a', '/b'], 'now + 1day')
+        expire_path('/c', 'now + 1day', at_queue='e')
+        moved, failed = helpers.migrate('e', dry_run=True)
+        self.assertEqual([(job.job_id, job.path) for job in moved], [('1', '/a'), ('1', '/b')])
+        self.assertEqual(len(self.backend.queue), 2)
+
+        moved, failed = helpers.migrate('e')
+        self.assertEqual(([job.path for job in moved], failed), (['/a', '/b'], []))
+        self.assertEqual([(job.job_id, job.queue) for job in self.backend.jobs()], [('2', 'e'), ('3', 'e')])
+        self.assertEqual(sorted(get_scheduled_jobs()), ['/a', '/b', '/c'])
+        self.assertEqual(helpers.migrate('e'), ([], []))
+        self.assertRaises(RuntimeError, helpers.migrate)
+
+    def test_reconcile(self):
+        workdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        paths = [os.path.join(workdir, name) for name in ('gone', 'touched', 'kept')]
+        for path in paths:
+            open(path, 'w').close()
+        expire_paths(paths[:2], 'now + 1day', unless_accessed=False)
+        expire_path(paths[2], 'now + 1day', unless_accessed=False)
+        os.unlink(paths[0])
+        later = time.time() + 120
+        os.utime(paths[1], (later, later))
+
+        result = helpers.reconcile(workers=2, dry_run=True)
+        self.assertEqual((result.paths, result.jobs, result.jobs_left), (3, 2, 2))
+        self.assertEqual([job.path for job in result.missing], paths[:1])
+        self.assertEqual([job.path for job in result.doomed], paths[1:2])
+        self.assertEqual(len(self.backend.queue), 2)
+
+        result = helpers.reconcile()
+        self.assertEqual(([job.path for job in result.removed], result.failed), (paths[:1], []))
+        self.assertEqual(result.jobs_left, 2)
+        self.assertEqual(sorted(get_scheduled_jobs()), sorted(paths[1:]))
+
+        result = helpers.reconcile(cancel_doomed=True)
+        self.assertEqual([job.path for job in result.removed], paths[1:2])
+        self.assertEqual((result.jobs, result.jobs_left), (2, 1))
+        self.assertEqual(list(get_scheduled_jobs()), paths[2:])
+
+    def test_arg_chunks(self):
+        job_ids = [str(i) for i in range(100000)]
+        with mock.patch('os.sysconf', return_value=131072):
+            chunks = list(arg_chunks(job_ids))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum(chunks, []), job_ids)
+        self.assertEqual(list(arg_chunks([])), [])
+
+
+class TestDeletionStrategies(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.tree = os.path.join(self.workdir, 'build tree')
+        for subdir in ('a', 'b', os.path.join('b', 'c')):
+            os.makedirs(os.path.join(self.tree, subdir))
+            for i in range(3):
+                open(os.path.join(self.tree, subdir, str(i)), 'w').close()
+
+    def run_script(self, **deletion):
+        script, _ = helpers._expiry_script(self.tree, 'now', False, False, time.time(), **deletion)
+        self.assertEqual(helpers._parse_script(script), [(self.tree, '')])
+        subprocess.check_call(['sh', '-c', script])
+
+    def test_rm(self):
+        self.assertEqual(helpers._deletion_action(self.tree), "rm -rf '{}'".format(self.tree))
+        self.assertEqual(helpers._deletion_action(self.tree, nice=10, strategy='rm'),
+                         "nice -n 10 rm -rf '{}'".format(self.tree))
+        self.assertEqual(helpers._deletion_action('/scratch/a; touch /tmp/pwned'),
+                         "rm  '/scratch/a; touch /tmp/pwned'")
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, helpers._deletion_action, self.tree, strategy='shred')
+
+    def test_missing_ionice(self):
+        with mock.patch('expyre.helpers.which', return_value=None):
+            self.assertRaisesRegexp(RuntimeError, 'ionice', helpers._deletion_action, self.tree, ionice=True)
+
+    def test_rename_reap(self):
+        self.run_script(strategy='rename-reap')
+        self.assertFalse(os.path.exists(self.tree))
+        trash = os.path.join(self.workdir, helpers.TRASH_DIR)
+        for _ in range(50):
+            if not os.listdir(trash):
+                break
+            time.sleep(0.1)
+        self.assertEqual(os.listdir(trash), [])
+
+    def test_throttled(self):
+        action = helpers._deletion_action(self.tree, strategy='throttled', rate=50)
+        self.assertIn("-m expyre reap --rate 50 -- '{}'".format(self.tree), action)
+        self.run_script(strategy='throttled', rate=100000)
+        self.assertFalse(os.path.exists(self.tree))
+
+    def test_reap_rate(self):
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(reap(self.tree, rate=2), 13)
+        self.assertFalse(os.path.exists(self.tree))
+        self.assertTrue(sleep.called)
+        self.assertEqual(reap(self.tree), 0)
+
+    def test_reap_failure(self):
+        unlink, locked = os.unlink, os.path.join(self.tree, 'b', 'c', '1')
+
+        def failing_unlink(path):
+            if path == locked:
+                raise OSError(errno.EACCES, 'Permission denied', path)
+            unlink(path)
+
+        with mock.patch('os.unlink', side_effect=failing_unlink):
+            self.assertRaisesRegexp(OSError, 'Could not remove 4 of the entries', reap, self.tree)
+        # - everything but the file and the 3 directories holding it was removed
+        self.assertEqual([os.path.join(root, name) for root, dirs, files in os.walk(self.tree) for name in files],
+                         [locked])
+        self.assertFalse(os.path.exists(os.path.join(self.tree, 'a')))
+
+
+class TestTreeConditions(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tree, True)
+        self.deep = os.path.join(self.tree, 'a', 'b', 'c')
+        os.makedirs(self.deep)
+        for directory in (self.tree, os.path.join(self.tree, 'a'), self.deep):
+            for i in range(3):
+                open(os.path.join(directory, str(i)), 'w').close()
+        self.cutoff = time.time() - 60
+        self.age()
+
+    def age(self):
+        # - walking the tree updates the access time of the directories, so
+        # the times are only set once it is walked
+        paths = [os.path.join(root, name) for root, dirs, files in os.walk(self.tree) for name in dirs + files]
+        for path in paths + [self.tree]:
+            os.utime(path, (self.cutoff - 3600, self.cutoff - 3600))
+
+    def test_untouched(self):
+        self.assertFalse(touched_since(self.tree, self.cutoff))
+        self.age()
+        self.assertFalse(touched_since(self.tree, self.cutoff, workers=4))
+
+    def test_modified_deep_file(self):
+        os.utime(os.path.join(self.deep, '1'), (self.cutoff - 3600, self.cutoff + 1))
+        self.assertTrue(touched_since(self.tree, self.cutoff))
+        self.assertTrue(touched_since(self.tree, self.cutoff, workers=4))
+        self.age()
+        os.utime(os.path.join(self.deep, '1'), (self.cutoff - 3600, self.cutoff + 1))
+        self.assertFalse(touched_since(self.tree, self.cutoff, modified=False))
+
+    def test_accessed_deep_file(self):
+        os.utime(os.path.join(self.deep, '1'), (self.cutoff + 1, self.cutoff - 3600))
+        self.assertTrue(touched_since(self.tree, self.cutoff, modified=False))
+        self.age()
+        os.utime(os.path.join(self.deep, '1'), (self.cutoff + 1, self.cutoff - 3600))
+        self.assertFalse(touched_since(self.tree, self.cutoff, accessed=False))
+
+    def test_stops_at_first_newer_entry(self):
+        os.utime(os.path.join(self.tree, '0'), (self.cutoff - 3600, self.cutoff + 1))
+        with mock.patch('expyre.helpers._scan_dir', wraps=helpers._scan_dir) as scanned:
+            self.assertTrue(touched_since(self.tree, self.cutoff, accessed=False))
+            self.assertEqual(scanned.call_count, 1)
+
+    def test_script(self):
+        script, _ = helpers._expiry_script(self.tree, 'now', True, False, self.cutoff, tree=True)
+        self.assertIn('-m expyre check --modified-after', script)
+        self.assertNotIn('stat -c', script)
+        os.utime(os.path.join(self.deep, '1'), (self.cutoff - 3600, self.cutoff + 1))
+        self.assertEqual(subprocess.call(['sh', '-c', script]), 1)
+        self.assertTrue(os.path.exists(self.tree))
+        self.age()
+        subprocess.check_call(['sh', '-c', script])
+        self.assertFalse(os.path.exists(self.tree))
+
+    def test_shell_stat_is_default(self):
+        script, _ = helpers._expiry_script(self.tree, 'now', True, True, self.cutoff)
+        self.assertIn('stat -c', script)
+        self.assertNotIn('expyre check', script)
+
+
+class TestAtdProbe(unittest.TestCase):
+
+    def test_result_is_cached(self):
+        probe = AtdProbe(ttl=60)
+        with mock.patch.object(probe, '_probe', return_value=True) as probed:
+            self.assertTrue(probe.is_running())
+            self.assertTrue(probe.is_running())
+            self.assertEqual(probed.call_count, 1)
+            probe.reset()
+            self.assertTrue(probe.is_running())
+            self.assertEqual(probed.call_count, 2)
+
+    def test_zero_ttl(self):
+        probe = AtdProbe(ttl=0)
+        with mock.patch.object(probe, '_probe', side_effect=[True, False]):
+            self.assertTrue(probe.is_running())
+            self.assertFalse(probe.is_running())
+
+    def test_probe_does_not_spawn_processes(self):
+        probe = AtdProbe()
+        with mock.patch('subprocess.Popen') as popen:
+            probe.is_running()
+            self.assertFalse(popen.called)
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.listing = '1\t{:%c} a user\n'.format(datetime(2018, 1, 4, 10, 0)).encode('utf-8')
+
+    def test_collect_stats(self):
+        with mock.patch('expyre.helpers.at_call', return_value=self.listing):
+            with collect_stats() as stats:
+                helpers._parse_at_list(helpers.at_list())
+                helpers._parse_script('# expyre path: /a\n# expyre conditions: \n')
+        self.assertEqual(stats.operations['at -l'][0], 1)
+        self.assertEqual(stats.operations['parse timestamp'][0], 1)
+        self.assertEqual(stats.operations['parse script'][0], 1)
+        self.assertIn('expyre_operations_total{operation="at -l"} 1', stats.prometheus())
+        self.assertIn('parse timestamp', stats.report())
+
+    def test_uninstrumented_when_disabled(self):
+        originals = (helpers.at_call, helpers._parse_script, AtdProbe._probe, vars(helpers.JobIndex)['load'])
+        with collect_stats():
+            self.assertIsNot(helpers._parse_script, originals[1])
+            with collect_stats():
+                pass
+            self.assertIsNot(helpers._parse_script, originals[1])
+        self.assertEqual((helpers.at_call, helpers._parse_script, AtdProbe._probe,
+                          vars(helpers.JobIndex)['load']), originals)
+
+    def test_write_textfile(self):
+        with collect_stats() as stats:
+            helpers._parse_script('')
+        fd, filename = mkstemp(suffix='.prom')
+        os.close(fd)
+        self.addCleanup(os.unlink, filename)
+        stats.write_textfile(filename)
+        with open(filename) as fd:
+            self.assertEqual(fd.read(), stats.prometheus())
+
+
+class TestPathIndex(unittest.TestCase):
+
+    def setUp(self):
+        paths = ['/data/foo', '/data/foo/bar', '/data/foo/bar/baz', '/data/foo-bar',
+                 '/data/foobar', '/data/fo', '/other']
+        self.index = PathIndex([JobSpec(str(i), path, None, '') for i, path in enumerate(paths)])
+
+    def subtree(self, directory):
+        return [job_spec.path for job_spec in self.index.subtree(directory)]
+
+    def test_subtree(self):
+        self.assertEqual(self.subtree('/data/foo'), ['/data/foo', '/data/foo/bar', '/data/foo/bar/baz'])
+        self.assertEqual(self.subtree('/data/foo/'), ['/data/foo', '/data/foo/bar', '/data/foo/bar/baz'])
+        self.assertEqual(self.subtree('/data/foo/bar/baz'), ['/data/foo/bar/baz'])
+        self.assertEqual(self.subtree('/data/f'), [])
+        self.assertEqual(len(self.subtree('/')), 7)
+
+    def test_duplicates(self):
+        index = PathIndex([JobSpec('1', '/a', None, ''), JobSpec('2', '/a', None, '')])
+        self.assertEqual([job_spec.job_id for job_spec in index.get('/a')], ['1', '2'])
+
+    def test_expand_large_subtree(self):
+        paths = ['/data/proj/{:03d}/file{:03d}'.format(i // 200, i % 200) for i in range(40000)]
+        job_specs = [JobSpec(str(i), path, None, '') for i, path in enumerate(paths)]
+        start = time.time()
+        expanded = helpers._expand_subtrees(['/data/proj', '/data/proj/001', '/data/other'], job_specs)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(expanded, sorted(paths) + ['/data/other'])
+
+    def test_is_under(self):
+        self.assertTrue(is_under('/data/foo', '/data/foo'))
+        self.assertTrue(is_under('/data/foo/bar', '/data/foo/'))
+        self.assertFalse(is_under('/data/foobar', '/data/foo'))
+        self.assertTrue(is_under('/data', '/'))
+
+
+class TestJobTable(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2026, 10, 17, 10, 0, 0, 250000)
+        self.job_specs = [JobSpec('1', '/data/a/log', self.now, 'unless accessed after'),
+                          JobSpec('1', '/data/b/log', self.now, 'unless accessed after'),
+                          JobSpec('2', '/data/a/out', self.now - timedelta(hours=1), ''),
+                          JobSpec('3', 'relative', self.now + timedelta(days=1), ''),
+                          JobSpec('4', '/data/a/log', self.now - timedelta(days=1), '')]
+        self.table = JobTable(self.job_specs)
+
+    def test_mapping(self):
+        expected = dict((job_spec.path, job_spec) for job_spec in self.job_specs)
+        self.assertEqual(self.table, expected)
+        self.assertEqual(list(self.table), ['/data/a/log', '/data/b/log', '/data/a/out', 'relative'])
+        self.assertEqual(len(self.table), 4)
+        self.assertEqual(self.table['/data/b/log'], self.job_specs[1])
+        self.assertEqual(self.table['/data/a/log'].job_id, '4')
+        self.assertIn('relative', self.table)
+        self.assertNotIn('/data/c/log', self.table)
+        self.assertNotIn('/data/a', self.table)
+        self.assertRaises(KeyError, self.table.__getitem__, '/data/log')
+        self.assertEqual(JobTable(), {})
+
+    def test_shared_values(self):
+        self.assertEqual(self.table._prefixes, ['/data/a/', '/data/b/', ''])
+        self.assertEqual(self.table._conditions, ['unless accessed after', ''])
+        self.assertIs(self.table['/data/a/out'].timestamp, self.table['/data/a/out'].timestamp)
+
+    def test_by_timestamp(self):
+        self.assertEqual([job_spec.path for job_spec in self.table.by_timestamp()],
+                         ['/data/a/log', '/data/a/out', '/data/b/log', 'relative'])
+        self.assertEqual([job_spec.path for job_spec in self.table.by_timestamp(reverse=True)],
+                         ['relative', '/data/b/log', '/data/a/out', '/data/a/log'])
+        self.assertEqual(list(self.table.by_timestamp()),
+                         sorted(self.table.values(), key=lambda job_spec: job_spec.timestamp))
+
+    def test_many_paths(self):
+        paths = ['/data/{}/file{}'.format(i % 7, i % 50) for i in range(1000)]
+        table = JobTable(JobSpec(str(i), path, self.now, '') for i, path in enumerate(paths))
+        self.assertEqual(list(table), list(dict.fromkeys(paths)))
+        self.assertEqual(table['/data/3/file10'].job_id, '710')
+        self.assertTrue(all(path in table for path in paths))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import unittest
+from tempfile import mkdtemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre.helpers import SCRIPT_TEMPLATE, AtCommandBackend, get_scheduled_jobs, iter_scheduled_jobs
+from expyre.index import JobIndex
+
+
+def make_script(path, conditions_string=''):
+    return 'cd /tmp || exit 1\n' + SCRIPT_TEMPLATE.format(path=path,
+                                                          conditions_string=conditions_string,
+                                                          conditions='',
+                                                          action='rm {}'.format(path))
+
+
+class TestJobIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'state', 'jobs.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        index = JobIndex(self.filename)
+        index.add('1', 'Sat Oct 17 10:00:00 2026', [('/path/to/file', ''), ('/path/to/other', '')])
+        index.add('2', 'Sat Oct 17 11:00:00 2026')
+        index.save()
+
+        index = JobIndex.load(self.filename)
+        self.assertEqual(index.lookup('1', 'Sat Oct 17 10:00:00 2026'),
+                         (True, [('/path/to/file', ''), ('/path/to/other', '')]))
+        self.assertEqual(index.lookup('2', 'Sat Oct 17 11:00:00 2026'), (True, None))
+        # - a reused job id with a different run time is not a hit
+        self.assertEqual(index.lookup('1', 'Sun Oct 18 10:00:00 2026'), (False, None))
+        self.assertEqual(index.lookup('3', 'Sat Oct 17 10:00:00 2026'), (False, None))
+
+    def test_retain(self):
+        index = JobIndex(self.filename)
+        index.add('1', 'Sat Oct 17 10:00:00 2026')
+        index.add('2', 'Sat Oct 17 11:00:00 2026')
+        index.retain(['2'])
+        self.assertNotIn('1', index)
+        self.assertIn('2', index)
+
+    def test_jobs_for(self):
+        index = JobIndex(self.filename)
+        index.add('1', 'Sat Oct 17 10:00:00 2026', [('/a', ''), ('/b', '')])
+        index.add('2', 'Sat Oct 17 11:00:00 2026', [('/a', '')])
+        index.add('3', 'Sat Oct 17 11:00:00 2026')
+        self.assertEqual(index.jobs_for('/a'), set(['1', '2']))
+        self.assertEqual(index.jobs_for('/c'), set())
+        index.retain(['2', '3'])
+        self.assertEqual(index.jobs_for('/a'), set(['2']))
+        self.assertEqual(index.jobs_for('/b'), set())
+
+    def test_load_corrupt(self):
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, 'w') as fd:
+            fd.write('{not json')
+        self.assertEqual(len(JobIndex.load(self.filename)), 0)
+
+
+class TestGetScheduledJobsIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.env = mock.patch.dict(os.environ, {'EXPYRE_INDEX': os.path.join(self.tmpdir, 'jobs.json')})
+        self.env.start()
+        self.check = mock.patch('expyre.helpers.pre_exec_check')
+        self.check.start()
+        self.queue = ['1\tSat Oct 17 10:00:00 2026 a user',
+                      '2\tSat Oct 17 11:00:00 2026 a user']
+        self.scripts = {'1': make_script('/path/to/file'), '2': 'echo unrelated\n'}
+
+    def tearDown(self):
+        self.check.stop()
+        self.env.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _list(self):
+        with mock.patch('expyre.helpers.at_list', return_value=list(self.queue)), \
+             mock.patch('expyre.helpers.at_cat', side_effect=self.scripts.get) as at_cat:
+            return get_scheduled_jobs(backend=AtCommandBackend()), at_cat.call_count
+
+    def test_only_new_jobs_are_fetched(self):
+        jobs, fetched = self._list()
+        self.assertEqual(list(jobs), ['/path/to/file'])
+        self.assertEqual(fetched, 2)
+
+        jobs, fetched = self._list()
+        self.assertEqual(list(jobs), ['/path/to/file'])
+        self.assertEqual(fetched, 0)
+
+        self.queue.append('3\tSat Oct 17 12:00:00 2026 a user')
+        self.scripts['3'] = make_script('/path/to/other')
+        jobs, fetched = self._list()
+        self.assertEqual(sorted(jobs), ['/path/to/file', '/path/to/other'])
+        self.assertEqual(fetched, 1)
+
+    def test_vanished_jobs_are_dropped(self):
+        self._list()
+        self.queue.pop(0)
+        jobs, fetched = self._list()
+        self.assertEqual(jobs, {})
+        self.assertNotIn('1', JobIndex.load())
+
+    def test_concurrent_fetch(self):
+        self.queue.append('3\tSat Oct 17 12:00:00 2026 a user')
+        self.scripts['3'] = make_script('/path/to/other')
+        with mock.patch('expyre.helpers.at_list', return_value=list(self.queue)), \
+             mock.patch('expyre.helpers.at_cat', side_effect=self.scripts.get):
+            jobs = get_scheduled_jobs(backend=AtCommandBackend(), use_index=False, workers=4)
+        self.assertEqual(sorted(jobs), ['/path/to/file', '/path/to/other'])
+
+    def test_vanished_job_does_not_abort_listing(self):
+        def at_cat(job_id):
+            if job_id == '1':
+                raise subprocess.CalledProcessError(1, 'at')
+            return self.scripts[job_id]
+        self.scripts['2'] = make_script('/path/to/other')
+        for workers in (None, 2):
+            with mock.patch('expyre.helpers.at_list', return_value=list(self.queue)), \
+                 mock.patch('expyre.helpers.at_cat', side_effect=at_cat):
+                jobs = get_scheduled_jobs(backend=AtCommandBackend(), workers=workers)
+            self.assertEqual(list(jobs), ['/path/to/other'])
+            self.assertNotIn('1', JobIndex.load())
+
+    def test_iter_yields_as_jobs_are_parsed(self):
+        self.scripts['2'] = make_script('/path/to/other')
+        with mock.patch('expyre.helpers.at_list', return_value=list(self.queue)), \
+             mock.patch('expyre.helpers.at_cat', side_effect=self.scripts.get) as at_cat:
+            jobs = iter_scheduled_jobs(backend=AtCommandBackend())
+            self.assertEqual(next(jobs).path, '/path/to/file')
+            self.assertEqual(at_cat.call_count, 1)
+            self.assertEqual([job.path for job in jobs], ['/path/to/other'])
+        self.assertIn('2', JobIndex.load())
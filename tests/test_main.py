@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import subprocess
 import sys
 import unittest
+from tempfile import mkstemp
 from datetime import datetime, timedelta
 try:
     from StringIO import StringIO
@@ -12,6 +15,7 @@ try:
 except ImportError:
     import mock
 
+from expyre import helpers
 from expyre.__main__ import main
 from expyre.helpers import JobSpec
 
@@ -98,6 +102,118 @@ class TestMain(unittest.TestCase):
             self.assertEquals('[0] /path/to/file will expire at {0:%F %R}\n'.format(self.dummy_job.timestamp),
                               self.stdout.getvalue())
 
+    def test_correct_invocation_expire_path_strategy(self):
+        with mock.patch('expyre.__main__.expire_path', return_value=self.dummy_job) as mocked:
+            main('--strategy throttled --rate 100 --nice 10 --path /path/to/file now+3days'.split())
+            mocked.assert_called_with('/path/to/file', 'now+3days', False, False,
+                                      strategy='throttled', rate=100, nice=10)
+
+    def test_strategy_with_list(self):
+        with self.assertRaises(SystemExit):
+            main('--strategy rename-reap --list'.split())
+        self.assertIn('Conflicting options', self.stderr.getvalue())
+
+    def test_reap(self):
+        with mock.patch('expyre.__main__.reap') as mocked:
+            self.assertEqual(main('reap --rate 10 /path/one /path/two'.split()), 0)
+            mocked.assert_has_calls([mock.call('/path/one', 10), mock.call('/path/two', 10)])
+        with mock.patch('expyre.__main__.reap', side_effect=[OSError(13, 'Could not remove'), 1]) as mocked:
+            self.assertEqual(main('reap /path/one /path/two'.split()), 1)
+            self.assertEqual(mocked.call_count, 2)
+            self.assertIn('Could not remove', self.stderr.getvalue())
+
+    def test_correct_invocation_expire_path_tree(self):
+        with mock.patch('expyre.__main__.expire_path', return_value=self.dummy_job) as mocked:
+            main('-m --tree --path /path/to/dir now+3days'.split())
+            mocked.assert_called_with('/path/to/dir', 'now+3days', True, False, tree=True)
+
+    def test_check(self):
+        with mock.patch('expyre.__main__.touched_since', return_value=False) as mocked:
+            self.assertEqual(main('check --accessed-after 10 --modified-after 10 /path/to/dir'.split()), 0)
+            mocked.assert_called_once_with('/path/to/dir', 10, True, True, None)
+        with mock.patch('expyre.__main__.touched_since', side_effect=[False, True]) as mocked:
+            self.assertEqual(main('check --accessed-after 10 --modified-after 20 /path/to/dir'.split()), 1)
+            self.assertEqual(mocked.call_count, 2)
+
+    def test_correct_invocation_expire_path_reschedule(self):
+        with mock.patch('expyre.__main__.expire_path', return_value=self.dummy_job) as mocked:
+            main('--reschedule --path /path/to/file now+3days'.split())
+            mocked.assert_called_with('/path/to/file', 'now+3days', False, False, replace=True)
+
+    def test_dedupe(self):
+        with mock.patch('expyre.__main__.dedupe', return_value=([self.dummy_job], [])) as mocked:
+            self.assertEqual(main('dedupe -n'.split()), 0)
+            mocked.assert_called_with(workers=None, dry_run=True)
+            self.assertEqual('Duplicate [0] /path/to/file scheduled to expire at {0:%F %R}\n'.format(
+                             self.dummy_job.timestamp), self.stdout.getvalue())
+
+    def test_queue(self):
+        with mock.patch('expyre.__main__.expire_path', return_value=self.dummy_job) as mocked:
+            main('--queue e -p /path/to/file @now'.split())
+            mocked.assert_called_with('/path/to/file', 'now', False, False, at_queue='e')
+        with mock.patch('expyre.__main__.get_scheduled_jobs', return_value={}) as mocked:
+            main('--queue e -l'.split())
+            mocked.assert_called_with('', at_queue='e')
+        with self.assertRaises(SystemExit):
+            main('--queue ab -l'.split())
+        for queue in ('b', 'E'):
+            with self.assertRaises(SystemExit):
+                main(['--queue', queue, '-l'])
+
+    def test_migrate(self):
+        with mock.patch('expyre.__main__.migrate', return_value=([self.dummy_job], [])) as mocked:
+            self.assertEqual(main('migrate --queue e'.split()), 0)
+            mocked.assert_called_with('e', workers=None, dry_run=False)
+            self.assertEqual('Moved [0] /path/to/file scheduled to expire at {0:%F %R}\n'.format(
+                             self.dummy_job.timestamp), self.stdout.getvalue())
+        with mock.patch('expyre.__main__.migrate', side_effect=RuntimeError('No dedicated at queue')):
+            self.assertEqual(main(['migrate']), -1)
+
+    def test_gc(self):
+        from expyre.helpers import ReconcileResult
+        doomed = self.dummy_job._replace(job_id='1', path='/path/to/other', conditions='unless modified after')
+        result = ReconcileResult(3, 2, [self.dummy_job], [doomed], [self.dummy_job], [], 1)
+        with mock.patch('expyre.__main__.reconcile', return_value=result) as mocked:
+            self.assertEqual(main('gc --queue e -w 4'.split()), 0)
+            mocked.assert_called_with(workers=4, dry_run=False, cancel_doomed=False, at_queue='e')
+            self.assertEqual(self.stdout.getvalue(),
+                             'Missing [0] /path/to/file\n'
+                             'Doomed [1] /path/to/other (unless modified after)\n')
+            self.assertIn('Cancelled 1 of 3 scheduled paths, the queue shrank from 2 to 1 jobs',
+                          self.stderr.getvalue())
+        with mock.patch('expyre.__main__.reconcile', return_value=result._replace(removed=[])):
+            self.assertEqual(main('gc --cancel-doomed -n'.split()), 0)
+            self.assertIn('Would cancel 2 of 3 scheduled paths', self.stderr.getvalue())
+
+    def test_sweep(self):
+        from expyre.sweep import SweepResult
+        with mock.patch('expyre.__main__.sweep', return_value=SweepResult(10, 2, 0)) as mocked:
+            self.assertEqual(main(['sweep', '/scratch', '--policy', 'f:*.tmp:2d', '--at', 'now + 1day']), 0)
+            args, kwargs = mocked.call_args
+            self.assertEqual(args[0], '/scratch')
+            self.assertEqual(args[2], 'schedule')
+            self.assertEqual(kwargs['timespec'], 'now + 1day')
+            self.assertIn('10 paths scanned, 2 matched', self.stderr.getvalue())
+
+    def test_sweep_requires_action(self):
+        with self.assertRaises(SystemExit):
+            main(['sweep', '/scratch', '--policy', 'f:*.tmp:2d'])
+        with self.assertRaises(SystemExit):
+            main(['sweep', '/scratch', '--policy', 'f:*.tmp', '--delete'])
+
+    def test_quota(self):
+        from expyre.quota import QuotaResult
+        with mock.patch('expyre.__main__.enforce_quota',
+                        return_value=QuotaResult(3 << 30, ['/cache/a'], 1 << 30, [])) as mocked:
+            self.assertEqual(main('quota /cache --max-size 2G --by mtime'.split()), 0)
+            args, kwargs = mocked.call_args
+            self.assertEqual(args, ('/cache', 2 << 30, None, 'mtime'))
+            self.assertEqual((kwargs['unless_modified'], kwargs['unless_accessed']), (True, False))
+            self.assertEqual(self.stdout.getvalue(), '')
+            self.assertIn('1 files deleted freeing 1073741824 bytes', self.stderr.getvalue())
+        with self.assertRaises(SystemExit):
+            main('quota /cache --max-size lots'.split())
+
     def test_correct_invocation_remove_from_schedule_single_path(self):
         with mock.patch('expyre.__main__.remove_from_schedule', return_value=[['/path/to/file'], []]) as mocked:
             main(['--reset', '/path/to/file'])
@@ -130,6 +246,19 @@ class TestMain(unittest.TestCase):
             self.assertSequenceEqual('/path/to/file scheduled to expire at {0:%F %R} \n'.format(self.dummy_job.timestamp),
                                      sys.stdout.getvalue())
 
+    def test_stats(self):
+        def get_scheduled_jobs(*args, **kwargs):
+            helpers._parse_script('')
+            return {}
+        with mock.patch('expyre.__main__.get_scheduled_jobs', side_effect=get_scheduled_jobs):
+            fd, filename = mkstemp(suffix='.prom')
+            os.close(fd)
+            self.addCleanup(os.unlink, filename)
+            main(['--stats', '--stats-file', filename, '--list'])
+            self.assertIn('parse script', self.stderr.getvalue())
+            with open(filename) as fd:
+                self.assertIn('expyre_operations_total{operation="parse script"} 1', fd.read())
+
     def test_correct_invocation_get_scheduled_jobs_multiple(self):
         now = datetime.now()
         later = datetime.now()+timedelta(hours=2)
@@ -150,8 +279,187 @@ class TestMain(unittest.TestCase):
                      '/path/to/last scheduled to expire at {2:%F %R} \n').format(earlier, now, later),
                     sys.stdout.getvalue())
 
+    def test_list_job_table(self):
+        from expyre.helpers import JobTable
+        now = datetime(2026, 10, 17, 10, 0)
+        jobs = JobTable([JobSpec('1', '/path/to/last', now + timedelta(hours=2), ''),
+                         JobSpec('2', '/path/to/first', now, 'unless modified after 09:00 2026-10-17'),
+                         JobSpec('2', '/path/to/second', now, '')])
+        with mock.patch('expyre.__main__.get_scheduled_jobs', return_value=jobs):
+            main(['--list'])
+        self.assertEqual(sys.stdout.getvalue(),
+                         '/path/to/first scheduled to expire at 2026-10-17 10:00 '
+                         'unless modified after 09:00 2026-10-17\n'
+                         '/path/to/second scheduled to expire at 2026-10-17 10:00 \n'
+                         '/path/to/last scheduled to expire at 2026-10-17 12:00 \n')
+
     def test_correct_invocation_get_scheduled_jobs_with_prefix_no_jobs(self):
         with mock.patch('expyre.__main__.get_scheduled_jobs', return_value={}) as mocked:
             main(['--list-in', '/path'])
             self.assertTrue(mocked.called)
             self.assertSequenceEqual('No paths scheduled for expiry under /path\n', self.stdout.getvalue())
+
+    def test_correct_invocation_get_scheduled_jobs_workers(self):
+        with mock.patch('expyre.__main__.get_scheduled_jobs', return_value={}) as mocked:
+            main(['--workers', '8', '--list'])
+            mocked.assert_called_with('', workers=8)
+
+    def test_correct_invocation_remove_from_schedule_workers(self):
+        with mock.patch('expyre.__main__.remove_from_schedule', return_value=[['/path/to/file'], []]) as mocked:
+            main(['-w', '4', '--reset', '/path/to/file'])
+            mocked.assert_called_with(['/path/to/file'], workers=4)
+
+    def test_correct_invocation_remove_from_schedule_recursive(self):
+        with mock.patch('expyre.__main__.remove_from_schedule', return_value=[['/path/to/file'], []]) as mocked:
+            main(['-R', '--reset', '/path/to'])
+            mocked.assert_called_with(['/path/to'], recursive=True)
+            main(['-r', '--recursive', '/path/to', '/path/to/other'])
+            mocked.assert_called_with(['/path/to', '/path/to/other'], recursive=True)
+            main(['-r', '/path/to', '-R', '/path/to/other'])
+            mocked.assert_called_with(['/path/to', '/path/to/other'], recursive=True)
+
+    def test_recursive_without_reset(self):
+        with self.assertRaises(SystemExit):
+            main('--recursive --list'.split())
+        self.assert_('Conflicting options' in self.stderr.getvalue(), self.stderr.getvalue())
+
+    def test_correct_invocation_remove_from_schedule_from_file(self):
+        fd, filename = mkstemp()
+        with os.fdopen(fd, 'w') as listing:
+            listing.write('/path/to/file2\n\n/path/to/file 3\n')
+        try:
+            with mock.patch('expyre.__main__.remove_from_schedule', return_value=[['/path/to/file1'], []]) as mocked:
+                main(['-r', '/path/to/file1', '--from-file', filename])
+                mocked.assert_called_with(['/path/to/file1', '/path/to/file2', '/path/to/file 3'])
+        finally:
+            os.unlink(filename)
+
+    def test_correct_invocation_remove_from_schedule_from_stdin(self):
+        with mock.patch('expyre.__main__.remove_from_schedule', return_value=[['/path/to/file1'], []]) as mocked, \
+             mock.patch('sys.stdin', StringIO('/path/to/file1\n')):
+            main(['-r', '--from-file', '-'])
+            mocked.assert_called_with(['/path/to/file1'])
+
+    def test_unquoted_timespec_examples(self):
+        from expyre.__main__ import TIMESPEC_EXAMPLES
+        for timespec in TIMESPEC_EXAMPLES + ('noon tomorrow', 'now next week', 'now + 2 days'):
+            with mock.patch('expyre.helpers.at_submit', return_value=('1', datetime.now())) as at_submit, \
+                 mock.patch('expyre.helpers.pre_exec_check'):
+                self.assertEqual(main(['-p', '/path/to/file'] + ('@' + timespec).split()), 0, timespec)
+            self.assertEqual(at_submit.call_args[0][1], timespec)
+
+    def test_schedule_from_stdin(self):
+        import io
+        import json
+        now = datetime.now()
+
+        def expire_paths(paths, timespec, unless_modified, unless_accessed, batch_size, **options):
+            if '/path/to/c' in paths:
+                raise RuntimeError('Could not schedule')
+            return [JobSpec(str(i), path, now, '') for i, path in enumerate(paths)]
+
+        stdin = io.TextIOWrapper(io.BytesIO(b'/path/to/a\0/path/to/b\0/path/to/c'))
+        with mock.patch('expyre.__main__.expire_paths', side_effect=expire_paths) as mocked, \
+             mock.patch('sys.stdin', stdin):
+            ret = main('-m --from-stdin -0 --json --batch-size 2 @now + 1day'.split())
+        self.assertEqual(ret, -1)
+        self.assertEqual([call[0][:4] for call in mocked.call_args_list],
+                         [(['/path/to/a', '/path/to/b'], 'now + 1day', True, False),
+                          (['/path/to/c'], 'now + 1day', True, False)])
+        self.assertEqual([json.loads(line) for line in self.stdout.getvalue().splitlines()],
+                         [{'path': '/path/to/a', 'status': 'scheduled', 'job_id': '0',
+                           'timestamp': now.isoformat()},
+                          {'path': '/path/to/b', 'status': 'scheduled', 'job_id': '1',
+                           'timestamp': now.isoformat()},
+                          {'path': '/path/to/c', 'status': 'failed', 'error': 'Could not schedule'}])
+
+    def test_schedule_from_stdin_at_failure(self):
+        import io
+
+        def expire_paths(paths, *args, **kwargs):
+            if '/path/to/a' in paths:
+                raise subprocess.CalledProcessError(1, 'at', 'at: refusing to create job destined in the past')
+            return [JobSpec('1', path, datetime.now(), '') for path in paths]
+
+        stdin = io.TextIOWrapper(io.BytesIO(b'/path/to/a\n/path/to/b\n/path/to/c\n'))
+        with mock.patch('expyre.__main__.expire_paths', side_effect=expire_paths), \
+             mock.patch('sys.stdin', stdin):
+            ret = main('--from-stdin --batch-size 2 @now'.split())
+        self.assertEqual(ret, -1)
+        lines = self.stdout.getvalue().splitlines()
+        self.assertIn('/path/to/c will expire at', lines[0])
+        self.assertEqual(lines[1], 'Failed to schedule these paths for expiry:')
+        self.assertEqual([line.split(':')[0] for line in lines[2:]], ['/path/to/a', '/path/to/b'])
+
+    def test_schedule_from_stdin_invalid_path(self):
+        import io
+        import json
+
+        def expire_paths(paths, *args, **kwargs):
+            return [JobSpec('1', path, datetime.now(), '') for path in paths]
+
+        stdin = io.TextIOWrapper(io.BytesIO(b'/tmp/ok1\0/tmp/bad\nname\0/tmp/ok2'))
+        with mock.patch('expyre.__main__.expire_paths', side_effect=expire_paths) as mocked, \
+             mock.patch('sys.stdin', stdin):
+            ret = main('--from-stdin -0 --json @now'.split())
+        self.assertEqual(ret, -1)
+        mocked.assert_called_once()
+        self.assertEqual(mocked.call_args[0][0], ['/tmp/ok1', '/tmp/ok2'])
+        self.assertEqual([(entry['path'], entry['status'])
+                          for entry in map(json.loads, self.stdout.getvalue().splitlines())],
+                         [('/tmp/ok1', 'scheduled'), ('/tmp/ok2', 'scheduled'), ('/tmp/bad\nname', 'failed')])
+
+    def test_reset_from_stdin(self):
+        with mock.patch('expyre.__main__.remove_from_schedule',
+                        side_effect=[(['/path/to/a'], ['/path/to/b']), (['/path/to/c'], [])]) as mocked, \
+             mock.patch('sys.stdin', StringIO('/path/to/a\n/path/to/b\n\n/path/to/c\n')):
+            self.assertEqual(main('-r --from-stdin --batch-size 2'.split()), -1)
+        self.assertEqual(mocked.call_args_list, [mock.call(['/path/to/a', '/path/to/b']),
+                                                 mock.call(['/path/to/c'])])
+        self.assertEqual(self.stdout.getvalue(),
+                         'Successfully removed these paths from expiry list:\n/path/to/a\n/path/to/c\n'
+                         'Failed to remove these paths from expiry list:\n/path/to/b\n')
+
+    def test_null_requires_from_stdin(self):
+        with self.assertRaises(SystemExit):
+            main('-0 -p /path/to/file @now'.split())
+        with self.assertRaises(SystemExit):
+            main('--from-stdin --json -l'.split())
+
+    def test_reset_without_paths(self):
+        with self.assertRaises(SystemExit):
+            main(['-r'])
+        self.assert_('Missing path' in self.stderr.getvalue(), self.stderr.getvalue())
+
+    def test_correct_invocation_iter_scheduled_jobs_stream(self):
+        now = datetime.now()
+        jobs = [JobSpec(0, '/path/to/second', now, ''),
+                JobSpec(1, '/path/to/first', now - timedelta(hours=2), '')]
+        with mock.patch('expyre.__main__.iter_scheduled_jobs', return_value=iter(jobs)) as mocked:
+            main(['--list', '--stream'])
+            mocked.assert_called_with('')
+            self.assertSequenceEqual(
+                    ('/path/to/second scheduled to expire at {0:%F %R} \n'
+                     '/path/to/first scheduled to expire at {1:%F %R} \n').format(now, now - timedelta(hours=2)),
+                    sys.stdout.getvalue())
+
+    def test_correct_invocation_iter_scheduled_jobs_next(self):
+        now = datetime.now()
+        jobs = [JobSpec(i, '/path/to/file{}'.format(i), now + timedelta(hours=i), '') for i in (3, 1, 4, 2)]
+        with mock.patch('expyre.__main__.iter_scheduled_jobs', return_value=iter(jobs)):
+            main(['--list-in', '/path', '--next', '2'])
+            self.assertSequenceEqual(
+                    ('/path/to/file1 scheduled to expire at {0:%F %R} \n'
+                     '/path/to/file2 scheduled to expire at {1:%F %R} \n').format(now + timedelta(hours=1),
+                                                                                 now + timedelta(hours=2)),
+                    sys.stdout.getvalue())
+
+    def test_correct_invocation_iter_scheduled_jobs_stream_no_jobs(self):
+        with mock.patch('expyre.__main__.iter_scheduled_jobs', return_value=iter([])):
+            main(['--list', '--stream'])
+            self.assertSequenceEqual('No paths scheduled for expiry\n', self.stdout.getvalue())
+
+    def test_stream_without_list(self):
+        with self.assertRaises(SystemExit):
+            main('--stream -r /path/to/file'.split())
+        self.assert_('Conflicting options' in self.stderr.getvalue(), self.stderr.getvalue())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre import quota
+from expyre.quota import enforce_quota, parse_size, scan
+
+
+class TestQuota(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.now = time.time()
+        # - files used 1 to 4 days ago, the oldest first
+        self.paths = []
+        for days, name in enumerate(('sub/old', 'older', 'sub/deep/recent', 'newest'), 1):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fd:
+                fd.write('x' * 4096)
+            self.paths.append(path)
+        for days, path in zip((4, 3, 2, 1), self.paths):
+            os.utime(path, (self.now - days * 86400, self.now - (5 - days) * 86400))
+        self.sizes = dict((path, quota._usage(os.stat(path))) for path in self.paths)
+        self.total = sum(self.sizes.values())
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('4096'), 4096)
+        self.assertEqual(parse_size('500M'), 500 << 20)
+        self.assertEqual(parse_size('1.5G'), 3 << 29)
+        self.assertEqual(parse_size('2TiB'), 2 << 40)
+        self.assertRaises(ValueError, parse_size, 'lots')
+
+    def test_under_quota(self):
+        result = enforce_quota(self.root, self.total)
+        self.assertEqual(result, (self.total, [], 0, []))
+        self.assertTrue(all(os.path.exists(path) for path in self.paths))
+
+    def test_evicts_least_recently_accessed(self):
+        low_water = self.total - self.sizes[self.paths[0]] - self.sizes[self.paths[1]]
+        result = enforce_quota(self.root, self.total - 1, low_water)
+        self.assertEqual(result.evicted, self.paths[:2])
+        self.assertEqual(result.freed, self.total - low_water)
+        self.assertEqual([os.path.exists(path) for path in self.paths], [False, False, True, True])
+
+    def test_evicts_least_recently_modified(self):
+        result = enforce_quota(self.root, self.total - 1, 0, by='mtime', dry_run=True)
+        self.assertEqual(result.evicted, list(reversed(self.paths)))
+        self.assertTrue(all(os.path.exists(path) for path in self.paths))
+
+    def test_skips_files_used_since_the_scan(self):
+        scan_ = scan
+
+        def scan_then_access(directory, snapshot=None):
+            dirs = scan_(directory, snapshot)
+            os.utime(self.paths[0], None)
+            return dirs
+
+        snapshot_file = os.path.join(self.root, 'snapshot.json')
+        with mock.patch('expyre.quota.scan', side_effect=scan_then_access):
+            result = enforce_quota(self.root, self.total - 1, self.total - 1, snapshot_file=snapshot_file)
+        self.assertEqual(result.skipped, [self.paths[0]])
+        self.assertEqual(result.evicted, [self.paths[1]])
+        self.assertTrue(os.path.exists(self.paths[0]))
+        # - the snapshot holds the times of use of the skipped file
+        with open(snapshot_file) as fd:
+            _, atime, mtime = json.load(fd)['dirs']['sub'][1]['old']
+        stat = os.stat(self.paths[0])
+        self.assertEqual((atime, mtime), (stat.st_atime, stat.st_mtime))
+        os.unlink(snapshot_file)
+
+        with mock.patch('expyre.quota.scan', side_effect=scan_then_access):
+            result = enforce_quota(self.root, 0, 0, unless_accessed=False, unless_modified=False)
+        self.assertEqual(result.skipped, [])
+        self.assertFalse(os.path.exists(self.paths[0]))
+
+    def test_snapshot_only_lists_modified_directories(self):
+        snapshot_file = os.path.join(self.root, 'snapshot.json')
+        # - directories are not trusted in the second they are modified
+        for directory in ('', 'sub', 'sub/deep'):
+            os.utime(os.path.join(self.root, directory), (self.now - 60, self.now - 60))
+        enforce_quota(self.root, self.total * 2, snapshot_file=snapshot_file)
+        with open(snapshot_file) as fd:
+            self.assertEqual(set(json.load(fd)['dirs']), set(['', 'sub', 'sub/deep']))
+        os.utime(os.path.join(self.root, 'sub'), (self.now - 30, self.now - 30))
+
+        listed = []
+        scandir_ = quota.scandir
+
+        def scandir(path):
+            listed.append(os.path.relpath(path, self.root))
+            return scandir_(path)
+
+        with mock.patch('expyre.quota.scandir', side_effect=scandir):
+            result = enforce_quota(self.root, self.total - 1, 0, snapshot_file=snapshot_file,
+                                   dry_run=True)
+        # - the root was modified by writing the snapshot
+        self.assertEqual(sorted(listed), ['.', 'sub'])
+        self.assertEqual(result.usage, self.total + quota._usage(os.stat(snapshot_file)))
+        self.assertEqual(result.evicted[:4], self.paths)
+
+    def test_invalid_order(self):
+        self.assertRaises(ValueError, enforce_quota, self.root, 1, by='ctime')
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre.helpers import SpoolBackend, get_backend, get_scheduled_jobs
+
+from .test_index import make_script
+
+
+def spool_name(queue, job_id, timestamp):
+    minutes = int((timestamp - datetime.fromtimestamp(0)).total_seconds()) // 60
+    return '{}{:05x}{:08x}'.format(queue, job_id, minutes)
+
+
+class TestSpoolBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.spool = mkdtemp()
+        self.fallback = mock.Mock()
+        self.backend = SpoolBackend(self.spool, fallback=self.fallback)
+        self.when = datetime(2026, 10, 17, 10, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.spool)
+
+    def add_job(self, job_id, script, queue='a'):
+        with open(os.path.join(self.spool, spool_name(queue, job_id, self.when)), 'w') as fd:
+            fd.write(script)
+
+    def test_jobs(self):
+        self.add_job(1, make_script('/path/to/file'))
+        self.add_job(26, 'echo unrelated\n', queue='b')
+        with open(os.path.join(self.spool, '.SEQ'), 'w') as fd:
+            fd.write('1a\n')
+        jobs = sorted(self.backend.jobs())
+        self.assertEqual([(job.job_id, job.queue) for job in jobs], [('1', 'a'), ('26', 'b')])
+        self.assertEqual(jobs[0].timestamp, self.when)
+
+    def test_jobs_in_queue(self):
+        self.add_job(1, make_script('/path/to/file'), queue='e')
+        self.add_job(2, 'echo unrelated\n')
+        backend = SpoolBackend(self.spool, fallback=self.fallback, at_queue='e')
+        self.assertEqual([job.job_id for job in backend.jobs()], ['1'])
+
+    def test_script(self):
+        self.add_job(1, make_script('/path/to/file'))
+        self.assertEqual(self.backend.script('1'), make_script('/path/to/file'))
+        self.assertFalse(self.fallback.script.called)
+
+    def test_script_falls_back_when_missing(self):
+        self.fallback.script.return_value = 'from at'
+        self.assertEqual(self.backend.script('42'), 'from at')
+        self.fallback.script.assert_called_with('42')
+
+    def test_remove_uses_fallback(self):
+        self.backend.remove('1')
+        self.fallback.remove.assert_called_with('1')
+
+    def test_get_scheduled_jobs(self):
+        self.add_job(1, make_script('/path/to/file', 'unless modified after 10:00 2026-10-17'))
+        self.add_job(2, 'echo unrelated\n')
+        jobs = get_scheduled_jobs(use_index=False, backend=self.backend)
+        self.assertEqual(list(jobs), ['/path/to/file'])
+        self.assertEqual(jobs['/path/to/file'].job_id, '1')
+        self.assertEqual(jobs['/path/to/file'].timestamp, self.when)
+        self.assertEqual(jobs['/path/to/file'].conditions, 'unless modified after 10:00 2026-10-17')
+
+    def test_get_backend(self):
+        with mock.patch.dict(os.environ, {'EXPYRE_SPOOL': self.spool}):
+            self.assertIsInstance(get_backend(), SpoolBackend)
+        with mock.patch.dict(os.environ, {'EXPYRE_SPOOL': os.path.join(self.spool, 'missing')}):
+            self.assertEqual(get_backend().name, 'at')
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import errno
+import json
+import os
+import shutil
+import time
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from tempfile import mkdtemp
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre.helpers import JobSpec, _scan_dir
+from expyre.sweep import Policy, parse_duration, parse_policy, sweep
+
+
+class TestPolicies(unittest.TestCase):
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('90'), 90)
+        self.assertEqual(parse_duration('30m'), 1800)
+        self.assertEqual(parse_duration('2d'), 172800)
+        self.assertEqual(parse_duration('1.5h'), 5400)
+        self.assertRaises(ValueError, parse_duration, '2 fortnights')
+
+    def test_parse_policy(self):
+        self.assertEqual(parse_policy('f:*.tmp:2d'), Policy('f', '*.tmp', 172800, ('mtime',)))
+        self.assertEqual(parse_policy('dir::7d:atime,mtime'), Policy('d', '*', 604800, ('atime', 'mtime')))
+        self.assertRaises(ValueError, parse_policy, 'x:*:1d')
+        self.assertRaises(ValueError, parse_policy, 'd:*:1d:ctime')
+        self.assertRaises(ValueError, parse_policy, 'f:*.tmp')
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.old = time.time() - 3 * 86400
+        for path in ('a.tmp', 'b.txt', 'one/c.tmp', 'one/d.tmp', 'one/deep/e.tmp',
+                     'two/f.tmp', 'two/g.log', 'build/x/y.o', 'build/z.o'):
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+            os.utime(path, (self.old, self.old))
+        for root, dirs, files in list(os.walk(self.root)):
+            os.utime(root, (self.old, self.old))
+        # - one/d.tmp is recent
+        os.utime(os.path.join(self.root, 'one', 'd.tmp'), None)
+        self.policies = ['d:build:2d', 'f:*.tmp:2d']
+        self.expected = ['a.tmp', 'build', 'one/c.tmp', 'one/deep/e.tmp', 'two/f.tmp']
+
+    def relative(self, paths):
+        return sorted(os.path.relpath(path, self.root) for path in paths)
+
+    def test_dry_run(self):
+        matched = []
+        result = sweep(self.root, self.policies, dry_run=True, on_match=lambda path, policy: matched.append(path))
+        self.assertEqual(self.relative(matched), self.expected)
+        self.assertEqual(result.matched, 5)
+        self.assertEqual(result.failed, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'a.tmp')))
+
+    def test_directory_with_recent_file_does_not_match(self):
+        os.utime(os.path.join(self.root, 'build', 'x', 'y.o'), None)
+        matched = []
+        sweep(self.root, self.policies, dry_run=True, on_match=lambda path, policy: matched.append(path))
+        self.assertNotIn('build', self.relative(matched))
+
+    def test_directory_policy_scans_each_directory_once(self):
+        # - the times under a directory are found by the walk checking its
+        # parent, rather than by walking its subtree again
+        deep = os.path.join(self.root, 'one', 'deep', 'er', 'est')
+        os.makedirs(deep)
+        open(os.path.join(deep, 'recent'), 'w').close()
+        os.utime(os.path.join(self.root, 'one', 'd.tmp'), (self.old, self.old))
+        while deep != self.root:
+            os.utime(deep, (self.old, self.old))
+            deep = os.path.dirname(deep)
+        scanned = []
+
+        def scan_dir(directory):
+            scanned.append(directory)
+            return _scan_dir(directory)
+
+        matched = []
+        with mock.patch('expyre.sweep._scan_dir', side_effect=scan_dir), \
+                mock.patch('expyre.helpers._scan_dir', side_effect=scan_dir):
+            sweep(self.root, ['d::2d:mtime'], dry_run=True, on_match=lambda path, policy: matched.append(path))
+        self.assertEqual(self.relative(matched), ['build', 'two'])
+        self.assertEqual(sorted(scanned), sorted(set(scanned)))
+
+    def test_delete(self):
+        result = sweep(self.root, self.policies, action='delete', workers=4)
+        self.assertEqual(result.matched, 5)
+        remaining = self.relative(os.path.join(root, name) for root, dirs, files in os.walk(self.root)
+                                  for name in files)
+        self.assertEqual(remaining, ['b.txt', 'one/d.tmp', 'two/g.log'])
+
+    def test_delete_failure(self):
+        unlink = os.unlink
+
+        def failing_unlink(path):
+            if path.endswith('e.tmp'):
+                raise OSError(errno.EACCES, 'Permission denied', path)
+            unlink(path)
+
+        with mock.patch('os.unlink', side_effect=failing_unlink):
+            result = sweep(self.root, self.policies, action='delete')
+        self.assertEqual((result.matched, result.failed), (5, 1))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'one', 'deep', 'e.tmp')))
+
+    def test_schedule_in_batches(self):
+        scheduled = []
+
+        def expire_paths(paths, timespec, unless_modified=True, unless_accessed=True, batch_size=1000, **options):
+            scheduled.append((list(paths), timespec, unless_modified, unless_accessed))
+            return [JobSpec(str(len(scheduled)), path, datetime.now(), '') for path in paths]
+
+        before = (datetime.now() + timedelta(days=1)).strftime('%R %F')
+        with mock.patch('expyre.helpers.expire_paths', side_effect=expire_paths):
+            result = sweep(self.root, self.policies, timespec='now + 1day', workers=2, unless_accessed=False)
+        after = (datetime.now() + timedelta(days=1)).strftime('%R %F')
+        self.assertEqual(result, (result.scanned, 5, 0))
+        self.assertEqual(len(scheduled), 1)
+        self.assertEqual(self.relative(scheduled[0][0]), self.expected)
+        # - the batch is scheduled at the minute the timespec resolved to
+        # when the paths were found, not when it is due
+        self.assertIn(scheduled[0][1], (before, after))
+        self.assertEqual(scheduled[0][2:], (True, False))
+
+    def test_resume(self):
+        state_file = os.path.join(self.root, 'state.json')
+        deleted = []
+
+        def fail_on_deep(path):
+            if path.endswith('e.tmp'):
+                raise KeyboardInterrupt()
+            deleted.append(path)
+
+        with mock.patch('expyre.sweep.reap', side_effect=fail_on_deep):
+            self.assertRaises(KeyboardInterrupt, sweep, self.root, self.policies, action='delete',
+                              state_file=state_file, checkpoint=1)
+            with open(state_file) as fd:
+                state = json.load(fd)
+            self.assertEqual(sorted(state['done']), ['', 'build'])
+
+            deleted[:] = []
+            with mock.patch('expyre.sweep.reap', side_effect=deleted.append):
+                sweep(self.root, self.policies, action='delete', state_file=state_file, checkpoint=1)
+        self.assertEqual(self.relative(deleted), ['one/deep/e.tmp', 'two/f.tmp'])
+        self.assertFalse(os.path.exists(state_file))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import calendar
+import unittest
+from datetime import datetime, timedelta
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from expyre import timespec
+from expyre.__main__ import TIMESPEC_EXAMPLES
+from expyre.timespec import parse_at_time, parse_timespec
+
+# - a Saturday
+NOW = datetime(2026, 10, 17, 10, 30, 15)
+
+CORPUS = (
+    ('now', datetime(2026, 10, 17, 10, 30)),
+    ('NOW', datetime(2026, 10, 17, 10, 30)),
+    ('now+2days', datetime(2026, 10, 19, 10, 30)),
+    ('now + 2 days', datetime(2026, 10, 19, 10, 30)),
+    ('now + 1 hour', datetime(2026, 10, 17, 11, 30)),
+    ('now + 90 minutes', datetime(2026, 10, 17, 12, 0)),
+    ('now + 5 min', datetime(2026, 10, 17, 10, 35)),
+    ('now + 1 week', datetime(2026, 10, 24, 10, 30)),
+    ('now + 1 month', datetime(2026, 11, 17, 10, 30)),
+    ('now + 1 year', datetime(2027, 10, 17, 10, 30)),
+    ('now next day', datetime(2026, 10, 18, 10, 30)),
+    ('now + 1 hour + 30 minutes', datetime(2026, 10, 17, 12, 0)),
+    ('18:00', datetime(2026, 10, 17, 18, 0)),
+    ('9:00', datetime(2026, 10, 18, 9, 0)),
+    ('10:30', datetime(2026, 10, 17, 10, 30)),
+    ('1830', datetime(2026, 10, 17, 18, 30)),
+    ('5pm', datetime(2026, 10, 17, 17, 0)),
+    ('9am', datetime(2026, 10, 18, 9, 0)),
+    ('9 a.m.', datetime(2026, 10, 18, 9, 0)),
+    ('11:45pm', datetime(2026, 10, 17, 23, 45)),
+    ('12am', datetime(2026, 10, 18, 0, 0)),
+    ('12pm', datetime(2026, 10, 17, 12, 0)),
+    ('noon', datetime(2026, 10, 17, 12, 0)),
+    ('midnight', datetime(2026, 10, 18, 0, 0)),
+    ('teatime', datetime(2026, 10, 17, 16, 0)),
+    ('today', datetime(2026, 10, 17, 10, 30)),
+    ('tomorrow', datetime(2026, 10, 18, 10, 30)),
+    ('18:00 tomorrow', datetime(2026, 10, 18, 18, 0)),
+    ('tomorrow 18:00', datetime(2026, 10, 18, 18, 0)),
+    ('9am today', datetime(2026, 10, 17, 9, 0)),
+    ('18:00 2017-12-31', datetime(2017, 12, 31, 18, 0)),
+    ('5pm Friday', datetime(2026, 10, 23, 17, 0)),
+    ('saturday', datetime(2026, 10, 17, 10, 30)),
+    ('sun', datetime(2026, 10, 18, 10, 30)),
+    ('oct 20', datetime(2026, 10, 20, 10, 30)),
+    ('jan 2', datetime(2027, 1, 2, 10, 30)),
+    ('feb 29', datetime(2028, 2, 29, 10, 30)),
+    ('december 31, 2026', datetime(2026, 12, 31, 10, 30)),
+    ('noon dec 31 2026', datetime(2026, 12, 31, 12, 0)),
+    ('20 oct 2026', datetime(2026, 10, 20, 10, 30)),
+    ('10/20/2026', datetime(2026, 10, 20, 10, 30)),
+    ('10/20/26', datetime(2026, 10, 20, 10, 30)),
+    ('20.10.2026', datetime(2026, 10, 20, 10, 30)),
+    ('102026', datetime(2026, 10, 20, 10, 30)),
+    ('10202026', datetime(2026, 10, 20, 10, 30)),
+    ('4pm + 3 days', datetime(2026, 10, 20, 16, 0)),
+    ('18:00 tomorrow - 1 hour', datetime(2026, 10, 18, 17, 0)),
+    ('teatime next week', datetime(2026, 10, 24, 16, 0)),
+)
+
+GARBLED = ('', 'invalid', 'now+1hr', 'now + 2 fortnights', 'now + 30 seconds', 'now +', 'next week',
+           '25:00', '13pm', '0am', '18:61', 'feb 30', 'oct', '2026-13-01', 'tea time', '18:00 tomorrow tomorrow')
+
+
+class TestParseTimespec(unittest.TestCase):
+
+    def test_corpus(self):
+        for spec, expected in CORPUS:
+            self.assertEqual(parse_timespec(spec, NOW), expected, spec)
+
+    def test_garbled(self):
+        for spec in GARBLED:
+            self.assertRaises(ValueError, parse_timespec, spec, NOW)
+
+    def test_epilog_examples(self):
+        for spec in TIMESPEC_EXAMPLES:
+            self.assertIn(spec, [spec for spec, _ in CORPUS])
+            parse_timespec(spec)
+
+    def test_seconds(self):
+        self.assertEqual(parse_timespec('now', NOW, seconds=True), NOW)
+        self.assertEqual(parse_timespec('now + 30 seconds', NOW, seconds=True), NOW + timedelta(seconds=30))
+
+    def test_epoch(self):
+        epoch = timespec.to_epoch(NOW)
+        self.assertEqual(parse_timespec('now + 1 day', epoch), datetime(2026, 10, 18, 10, 30))
+
+    def test_utc(self):
+        utc_now = datetime.utcfromtimestamp(timespec.to_epoch(NOW.replace(second=0)))
+        expected = utc_now.replace(hour=10, minute=0)
+        if expected < utc_now:
+            expected += timedelta(days=1)
+        self.assertEqual(parse_timespec('10:00 utc', NOW),
+                         datetime.fromtimestamp(calendar.timegm(expected.timetuple())))
+
+
+class TestParseAtTime(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(parse_at_time('Sat Oct 17 10:00:00 2026'), datetime(2026, 10, 17, 10, 0))
+        self.assertEqual(parse_at_time('Wed Oct  7 09:05:00 2026'), datetime(2026, 10, 7, 9, 5))
+        self.assertEqual(parse_at_time('2026-10-17 10:00'), datetime(2026, 10, 17, 10, 0))
+        self.assertRaises(ValueError, parse_at_time, 'the day after')
+
+    def test_at_time_of_other_locale(self):
+        # - a month name of another language is parsed in the current locale
+        parsed = []
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def strptime(cls, text, fmt):
+                parsed.append((text, fmt))
+                return datetime(2026, 1, 17, 10, 0)
+
+        with mock.patch('expyre.timespec.datetime', FakeDatetime):
+            self.assertEqual(parse_at_time('sab ene 17 10:00:00 2026'), datetime(2026, 1, 17, 10, 0))
+        self.assertEqual(parsed, [('sab ene 17 10:00:00 2026', '%c')])
+        self.assertRaises(ValueError, parse_at_time, 'Sat Foo 17 10:00:00 2026')
+
+    def test_cached(self):
+        parse_at_time('Sat Oct 17 11:00:00 2026')
+        with mock.patch('expyre.timespec.AT_TIME_RE') as regex:
+            self.assertEqual(parse_at_time('Sat Oct 17 11:00:00 2026'), datetime(2026, 10, 17, 11, 0))
+            self.assertFalse(regex.match.called)